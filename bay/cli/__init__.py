@@ -1,6 +1,5 @@
 import click
 import collections
-import pkg_resources
 import sys
 import os
 import traceback
@@ -9,12 +8,14 @@ import attr
 from .alias_group import SpellcheckableAliasableGroup
 from .colors import PURPLE, RED
 from .tasks import RootTask
+from .timings import Timings
 from ..config import Config
 from ..constants import PluginHook
-from ..docker.hosts import HostManager
 from ..exceptions import DockerNotAvailableError
 from ..containers.graph import ContainerGraph
 from ..containers.profile import NullProfile, Profile
+from ..plugins.manifest import PluginEntryPoint, PluginManifest
+from ..utils.functional import cached_property
 from ..utils.sorting import dependency_sort
 
 
@@ -32,56 +33,191 @@ class App(object):
     """
     cli = attr.ib()
     plugins = attr.ib(default=attr.Factory(dict), init=False)
+    timings = attr.ib(default=attr.Factory(Timings), init=False, repr=False)
+    containers = attr.ib(default=None, init=False, repr=False)
+
+    # Cache of what each plugin registers, so plugins can be imported lazily
+    plugin_manifest_path = os.path.expanduser("~/.bay/plugin_manifest.json")
 
     def load_config(self, config_paths):
-        self.config = Config(config_paths)
-        self.hosts = HostManager.from_config(self.config)
-        self.containers = ContainerGraph(self.config["bay"]["home"])
-        self.root_task = RootTask()
+        """
+        Loads configuration and the container graph. A graph that is already
+        loaded (as it is in the daemon) is kept if nothing on disk has changed.
+        """
+        with self.timings.phase("load_config"):
+            with self.timings.phase("config"):
+                self.config = Config(config_paths)
+            with self.timings.phase("graph"):
+                if not (
+                    self.containers is not None and
+                    self.containers.path == os.path.abspath(self.config["bay"]["home"]) and
+                    self.containers.is_current()
+                ):
+                    self.containers = ContainerGraph(
+                        self.config["bay"]["home"],
+                        snapshot_path=self.config["bay"]["graph_snapshot_path"],
+                    )
+            self.root_task = RootTask()
+
+    @cached_property
+    def hosts(self):
+        """
+        The configured Docker hosts. Made on first use so that commands that
+        never talk to Docker do not import it.
+        """
+        from ..docker.hosts import HostManager
+        return HostManager.from_config(self.config)
+
+    @cached_property
+    def formations(self):
+        """
+        Cache of the formations running on each host, shared by everything
+        in this invocation.
+        """
+        from ..docker.introspect import FormationCache
+        return FormationCache(self)
 
     def load_plugins(self):
         """
-        Loads all plugins defined in config
+        Finds all plugins defined by entrypoints and registers their commands.
+
+        Plugin modules are only imported when something needs them - one of
+        their commands is run, or a hook or catalog they add to is used. This
+        relies on a cached manifest of what each plugin registers; if it is
+        missing or out of date, every plugin is imported and loaded up front
+        to rebuild it.
         """
+        with self.timings.phase("load_plugins"):
+            self._load_plugins()
+
+    def _load_plugins(self):
         self.hooks = {}
         self.catalog = {}
-        # Load plugin classes based on entrypoints
-        plugins = []
-        for entrypoint in pkg_resources.iter_entry_points("bay.plugins"):
-            try:
-                plugin = entrypoint.load()
-                plugins.append(plugin)
-            except ImportError:
-                click.echo(PURPLE("Failed to import plugin: {name}".format(name=entrypoint.name)), err=True)
-                click.echo(PURPLE(traceback.format_exc()), err=True)
-                sys.exit(1)
+        self.loaded_plugins = set()
+        self.loading_plugin = None
+        self.entrypoints = collections.OrderedDict(
+            (entrypoint.name, entrypoint)
+            for entrypoint in PluginEntryPoint.find_all("bay.plugins")
+        )
+        self.manifest = PluginManifest(self.plugin_manifest_path)
+        if self.manifest.load(PluginManifest.key_for(self.entrypoints.values())):
+            self.resolve_plugin_order()
+            # Register placeholder commands and aliases for every plugin
+            for name in self.plugin_order:
+                for command_name, short_help in self.manifest.entries[name]["commands"].items():
+                    self.cli.add_command(PluginCommandStub(command_name, name, short_help))
+            for name in self.plugin_order:
+                for alias, command_name in self.manifest.entries[name]["aliases"].items():
+                    self.cli.add_alias(self.cli.commands[command_name], alias)
+        else:
+            # Import everything, recording what each plugin provides/requires
+            for name in self.entrypoints:
+                self.manifest.add_plugin(name, self.entrypoints[name], self.import_plugin(name))
+            self.resolve_plugin_order()
+            for name in self.plugin_order:
+                self.load_plugin(name)
+            self.manifest.save()
+
+    def resolve_plugin_order(self):
+        """
+        Checks plugin provides/requires are satisfied and works out the order
+        plugins should load in.
+        """
         # Build plugin provides
-        provided = {}
-        for plugin in plugins:
-            for p in plugin.provides:
+        self.plugin_providers = {}
+        for name, entry in sorted(self.manifest.entries.items()):
+            for p in entry["provides"]:
                 # Make sure another plugin does not provide this
-                if p in provided:
+                if p in self.plugin_providers:
                     click.echo(PURPLE("Multiple plugins provide {}, please unload one.".format(p)))
                     sys.exit(1)
-                provided[p] = plugin
+                self.plugin_providers[p] = name
         # Check plugin requires
-        for plugin in plugins:
-            for r in plugin.requires:
-                if r not in provided:
-                    click.echo(PURPLE("Plugin {} requires {}, but nothing provides it.".format(plugin, r)))
+        for name, entry in sorted(self.manifest.entries.items()):
+            for r in entry["requires"]:
+                if r not in self.plugin_providers:
+                    click.echo(PURPLE("Plugin {} requires {}, but nothing provides it.".format(name, r)))
                     sys.exit(1)
         # Sort plugins by dependency order, and then alphabetically inside that
-        plugins = dependency_sort(plugins, lambda x: [provided[r] for r in x.requires])
-        # Load plugins
-        for plugin in plugins:
-            # We store plugins so you can look their instances up by class
-            self.plugins[plugin] = instance = plugin(self)
-            instance.load()
+        self.plugin_order = dependency_sort(
+            sorted(self.manifest.entries),
+            lambda name: [self.plugin_providers[r] for r in self.manifest.entries[name]["requires"]],
+        )
+
+    def import_plugin(self, name):
+        """
+        Imports the plugin class for the named entrypoint.
+        """
+        try:
+            return self.entrypoints[name].load()
+        except ImportError:
+            click.echo(PURPLE("Failed to import plugin: {name}".format(name=name)), err=True)
+            click.echo(PURPLE(traceback.format_exc()), err=True)
+            sys.exit(1)
+
+    def load_plugin(self, name):
+        """
+        Imports and loads the named plugin if it has not been already, along
+        with the plugins it requires and any whose catalogs it adds to.
+        """
+        if name in self.loaded_plugins:
+            return
+        self.loaded_plugins.add(name)
+        entry = self.manifest.entries[name]
+        dependencies = [self.plugin_providers[r] for r in entry["requires"]]
+        for dependency in dependencies + self.manifest.catalog_type_owners(name):
+            self.load_plugin(dependency)
+        with self.timings.phase("plugin {}".format(name)):
+            plugin = self.import_plugin(name)
+            previous_plugin, self.loading_plugin = self.loading_plugin, name
+            try:
+                # We store plugins so you can look their instances up by class
+                self.plugins[plugin] = instance = plugin(self)
+                instance.load()
+            finally:
+                self.loading_plugin = previous_plugin
+
+    def load_all_plugins(self):
+        """
+        Loads every plugin that is not loaded yet. Used when the manifest
+        turns out to be out of date; it is removed so the next run rebuilds it.
+        """
+        self.manifest.invalidate()
+        for name in self.plugin_order:
+            self.load_plugin(name)
+
+    def load_plugins_named(self, names):
+        """
+        Loads the given plugins in plugin order.
+        """
+        for name in self.plugin_order:
+            if name in names:
+                self.load_plugin(name)
+
+    def add_command(self, command):
+        """
+        Adds a command to the CLI, recording it against the loading plugin.
+        """
+        self.cli.add_command(command)
+        if self.loading_plugin is not None:
+            self.manifest.record_command(self.loading_plugin, command)
+
+    def add_alias(self, command, alias):
+        """
+        Aliases a command on the CLI, recording it against the loading plugin.
+        """
+        self.cli.add_alias(command, alias)
+        if self.loading_plugin is not None:
+            self.manifest.record_alias(self.loading_plugin, command.name, alias)
 
     def load_profiles(self):
         """
         Loads the current profile stack
         """
+        with self.timings.phase("load_profiles"):
+            self._load_profiles()
+
+    def _load_profiles(self):
         user_profile_path = os.path.join(
             self.config["bay"]["user_profile_home"],
             self.containers.prefix,
@@ -112,7 +248,13 @@ class App(object):
         """
         if hook_type not in PluginHook.valid_hooks:
             raise ValueError("Invalid hook type {}".format(hook_type))
-        self.hooks.setdefault(hook_type, []).append(receiver)
+        # Hooks run in plugin order, whatever order their plugins were loaded in
+        if self.loading_plugin is not None:
+            position = self.plugin_order.index(self.loading_plugin)
+            self.manifest.record_hook(self.loading_plugin, hook_type)
+        else:
+            position = len(self.plugin_order)
+        self.hooks.setdefault(hook_type, []).append((position, receiver))
 
     def run_hooks(self, hook_type, **kwargs):
         """
@@ -120,8 +262,9 @@ class App(object):
 
         Returns True if at least one hook ran, False otherwise.
         """
-        hooks = self.hooks.get(hook_type, [])
-        for hook in hooks:
+        self.load_plugins_named(self.manifest.plugins_with_hook(hook_type))
+        hooks = sorted(self.hooks.get(hook_type, []), key=lambda hook: hook[0])
+        for _, hook in hooks:
             hook(**kwargs)
         return bool(hooks)
 
@@ -132,6 +275,8 @@ class App(object):
         if name in self.catalog:
             raise ValueError("Catalog type {} already registered".format(name))
         self.catalog[name] = collections.OrderedDict()
+        if self.loading_plugin is not None:
+            self.manifest.record_catalog_type(self.loading_plugin, name)
 
     def add_catalog_item(self, type_name, name, value):
         """
@@ -142,8 +287,11 @@ class App(object):
         if name in self.catalog[type_name]:
             raise ValueError("Catalog item {}/{} already registered".format(type_name, name))
         self.catalog[type_name][name] = value
+        if self.loading_plugin is not None:
+            self.manifest.record_catalog_item(self.loading_plugin, type_name, name)
 
     def get_catalog_items(self, type_name):
+        self.load_plugins_named(self.manifest.plugins_with_catalog(type_name))
         if type_name not in self.catalog:
             raise ValueError("Catalog type {} does not exist".format(type_name))
         return self.catalog[type_name]
@@ -152,6 +300,10 @@ class App(object):
         """
         Given a plugin's class, returns the instance of it we have loaded.
         """
+        if klass not in self.plugins:
+            name = self.manifest.plugin_for_class(klass)
+            if name is not None:
+                self.load_plugin(name)
         return self.plugins[klass]
 
     def invoke(self, command_name, **kwargs):
@@ -163,39 +315,115 @@ class App(object):
         context.invoke(command, **kwargs)
 
 
+class PluginCommandStub(click.Command):
+    """
+    Placeholder for a command whose plugin has not been imported yet. It has
+    just enough information to be listed in help.
+    """
+
+    def __init__(self, name, plugin_name, short_help):
+        super(PluginCommandStub, self).__init__(name, short_help=short_help)
+        self.plugin_name = plugin_name
+
+
 class AppGroup(SpellcheckableAliasableGroup):
     """
     Group subclass that instantiates an App instance when called, loads
     plugins, and passes the app as the context obj.
+
+    Plugins are loaded when the CLI is first used rather than when it is
+    made, as that happens on import of bay.cli - which plugin modules
+    themselves import, and they cannot be loaded while half-imported.
     """
 
     def __init__(self, app_class, **kwargs):
         super(AppGroup, self).__init__(**kwargs)
+        self.listing_commands = False
+        # Turned off inside the daemon, which runs forwarded commands itself
+        self.forward_to_daemon = True
+        self.plugins_loaded = False
         self.app = app_class(self)
-        self.app.load_plugins()
+
+    def load_plugins(self):
+        """
+        Loads plugins if they have not been already.
+        """
+        if not self.plugins_loaded:
+            self.plugins_loaded = True
+            self.app.load_plugins()
+
+    def list_commands(self, ctx):
+        self.load_plugins()
+        return super(AppGroup, self).list_commands(ctx)
+
+    def get_command(self, ctx, cmd_name):
+        """
+        Resolves placeholder commands by loading their plugin, unless we are
+        just listing commands for help.
+        """
+        self.load_plugins()
+        command = super(AppGroup, self).get_command(ctx, cmd_name)
+        if isinstance(command, PluginCommandStub) and not self.listing_commands:
+            self.app.load_plugin(command.plugin_name)
+            command = super(AppGroup, self).get_command(ctx, cmd_name)
+            if isinstance(command, PluginCommandStub):
+                # The manifest is out of date; fall back to loading everything
+                self.app.load_all_plugins()
+                command = super(AppGroup, self).get_command(ctx, cmd_name)
+                if isinstance(command, PluginCommandStub):
+                    # No plugin registers it any more
+                    self.commands.pop(command.name, None)
+                    for alias, target in list(self.aliases.items()):
+                        if target is command:
+                            del self.aliases[alias]
+                    return None
+        return command
+
+    def format_commands(self, ctx, formatter):
+        # Help output only needs the short help the placeholders already have
+        self.listing_commands = True
+        try:
+            super(AppGroup, self).format_commands(ctx, formatter)
+        finally:
+            self.listing_commands = False
 
     def invoke(self, ctx):
         ctx.obj = self.app
-        return super(AppGroup, self).invoke(ctx)
+        with self.app.timings.phase(" ".join(["command"] + ctx.protected_args)):
+            return super(AppGroup, self).invoke(ctx)
 
-    def main(self, *args, **kwargs):
+    def main(self, args=None, *rest, **kwargs):
+        # Hand the command to a running daemon if there is one
+        if self.forward_to_daemon:
+            from .daemon import DaemonClient
+            exit_code = DaemonClient.forward(sys.argv[1:] if args is None else args)
+            if exit_code is not None:
+                sys.exit(exit_code)
+        self.load_plugins()
         try:
-            return super(AppGroup, self).main(*args, **kwargs)
+            return super(AppGroup, self).main(args, *rest, **kwargs)
         except DockerNotAvailableError as e:
             # Run the failure hooks, printing a default error if nothing is hooked in
             if not self.app.run_hooks(PluginHook.DOCKER_FAILURE):
                 click.echo(RED(str(e)))
             sys.exit(1)
+        finally:
+            self.app.timings.report()
 
 
 @click.command(cls=AppGroup, app_class=App)
 @click.option('-c', '--config', multiple=True)
+@click.option('--timings', is_flag=True, envvar="BAY_TIMINGS", help="Print a breakdown of where time was spent.")
+@click.option('--timings-json', envvar="BAY_TIMINGS_JSON", type=click.Path(dir_okay=False, writable=True),
+              help="Write the time breakdown to this file as JSON.")
 @click.version_option()
 @click.pass_obj
-def cli(app, config):
+def cli(app, config, timings, timings_json):
     """
     Bay, the Docker-based development environment management tool.
     """
+    app.timings.enabled = timings
+    app.timings.json_path = timings_json
     # Load config based on CLI parameters
     app.load_config(config)
     app.load_profiles()
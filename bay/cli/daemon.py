@@ -0,0 +1,415 @@
+import array
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import threading
+import traceback
+
+import attr
+import click
+import yaml
+
+from .timings import Timings
+from ..config import Config
+from ..exceptions import BadConfigError, DockerNotAvailableError
+
+
+# Commands that are handed to a running daemon. Anything that needs to be in
+# the terminal's foreground process group (like `shell` and `attach`, which
+# resize the PTY on SIGWINCH) always runs in-process, and the daemon refuses
+# commands that would launch a foreground container for the same reason.
+FORWARDED_COMMANDS = {"ps", "run", "start", "stop", "restart", "hup", "up", "tail"}
+
+# Environment variables the daemon's warm state depends on; a client with
+# different values is refused and runs the command itself.
+PINNED_ENVIRONMENT = ["BAY_HOME", "DOCKER_HOST", "DOCKER_CERT_PATH", "DOCKER_TLS_VERIFY"]
+
+
+def socket_path():
+    """
+    Returns the path of the daemon socket. It does not depend on any config,
+    so a client can tell there is no daemon without loading any.
+    """
+    return os.environ.get("BAY_DAEMON_SOCKET") or os.path.expanduser("~/.bay/daemon.sock")
+
+
+def send_message(conn, message, fds=()):
+    """
+    Sends a length-prefixed JSON message, optionally passing file descriptors along with it.
+    """
+    data = json.dumps(message).encode("utf8")
+    data = struct.pack("!I", len(data)) + data
+    ancillary = []
+    if fds:
+        ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))]
+    sent = conn.sendmsg([data], ancillary)
+    if sent < len(data):
+        conn.sendall(data[sent:])
+
+
+def receive_message(conn, max_fds=3):
+    """
+    Receives a message sent by send_message. Returns (message, fds); message
+    is None if the connection closed first.
+    """
+    fds = array.array("i")
+    data, ancillary, _, _ = conn.recvmsg(4096, socket.CMSG_SPACE(max_fds * fds.itemsize))
+    for level, kind, fd_data in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(fd_data[:len(fd_data) - (len(fd_data) % fds.itemsize)])
+    if len(data) < 4:
+        return None, list(fds)
+    length = struct.unpack("!I", data[:4])[0]
+    data = data[4:]
+    while len(data) < length:
+        chunk = conn.recv(length - len(data))
+        if not chunk:
+            return None, list(fds)
+        data += chunk
+    return json.loads(data.decode("utf8")), list(fds)
+
+
+@attr.s
+class DaemonClient:
+    """
+    Talks to a running daemon over its unix socket.
+    """
+    path = attr.ib()
+
+    @classmethod
+    def forward(cls, args):
+        """
+        Runs the command line on a daemon if one is running and it agrees to
+        run it. Returns the exit code, or None if the command should run
+        in-process instead.
+
+        This is on every command's startup path, so it only looks for the
+        socket; the daemon parses the command line and resolves its config.
+        """
+        if os.environ.get("BAY_NO_DAEMON"):
+            return None
+        path = socket_path()
+        if not os.path.exists(path):
+            return None
+        return cls(path).run(args)
+
+    def connect(self):
+        """
+        Returns a connected socket, or None if no daemon is listening.
+        """
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.path)
+        except OSError:
+            conn.close()
+            return None
+        return conn
+
+    def run(self, args):
+        """
+        Sends the command line and our stdin/stdout/stderr to the daemon and
+        waits for the command to finish.
+        """
+        try:
+            fds = [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()]
+        except (AttributeError, ValueError, OSError):
+            # Not attached to real files (e.g. captured output)
+            return None
+        conn = self.connect()
+        if conn is None:
+            return None
+        try:
+            send_message(
+                conn,
+                {
+                    "argv": list(args),
+                    "cwd": os.getcwd(),
+                    "env": dict(os.environ),
+                },
+                fds=fds,
+            )
+            reply, _ = receive_message(conn)
+        except KeyboardInterrupt:
+            # Closing the connection tells the daemon to interrupt the command
+            return 130
+        except OSError:
+            return None
+        finally:
+            conn.close()
+        if reply is None or "exit" not in reply:
+            return None
+        return reply["exit"]
+
+    def control(self, action):
+        """
+        Sends a control message ("status" or "stop"). Returns the reply, or
+        None if no daemon is running.
+        """
+        conn = self.connect()
+        if conn is None:
+            return None
+        try:
+            send_message(conn, {"control": action})
+            reply, _ = receive_message(conn)
+        except OSError:
+            return None
+        finally:
+            conn.close()
+        return reply
+
+
+@attr.s
+class DaemonServer:
+    """
+    Long-lived process that keeps an App warm - plugins imported, the
+    container graph loaded, the Docker API version negotiated, and the
+    formation running on each host cached and kept current from its events -
+    and runs forwarded commands in forked copies of itself.
+
+    Forking gives each command its own copy of that state, so it can apply
+    profiles and open Docker connections without affecting other commands
+    or the daemon. The client passes its stdin/stdout/stderr over the socket,
+    and the command's output goes straight to them.
+    """
+    app = attr.ib()
+    path = attr.ib()
+    listener = attr.ib(default=None, init=False, repr=False)
+    running = attr.ib(default=False, init=False)
+    environment = attr.ib(default=attr.Factory(dict), init=False, repr=False)
+
+    def warm(self):
+        """
+        Loads everything commands are going to need up front.
+        """
+        self.app.load_plugins_named(self.app.plugin_order)
+        # Profiles change the graph, so load a fresh one no profile has been applied to
+        self.app.containers = None
+        self.app.load_config(self.app.config.file_paths)
+        self.environment = {name: os.environ.get(name) for name in PINNED_ENVIRONMENT}
+        for host in self.app.hosts:
+            try:
+                # Just negotiates the API version; commands make their own clients
+                host.make_client().close()
+            except DockerNotAvailableError:
+                pass
+        self.refresh_formations()
+
+    def refresh_formations(self):
+        """
+        Makes sure the formation running on each host is cached, following
+        the host's events so any change throws the cached copy away. Forked
+        commands inherit it rather than each introspecting the host.
+        """
+        from docker.errors import DockerException
+        for host in self.app.hosts:
+            try:
+                self.app.formations.get(host)
+            except (DockerNotAvailableError, DockerException, OSError):
+                pass
+
+    def serve(self):
+        """
+        Listens on the socket and handles requests until told to stop.
+        """
+        self.warm()
+        if DaemonClient(self.path).connect() is not None:
+            raise RuntimeError("A daemon is already running on {}".format(self.path))
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        elif not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only we may connect; set before bind so the socket is never open to others
+        previous_umask = os.umask(0o177)
+        try:
+            self.listener.bind(self.path)
+        finally:
+            os.umask(previous_umask)
+        self.listener.listen(16)
+        self.listener.settimeout(1)
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    conn, _ = self.listener.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                self.handle(conn)
+        finally:
+            self.listener.close()
+            os.unlink(self.path)
+
+    def handle(self, conn):
+        """
+        Handles a single request. Forking happens here, on the main thread.
+        """
+        try:
+            request, fds = receive_message(conn)
+        except OSError:
+            conn.close()
+            return
+        if request is None:
+            conn.close()
+        elif "control" in request:
+            self.handle_control(conn, request["control"])
+        else:
+            refusal = self.refusal(request)
+            if refusal is None:
+                # Pick up any changes to the library before forking, so every
+                # command does not have to reload it on its own.
+                if not self.app.containers.is_current():
+                    self.app.containers = None
+                    self.app.load_config(self.app.config.file_paths)
+                    # Cached formations refer to the old graph's containers
+                    self.app.formations.invalidate()
+                self.refresh_formations()
+                if self.needs_terminal(request["argv"]):
+                    refusal = "command runs a foreground container"
+            if refusal is not None:
+                # The client runs it itself
+                send_message(conn, {"refused": refusal})
+                conn.close()
+            else:
+                self.fork_command(conn, request, fds)
+        for fd in fds:
+            os.close(fd)
+
+    def refusal(self, request):
+        """
+        Returns why the daemon will not run the request at all, or None if
+        it will run it (as long as it does not need the terminal).
+        """
+        # Work out the command and config like the CLI will
+        try:
+            context = self.app.cli.make_context("bay", list(request["argv"]), resilient_parsing=True)
+        except click.ClickException:
+            return "command line does not parse"
+        if not context.protected_args or context.protected_args[0] not in FORWARDED_COMMANDS:
+            return "command is not one the daemon runs"
+        if any(request["env"].get(name) != value for name, value in self.environment.items()):
+            return "environment differs from the daemon's"
+        if self.request_home(request, context.params.get("config") or ()) != self.app.containers.path:
+            return "library differs from the daemon's"
+        return None
+
+    def request_home(self, request, config_paths):
+        """
+        Returns the library the request's command would load, resolving
+        paths against the client's working directory.
+        """
+        try:
+            config = Config([os.path.join(request["cwd"], path) for path in config_paths])
+        except (BadConfigError, OSError, yaml.YAMLError):
+            return None
+        return os.path.abspath(os.path.join(request["cwd"], os.path.expanduser(config["bay"]["home"])))
+
+    def needs_terminal(self, argv):
+        """
+        Returns True if any container named on the command line, or one it
+        depends on, runs in the foreground. Attaching its TTY needs the
+        terminal's foreground process group, which a forked child is not in.
+        """
+        graph = self.app.containers
+        for name in argv:
+            if name == "all":
+                containers = list(graph)
+            elif name in graph.containers:
+                containers = [graph[name]] + list(graph.ancestors(graph[name]))
+            else:
+                continue
+            if any(container.foreground for container in containers):
+                return True
+        return False
+
+    def fork_command(self, conn, request, fds):
+        """
+        Runs the command in a forked child, reporting back from a thread.
+        """
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Not while an event is changing the cached formations, or the child
+        # would inherit their lock held
+        with self.app.formations.lock:
+            pid = os.fork()
+        if pid == 0:
+            self.run_child(conn, request, fds)
+        threading.Thread(target=self.watch_child, args=(conn, pid), daemon=True).start()
+
+    def handle_control(self, conn, action):
+        if action == "status":
+            send_message(conn, {"pid": os.getpid(), "home": self.app.containers.path})
+        elif action == "stop":
+            send_message(conn, {"stopping": True})
+            self.running = False
+        else:
+            send_message(conn, {"error": "Unknown action {}".format(action)})
+        conn.close()
+
+    def run_child(self, conn, request, fds):
+        """
+        Runs the command in the forked child, then exits it.
+        """
+        exit_code = 1
+        try:
+            self.listener.close()
+            conn.close()
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.chdir(request["cwd"])
+            os.environ.clear()
+            os.environ.update(request["env"])
+            sys.argv = ["bay"] + request["argv"]
+            self.app.timings = Timings()
+            for host in self.app.hosts:
+                host.after_fork()
+            self.app.formations.after_fork()
+            self.app.cli.forward_to_daemon = False
+            self.app.cli.main(args=request["argv"], prog_name="bay")
+            exit_code = 0
+        except SystemExit as e:
+            if e.code is None:
+                exit_code = 0
+            elif isinstance(e.code, int):
+                exit_code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(exit_code)
+
+    def watch_child(self, conn, pid):
+        """
+        Waits for a command to finish and reports its exit code to the client.
+        If the client goes away first (e.g. Ctrl-C), the command is interrupted.
+        """
+        client_gone = False
+        while True:
+            finished, status = os.waitpid(pid, os.WNOHANG)
+            if finished:
+                break
+            if client_gone:
+                select.select([], [], [], 0.1)
+            elif select.select([conn], [], [], 0.1)[0] and not conn.recv(1):
+                client_gone = True
+                os.kill(pid, signal.SIGINT)
+        if os.WIFEXITED(status):
+            exit_code = os.WEXITSTATUS(status)
+        else:
+            exit_code = 128 + os.WTERMSIG(status)
+        try:
+            send_message(conn, {"exit": exit_code})
+        except OSError:
+            pass
+        conn.close()
@@ -0,0 +1,96 @@
+import contextlib
+import json
+import threading
+import time
+
+import attr
+import click
+
+from .colors import CYAN
+
+
+@attr.s
+class Timings:
+    """
+    Records wall time spent in named phases of a bay invocation, so it's
+    possible to see where the time in a slow command went.
+
+    Phases nest; each recorded phase knows its depth and how much of its time
+    was spent in its own nested phases. Phases are always recorded (it's cheap),
+    and only reported if enabled.
+    """
+    start = attr.ib(default=attr.Factory(time.monotonic))
+    enabled = attr.ib(default=False)
+    json_path = attr.ib(default=None)
+    phases = attr.ib(default=attr.Factory(list), init=False, repr=False)
+    notes = attr.ib(default=attr.Factory(list), init=False, repr=False)
+    _lock = attr.ib(default=attr.Factory(threading.Lock), init=False, repr=False)
+    _local = attr.ib(default=attr.Factory(threading.local), init=False, repr=False)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager that records the time spent inside it as a phase.
+        """
+        stack = self._local.__dict__.setdefault("stack", [])
+        record = {
+            "name": name,
+            "depth": len(stack),
+            "thread": threading.current_thread().name,
+            "start": time.monotonic() - self.start,
+            "duration": None,
+            "nested": 0,
+        }
+        with self._lock:
+            self.phases.append(record)
+        stack.append(record)
+        try:
+            yield record
+        finally:
+            stack.pop()
+            record["duration"] = time.monotonic() - self.start - record["start"]
+            if stack:
+                stack[-1]["nested"] += record["duration"]
+
+    def note(self, message):
+        """
+        Adds a line of extra information (e.g. lock contention) to the report.
+        """
+        with self._lock:
+            self.notes.append(message)
+
+    def as_dict(self):
+        return {
+            "total": time.monotonic() - self.start,
+            "phases": [
+                dict(record)
+                for record in self.phases
+                if record["duration"] is not None
+            ],
+            "notes": list(self.notes),
+        }
+
+    def report(self):
+        """
+        Prints the breakdown and/or writes it out as JSON, if enabled.
+        """
+        data = self.as_dict()
+        if self.json_path:
+            with open(self.json_path, "w") as fh:
+                json.dump(data, fh, indent=2)
+        if not self.enabled:
+            return
+        click.echo(CYAN("{:<40} {:>10} {:>10} {:>7}".format("PHASE", "TOTAL MS", "SELF MS", "%")), err=True)
+        for record in data["phases"]:
+            name = "  " * record["depth"] + record["name"]
+            if record["thread"] != "MainThread":
+                name += " [{}]".format(record["thread"])
+            click.echo("{:<40} {:>10.1f} {:>10.1f} {:>7.1f}".format(
+                name,
+                record["duration"] * 1000,
+                (record["duration"] - record["nested"]) * 1000,
+                (record["duration"] / data["total"] * 100) if data["total"] else 0,
+            ), err=True)
+        click.echo("{:<40} {:>10.1f}".format("total", data["total"] * 1000), err=True)
+        for note in data["notes"]:
+            click.echo(note, err=True)
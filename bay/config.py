@@ -22,9 +22,16 @@ class Config(object):
             "home": str,
             "build_log_path": str,
             "user_data_path": str,
+            "graph_snapshot_path": str,
             "user_profile_home": str,
             "ssh_agent_container": str,
             "port_proxy_container": str,
+            "runner_concurrency": int,
+            "reuse_containers": bool,
+            "build_concurrency": int,
+            "pull_concurrency": int,
+            "wait_timeout": int,
+            "lock_timeout": int,
         }
     }
 
@@ -34,11 +41,21 @@ class Config(object):
         },
         "bay": {
             "home": os.path.expanduser(os.environ.get("BAY_HOME", ".")),
-            "build_log_path": os.path.expanduser('~/.bay/{prefix}/build.log'),
+            # One log per container being built
+            "build_log_path": os.path.expanduser('~/.bay/{prefix}/builds/{container}.log'),
             "user_data_path": os.path.expanduser('~/.bay/{prefix}'),
+            "graph_snapshot_path": os.path.expanduser('~/.bay/{prefix}/graph.snapshot'),
             "user_profile_home": os.path.expanduser('~/.bay'),
             "ssh_agent_container": "tugboat/ssh-agent",
             "port_proxy_container": "tugboat/port-proxy",
+            "runner_concurrency": 8,
+            "reuse_containers": True,
+            "build_concurrency": 4,
+            "pull_concurrency": 4,
+            # Seconds all the waits of one container may take in total; 0 for no limit
+            "wait_timeout": 600,
+            # Seconds to wait for another thread changing the same container; 0 to allow for wait_timeout
+            "lock_timeout": 0,
         },
     }
 
@@ -1,10 +1,103 @@
 import re
 import os
 import yaml
+from stat import S_ISREG
 
 import attr
 
 from ..exceptions import BadConfigError
+from ..utils.functional import cached_property
+
+
+@attr.s
+class ContainerSource:
+    """
+    The parsed contents of a container directory on disk: its bay.yaml (or
+    tug.yaml) config and the build parent named in each of its Dockerfiles.
+
+    It also records a fingerprint (mtime, size and inode) of every file it was
+    read from, so a cached copy can be checked against the disk without parsing
+    anything. Sources must stay picklable and must not reference the graph.
+    """
+    parent_pattern = re.compile(r'^FROM\s+([\S/]+)', re.IGNORECASE | re.MULTILINE)
+
+    path = attr.ib()
+    config_path = attr.ib()
+    config_data = attr.ib(repr=False)
+    build_parents = attr.ib(repr=False)
+    fingerprint = attr.ib(repr=False)
+
+    @classmethod
+    def from_directory(cls, path):
+        """
+        Reads and parses the config and Dockerfiles in the directory.
+        """
+        fingerprint = {}
+        # Read config, making sure a empty file (None) appears as empty dict.
+        # Files are always statted before they're read so a change in between
+        # results in a stale fingerprint, not a stale cache.
+        config_path = os.path.join(path, "bay.yaml")
+        config_data = {}
+        for config_name in ("bay.yaml", "tug.yaml"):
+            fingerprint[config_name] = cls.stat_file(os.path.join(path, config_name))
+        if fingerprint["bay.yaml"] is None and fingerprint["tug.yaml"] is not None:
+            config_path = os.path.join(path, "tug.yaml")
+        if fingerprint[os.path.basename(config_path)] is not None:
+            with open(config_path, "r") as fh:
+                config_data = yaml.safe_load(fh.read()) or {}
+        # Load parent image from every Dockerfile any version uses
+        build_parents = {}
+        dockerfile_names = {"Dockerfile"}.union(config_data.get("versions", {}).values())
+        for dockerfile_name in dockerfile_names:
+            fingerprint[dockerfile_name] = cls.stat_file(os.path.join(path, dockerfile_name))
+            if fingerprint[dockerfile_name] is None:
+                continue
+            with open(os.path.join(path, dockerfile_name), "r") as fh:
+                match = cls.parent_pattern.search(fh.read())
+                build_parents[dockerfile_name] = match.group(1) if match else None
+        return cls(
+            path=path,
+            config_path=config_path,
+            config_data=config_data,
+            build_parents=build_parents,
+            fingerprint=fingerprint,
+        )
+
+    @staticmethod
+    def stat_file(path):
+        """
+        Returns a (mtime, size, inode) tuple for a regular file, or None if it
+        does not exist.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not S_ISREG(stat.st_mode):
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def is_current(self):
+        """
+        Returns True if none of the files this source was read from have changed.
+        """
+        return all(
+            self.stat_file(os.path.join(self.path, name)) == signature
+            for name, signature in self.fingerprint.items()
+        )
+
+    @property
+    def versions(self):
+        """
+        Returns a dict of {suffix: dockerfile_name} for every version of the container.
+        """
+        versions = {None: "Dockerfile"}
+        # Merges extra versions in config file into versions dict
+        versions.update({
+            str(suffix): dockerfile_name
+            for suffix, dockerfile_name in self.config_data.get("versions", {}).items()
+        })
+        return versions
 
 
 @attr.s
@@ -16,7 +109,6 @@ class Container:
     All containers are backed by a local disk directory containing their information,
     even if the actual running server is remote.
     """
-    parent_pattern = re.compile(r'^FROM\s+([\S/]+)', re.IGNORECASE | re.MULTILINE)
     git_volume_pattern = re.compile(r'^\{git@github.com:eventbrite/([\w\s\-]+).git\}(.*)$')
 
     graph = attr.ib(repr=False, hash=False, cmp=False)
@@ -24,47 +116,40 @@ class Container:
     suffix = attr.ib(repr=False, hash=False, cmp=False)
     dockerfile_name = attr.ib(repr=False, hash=False, cmp=False)
     name = attr.ib(init=False, repr=True, hash=True, cmp=True)
+    source = attr.ib(default=None, repr=False, hash=False, cmp=False)
 
     def __attrs_post_init__(self):
+        if self.source is None:
+            self.source = ContainerSource.from_directory(self.path)
         self.load()
 
     @classmethod
-    def from_directory(cls, graph, path):
+    def from_directory(cls, graph, path, source=None):
         """
         Creates a set of one or more Container objects from a source directory.
         The "versions" key in the bay.yaml file can mean there are multiple variants
         of the container, and we treat each separately (though they share a build directory and bay.yaml settings)
+
+        If a ContainerSource is passed (e.g. from the graph snapshot), it is used
+        instead of reading the directory again.
         """
-        versions = {None: "Dockerfile"}
-        # Read config and get out any non-default versions
-        config_path = os.path.join(path, "bay.yaml")
-        if not os.path.isfile(config_path):
-            config_path = os.path.join(path, "tug.yaml")
-        if os.path.isfile(config_path):
-            # Read out config, making sure a empty file (None) appears as empty dict
-            with open(config_path, "r") as fh:
-                config_data = yaml.safe_load(fh.read()) or {}
-                # Merges extra versions in config file into versions dict
-                versions.update({
-                    str(suffix): dockerfile_name
-                    for suffix, dockerfile_name in config_data.get("versions", {}).items()
-                })
+        if source is None:
+            source = ContainerSource.from_directory(path)
         # For each version, make a Container class for it, and return the list of them
         return [
-            cls(graph, path, suffix, dockerfile_name)
-            for suffix, dockerfile_name in versions.items()
+            cls(graph, path, suffix, dockerfile_name, source=source)
+            for suffix, dockerfile_name in source.versions.items()
         ]
 
     def load(self):
         """
-        Loads information from the container's files.
+        Loads the container's header - name, build parent and links - from its
+        parsed source files. Runtime details are loaded lazily.
         """
         # Work out paths to key files, make sure they exist
         self.dockerfile_path = os.path.join(self.path, self.dockerfile_name)
-        self.config_path = os.path.join(self.path, "bay.yaml")
-        if not os.path.isfile(self.config_path):
-            self.config_path = os.path.join(self.path, "tug.yaml")
-        if not os.path.isfile(self.dockerfile_path):
+        self.config_path = self.source.config_path
+        if self.dockerfile_name not in self.source.build_parents:
             raise BadConfigError("Cannot find Dockerfile for container %s" % self.path)
         # Calculate name from path component
         if self.suffix is None:
@@ -76,92 +161,157 @@ class Container:
             name=self.name,
         )
         # Load parent image from Dockerfile
-        with open(self.dockerfile_path, "r") as fh:
-            self.build_parent = self.parent_pattern.search(fh.read()).group(1)
-            # Make sure any ":" in the dockerfile is changed to a "-"
-            # TODO: Add warning here once we've converted enough of the dockerfiles
-            self.build_parent = self.build_parent.replace(":", "-")
+        self.build_parent = self.source.build_parents[self.dockerfile_name]
+        if self.build_parent is None:
+            raise BadConfigError("Cannot find FROM line in Dockerfile for container %s" % self.path)
+        # Make sure any ":" in the dockerfile is changed to a "-"
+        # TODO: Add warning here once we've converted enough of the dockerfiles
+        self.build_parent = self.build_parent.replace(":", "-")
         self.build_parent_in_prefix = self.build_parent.startswith(self.graph.prefix + '/')
         # Ensure it does not have an old-style multi version inheritance
         if self.build_parent_in_prefix and ":" in self.build_parent:
             raise BadConfigError(
                 "Container {} has versioned build parent - it should be converted to just a name.".format(self.path),
             )
-        # Load information from bay.yaml file
-        if os.path.isfile(self.config_path):
-            with open(self.config_path, "r") as fh:
-                config_data = yaml.safe_load(fh.read()) or {}
-        else:
-            config_data = {}
-        # Set our attributes with empty defaults
-        self.default_links = set(config_data.get("links", []))
-        self.all_links = set(config_data.get("extra_links", [])).union(self.default_links)
-        # Parse waits from the config format
-        self.waits = []
-        for wait_dict in config_data.get("waits", []):
+        # Links are needed to build the graph, so they are loaded now; everything
+        # else is only parsed when something first asks for it (see below).
+        self.default_links = set(self.config_data.get("links", []))
+        self.all_links = set(self.config_data.get("extra_links", [])).union(self.default_links)
+
+    # Runtime details, parsed from bay.yaml on first access. Versions share one
+    # parsed config, so anything a profile might mutate is copied.
+
+    @property
+    def config_data(self):
+        return self.source.config_data
+
+    @cached_property
+    def waits(self):
+        """
+        Waits from the config format, as a list of {"type": ..., "params": {...}}
+        """
+        waits = []
+        for wait_dict in self.config_data.get("waits", []):
             for wait_type, params in wait_dict.items():
                 if not isinstance(params, dict):
                     # TODO: Deprecate non-dictionary params
                     if wait_type == "time":
                         params = {"seconds": params}
+                    elif wait_type == "log":
+                        params = {"pattern": params}
+                    elif wait_type == "healthy":
+                        params = {}
                     else:
                         params = {"port": params}
-                self.waits.append({"type": wait_type, "params": params})
-        # Volumes is a dict of {container mountpoint: volume name/host path}
-        self._bound_volumes = {}
-        self._named_volumes = {}
-        for mount_point, source in config_data.get("volumes", {}).items():
-            # Old-style git link
-            # TODO: Add warning here once we've converted enough of the dockerfiles
-            git_match = self.git_volume_pattern.match(source)
-            if git_match:
-                source = "../{}/{}".format(git_match.group(1), git_match.group(2).lstrip("/"))
-            # Split named volumes and directory mounts up
+                waits.append({"type": wait_type, "params": params})
+        return waits
+
+    @cached_property
+    def _bound_volumes(self):
+        """
+        Directory mounts from the volumes config, as {container mountpoint: host path}
+        """
+        bound_volumes = {}
+        for mount_point, source in self.config_data.get("volumes", {}).items():
+            source = self.resolve_git_source(source)
             if "/" in source:
-                self._bound_volumes[mount_point] = os.path.abspath(os.path.join(self.graph.path, source))
-            else:
-                self._named_volumes[mount_point] = source
+                bound_volumes[mount_point] = os.path.abspath(os.path.join(self.graph.path, source))
+        return bound_volumes
+
+    @cached_property
+    def _named_volumes(self):
+        """
+        Named volumes from the volumes config, as {container mountpoint: volume name}
+        """
+        named_volumes = {}
+        for mount_point, source in self.config_data.get("volumes", {}).items():
+            source = self.resolve_git_source(source)
+            if "/" not in source:
+                named_volumes[mount_point] = source
         # Volumes_mount is a deprecated key from the old buildable volumes system.
         # They turn into named volumes.
         # TODO: Deprecate volumes_mount
-        for mount_point, source in config_data.get("volumes_mount", {}).items():
-            self._named_volumes[mount_point] = source
-        # Devmodes might also have git URLs
-        self._devmodes = {}
-        for name, mounts in config_data.get("devmodes", {}).items():
+        for mount_point, source in self.config_data.get("volumes_mount", {}).items():
+            named_volumes[mount_point] = source
+        return named_volumes
+
+    @cached_property
+    def _devmodes(self):
+        """
+        Devmodes defined directly on this container, as {name: {mountpoint: source}}
+        """
+        devmodes = {}
+        for name, mounts in self.config_data.get("devmodes", {}).items():
             # Allow for empty devmodes
             if not mounts:
                 continue
-            # Add each mount individually
-            self._devmodes[name] = {}
+            # Add each mount individually; devmodes might also have git URLs
+            devmodes[name] = {}
             for mount_point, source in mounts.items():
-                git_match = self.git_volume_pattern.match(source)
-                if git_match:
-                    source = "../{}/{}".format(git_match.group(1), git_match.group(2).lstrip("/"))
-                self._devmodes[name][mount_point] = source
-        # Ports is a dict of {port on container: host exposed port}
-        self.ports = config_data.get("ports", {})
-        self.build_checks = config_data.get("build_checks", [])
-        self.foreground = config_data.get("foreground", False)
-        self.image_tag = config_data.get("image_tag", "local")
-        self.environment = config_data.get("environment", {})
-        self.fast_kill = config_data.get("fast_kill", False)
-        self.buildargs = {}
-        # Store all extra data so plugins can get to it
-        self.extra_data = {
+                devmodes[name][mount_point] = self.resolve_git_source(source)
+        return devmodes
+
+    @cached_property
+    def ports(self):
+        """
+        Ports as a dict of {port on container: host exposed port}
+        """
+        return dict(self.config_data.get("ports", {}))
+
+    @cached_property
+    def build_checks(self):
+        return list(self.config_data.get("build_checks", []))
+
+    @cached_property
+    def foreground(self):
+        return self.config_data.get("foreground", False)
+
+    @cached_property
+    def image_tag(self):
+        return self.config_data.get("image_tag", "local")
+
+    @cached_property
+    def environment(self):
+        return dict(self.config_data.get("environment", {}))
+
+    @cached_property
+    def fast_kill(self):
+        return self.config_data.get("fast_kill", False)
+
+    @cached_property
+    def synthesize_healthcheck(self):
+        """
+        If the waits should be run by Docker as the container's healthcheck
+        """
+        return self.config_data.get("synthesize_healthcheck", False)
+
+    @cached_property
+    def buildargs(self):
+        return {}
+
+    @cached_property
+    def extra_data(self):
+        """
+        All extra data in the config, so plugins can get to it
+        """
+        return {
             key: value
-            for key, value in config_data.items()
-            if key not in ["ports", "build_checks", "devmodes", "foreground", "links", "waits", "volumes", "image_tag"]
+            for key, value in self.config_data.items()
+            if key not in [
+                "ports", "build_checks", "devmodes", "foreground", "links", "waits", "volumes", "image_tag",
+                "synthesize_healthcheck",
+            ]
         }
 
-    def get_parent_value(self, name, default):
+    def resolve_git_source(self, source):
         """
-        Shortcut for getting inherited values from parents with a fallback.
+        Converts an old-style git link volume source into a relative path.
         """
-        if self.build_parent_in_prefix:
-            return getattr(self.graph.build_parent(self), name)
-        else:
-            return default
+        # TODO: Add warning here once we've converted enough of the dockerfiles
+        git_match = self.git_volume_pattern.match(source)
+        if git_match:
+            source = "../{}/{}".format(git_match.group(1), git_match.group(2).lstrip("/"))
+        return source
 
     def get_ancestral_extra_data(self, key):
         """
@@ -180,18 +330,21 @@ class Container:
 
     @property
     def bound_volumes(self):
-        value = self.get_parent_value("bound_volumes", {})
-        value.update(self._bound_volumes)
-        return value
+        """
+        Read-only {mountpoint: host path} of bind mounts, including inherited ones.
+        """
+        return self.graph.inherited_config(self, "bound_volumes")
 
     @property
     def named_volumes(self):
-        value = self.get_parent_value("named_volumes", {})
-        value.update(self._named_volumes)
-        return value
+        """
+        Read-only {mountpoint: volume name} of named volumes, including inherited ones.
+        """
+        return self.graph.inherited_config(self, "named_volumes")
 
     @property
     def devmodes(self):
-        value = self.get_parent_value("devmodes", {})
-        value.update(self._devmodes)
-        return value
+        """
+        Read-only {name: {mountpoint: source}} of devmodes, including inherited ones.
+        """
+        return self.graph.inherited_config(self, "devmodes")
@@ -1,4 +1,6 @@
 import attr
+import hashlib
+import json
 import warnings
 
 from ..exceptions import BadConfigError
@@ -53,7 +55,7 @@ class ContainerFormation:
         # Make sure the instance being removed is part of us
         assert instance.formation is self
         # Resolve the dependent containers so they can all be removed
-        dependent_descendency = set(dependency_sort([instance.container], self.graph.dependents)[:-1])
+        dependent_descendency = self.graph.descendants(instance.container)
         for other_instance in list(self):
             if other_instance.container in dependent_descendency and other_instance.formation:
                 other_instance.formation = None
@@ -62,6 +64,14 @@ class ContainerFormation:
         del self.container_instances[instance.name]
         instance.formation = None
 
+    def discard_instance(self, name):
+        """
+        Removes the named instance (and only it) from the formation if it is there.
+        """
+        instance = self.container_instances.pop(name, None)
+        if instance is not None:
+            instance.formation = None
+
     def add_container(self, container, host):
         """
         Adds a container to run inside the formation along with all dependencies.
@@ -86,15 +96,16 @@ class ContainerFormation:
                 links[dependency.name] = instance
         # Look up the image hash to use in the repo
         image_id = host.images.image_version(container.image_name, container.image_tag)
-        # Make the instance
+        # Make the instance. Hooks change its environment before launch, so it
+        # gets its own copies of anything shared with the graph.
         instance = ContainerInstance(
             name="{}.{}.1".format(self.graph.prefix, container.name),
             container=container,
             image_id=image_id,
             links=links,
-            devmodes=devmodes,
+            devmodes=set(devmodes),
             foreground=container.foreground,
-            environment=container.environment,
+            environment=dict(container.environment),
         )
         self.add_instance(instance)
         return instance
@@ -140,7 +151,15 @@ class ContainerInstance:
     :environment: Extra environment variables to set in the container
     :command: A custom command override (as a list of string arguments, like subprocess.call takes)
     :foreground: If True, the container is launched in the foreground and a TTY attached
+    :recorded_fingerprint: For introspected instances, the fingerprint label the container was launched with
+    :healthcheck: A Docker healthcheck config to create the container with, overriding the image's
     """
+    FINGERPRINT_LABEL = "com.eventbrite.bay.fingerprint"
+    # Fingerprint of the spec once plugins have added to it, i.e. what was really launched
+    LAUNCH_FINGERPRINT_LABEL = "com.eventbrite.bay.launch-fingerprint"
+    # The container's links, as the JSON list of "name:alias" strings Docker
+    # reports when inspecting; the list API does not give them at all
+    LINKS_LABEL = "com.eventbrite.bay.links"
 
     name = attr.ib(cmp=True)
     container = attr.ib(cmp=False)
@@ -151,6 +170,8 @@ class ContainerInstance:
     environment = attr.ib(default=attr.Factory(dict), repr=False, cmp=False)
     command = attr.ib(default=None, repr=False, cmp=False)
     foreground = attr.ib(default=None, repr=False, cmp=False)
+    recorded_fingerprint = attr.ib(default=None, repr=False, cmp=False)
+    healthcheck = attr.ib(default=None, repr=False, cmp=False)
     formation = attr.ib(default=None, init=False, repr=False, cmp=False)
 
     def __attrs_post_init__(self):
@@ -175,35 +196,98 @@ class ContainerInstance:
         """
         Returns a safely mutable clone of this Instance
         """
-        return self.__class__(
+        clone = self.__class__(
             name=self.name,
             container=self.container,
             image_id=self.image_id,
-            links=self.links,
-            devmodes=self.devmodes,
-            ports=self.ports,
-            environment=self.environment,
-            command=self.command,
+            links=dict(self.links),
+            devmodes=set(self.devmodes),
+            ports=dict(self.ports),
+            environment=dict(self.environment),
+            command=list(self.command) if self.command is not None else None,
             foreground=self.foreground,
+            recorded_fingerprint=self.recorded_fingerprint,
+            healthcheck=self.healthcheck,
         )
+        # Introspected instances also know where they are running
+        for name in ("ip_address", "port_mapping"):
+            if hasattr(self, name):
+                setattr(clone, name, getattr(self, name))
+        return clone
+
+    def launch_spec(self):
+        """
+        Returns everything that goes into launching the container, in a
+        JSON-serialisable form.
+        """
+        spec = {
+            "image": self.image_id,
+            "environment": dict(self.environment),
+            "ports": {str(container_port): host_port for container_port, host_port in self.ports.items()},
+            "bound_volumes": dict(self.container.bound_volumes),
+            "named_volumes": dict(self.container.named_volumes),
+            "devmodes": {name: dict(self.container.devmodes[name]) for name in self.devmodes},
+            "links": {
+                alias: target if isinstance(target, str) else target.name
+                for alias, target in self.links.items()
+            },
+            "command": self.command,
+        }
+        # Only present when set, so containers without one keep their fingerprint
+        if self.healthcheck is not None:
+            spec["healthcheck"] = self.healthcheck
+        return spec
+
+    def fingerprint(self):
+        """
+        Returns a hash of the launch spec. Introspected instances return the
+        fingerprint the container was launched with, as they don't know their
+        full spec.
+        """
+        if self.recorded_fingerprint is not None:
+            return self.recorded_fingerprint
+        spec = json.dumps(self.launch_spec(), sort_keys=True, default=str)
+        return hashlib.sha256(spec.encode("utf8")).hexdigest()
 
     def different_from(self, other):
         """
         Returns if the other instance is different from this one at all
         (i.e. we need to stop it and start us)
         """
-        return (
-            self.name != other.name or
-            self.container != other.container or
-            self.image_id != other.image_id or
-            self.links != other.links or
-            self.devmodes != other.devmodes or
-            self.ports != other.ports or
-            self.environment != other.environment or
-            self.command != other.command or
-            other.foreground or
-            self.foreground
-        )
+        return bool(self.differences(other))
+
+    def differences(self, other):
+        """
+        Returns a list of the reasons the other instance needs replacing by
+        this one, as short strings; it is empty if they are the same.
+        """
+        reasons = []
+        if self.name != other.name:
+            reasons.append("name changed")
+        if self.container != other.container:
+            reasons.append("container changed")
+        # Containers launched with a fingerprint can be compared on just that
+        if other.recorded_fingerprint is not None:
+            if self.fingerprint() != other.recorded_fingerprint:
+                reasons.append("launch spec changed")
+        else:
+            if self.image_id != other.image_id:
+                reasons.append("image changed")
+            if self.links != other.links:
+                reasons.append("links changed")
+            if self.devmodes != other.devmodes:
+                reasons.append("devmodes changed")
+            if self.ports != other.ports:
+                reasons.append("ports changed")
+            if self.environment != other.environment:
+                reasons.append("environment changed")
+            if self.command != other.command:
+                reasons.append("command changed")
+        if other.foreground:
+            reasons.append("running in the foreground")
+        if self.foreground:
+            reasons.append("runs in the foreground")
+        return reasons
 
     def resolve_links(self):
         """
@@ -1,10 +1,19 @@
 import os
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+
+try:
+    from os import scandir
+except ImportError:
+    # Python < 3.5
+    from scandir import scandir
 
 import attr
 
 from ..exceptions import BadConfigError
-from .container import Container
+from .container import Container, ContainerSource
+from .snapshot import GraphSnapshot
 
 
 @attr.s
@@ -18,11 +27,25 @@ class ContainerGraph:
     containers to start by default.
     """
     path = attr.ib(convert=os.path.abspath)
+    # Path to the on-disk snapshot of parsed containers; may contain {prefix}.
+    # If None, every container directory is read and parsed on load.
+    snapshot_path = attr.ib(default=None, repr=False)
+    # Number of threads used to read container directories
+    scan_workers = attr.ib(default=8, repr=False)
     containers = attr.ib(default=attr.Factory(dict), init=False, repr=False)
     _dependencies = attr.ib(default=attr.Factory(dict), repr=False)
     _build_dependencies = attr.ib(default=attr.Factory(dict), init=False, repr=False)
+    # Reverse indexes of the two edge sets above, {provider: set(dependers)}
+    _dependents = attr.ib(default=attr.Factory(dict), init=False, repr=False)
+    _build_children = attr.ib(default=attr.Factory(dict), init=False, repr=False)
+    # Memoised transitive closures, {(edge type, container): frozenset}, and
+    # inherited config, {(name, container): read-only mapping}. Both are
+    # cleared by invalidate() whenever the graph or a profile changes.
+    _closures = attr.ib(default=attr.Factory(dict), init=False, repr=False)
+    _inherited = attr.ib(default=attr.Factory(dict), init=False, repr=False)
     _options = attr.ib(default=attr.Factory(dict), init=False, repr=False)
     config_path = attr.ib(init=False)
+    config_fingerprint = attr.ib(default=None, init=False, repr=False)
 
     def __attrs_post_init__(self):
         """
@@ -35,41 +58,109 @@ class ContainerGraph:
         """
         Loads top-level configuration
         """
-        self.prefix = None
-        self.registry = None
+        self.config_path, self.prefix, self.registry = self.read_config(self.path)
+        self.config_fingerprint = ContainerSource.stat_file(self.config_path)
+
+    @classmethod
+    def read_config(cls, path):
+        """
+        Reads the top-level configuration of the library at path, without
+        loading any containers. Returns (config_path, prefix, registry).
+        """
+        prefix = None
+        registry = None
         # Work out the path to the configuration file
-        self.config_path = os.path.join(self.path, "bay.yaml")
-        if not os.path.isfile(self.config_path):
-            self.config_path = os.path.join(self.path, "tug.yaml")
-            if not os.path.isfile(self.config_path):
-                raise BadConfigError("Cannot find bay.yaml in top level of container library at %s" % self.path)
+        config_path = os.path.join(path, "bay.yaml")
+        if not os.path.isfile(config_path):
+            config_path = os.path.join(path, "tug.yaml")
+            if not os.path.isfile(config_path):
+                raise BadConfigError("Cannot find bay.yaml in top level of container library at %s" % path)
         # Load the configuration file
-        with open(self.config_path, "r") as fh:
+        with open(config_path, "r") as fh:
             config_data = yaml.safe_load(fh.read())
         if not isinstance(config_data, dict):
-            raise BadConfigError("%s is badly formatted (not a dict)" % self.config_path)
+            raise BadConfigError("%s is badly formatted (not a dict)" % config_path)
         for key, value in config_data.items():
             if key == "prefix":
-                self.prefix = value
+                prefix = value
             elif key == "registry":
-                self.registry = value
+                registry = value
             else:
-                raise BadConfigError("Unknown key in %s: %s" % (self.config_path, key))
-        if self.prefix is None:
-            raise BadConfigError("No prefix set in top-level tug.yaml {}".format(self.config_path))
+                raise BadConfigError("Unknown key in %s: %s" % (config_path, key))
+        if prefix is None:
+            raise BadConfigError("No prefix set in top-level tug.yaml {}".format(config_path))
+        return config_path, prefix, registry
 
     def load_containers(self):
         """
         Loads containers from their directories.
         """
-        # Scan through directories and load ones that look right
+        snapshot = None
+        if self.snapshot_path is not None:
+            snapshot = GraphSnapshot(self.snapshot_path.replace("{prefix}", self.prefix))
+            snapshot.load()
+        # Read directories that look right in parallel, as on network home
+        # directories the file I/O dominates. Results come back in name order.
+        with ThreadPoolExecutor(max_workers=self.scan_workers) as executor:
+            sources = list(executor.map(
+                lambda path: self.read_container_directory(path, snapshot),
+                self.candidate_directories(),
+            ))
+        if snapshot:
+            snapshot.save()
         containers = []
-        for name in os.listdir(self.path):
-            container_path = os.path.join(self.path, name)
-            if os.path.isdir(container_path) and os.path.isfile(os.path.join(container_path, "Dockerfile")):
-                containers.extend(Container.from_directory(self, container_path))
+        for source in sources:
+            if source is not None:
+                containers.extend(Container.from_directory(self, source.path, source))
         self.add_containers(containers)
 
+    def is_current(self):
+        """
+        Returns True if nothing the graph was loaded from has changed on disk
+        since: the top-level config, the set of container directories, and
+        every file each container was read from. Only stats files.
+
+        Profiles are not taken into account, so this is only meaningful for a
+        graph no profile has been applied to.
+        """
+        if ContainerSource.stat_file(self.config_path) != self.config_fingerprint:
+            return False
+        sources = {
+            container.source.path: container.source
+            for container in self.containers.values()
+            if container.source is not None
+        }
+        directories = [
+            path
+            for path in self.candidate_directories()
+            if os.path.isfile(os.path.join(path, "Dockerfile"))
+        ]
+        if set(directories) != set(sources):
+            return False
+        return all(source.is_current() for source in sources.values())
+
+    def candidate_directories(self):
+        """
+        Returns the paths of all directories in the library, sorted by name.
+        Uses dirent types from scandir so most entries need no extra stat.
+        """
+        return sorted(
+            entry.path
+            for entry in scandir(self.path)
+            if entry.is_dir()
+        )
+
+    def read_container_directory(self, path, snapshot=None):
+        """
+        Returns the ContainerSource for a directory, or None if it has no
+        Dockerfile and so is not a container.
+        """
+        if not os.path.isfile(os.path.join(path, "Dockerfile")):
+            return None
+        if snapshot is not None:
+            return snapshot.source(path)
+        return ContainerSource.from_directory(path)
+
     def add_containers(self, containers):
         """
         Adds container nodes to the graph and links them up based on their `links`
@@ -87,16 +178,21 @@ class ContainerGraph:
 
     def set_dependencies(self, depender, providers):
         """
-        Adds runtime dependency edges to the graph where `depender` depends on each of `providers`
+        Adds runtime dependency edges to the graph where `depender` depends on each of `providers`,
+        replacing any it had before.
         """
+        for provider in self._dependencies.get(depender, set()):
+            self._dependents[provider].discard(depender)
         self._dependencies[depender] = set()
+        self.invalidate()
         for provider in providers:
-            if provider not in self.containers.values() or depender not in self.containers.values():
+            if not (self.has_container(provider) and self.has_container(depender)):
                 raise ValueError("Cannot link between containers %s and %s - one or both not in graph." % (
                     provider,
                     depender,
                 ))
             self._dependencies[depender].add(provider)
+            self._dependents.setdefault(provider, set()).add(depender)
 
     def set_option(self, container, option, value):
         """
@@ -116,12 +212,31 @@ class ContainerGraph:
         """
         Adds a build dependency edge to the graph where `depender` depends on `provider`
         """
-        if provider not in self.containers.values() or depender not in self.containers.values():
+        if not (self.has_container(provider) and self.has_container(depender)):
             raise ValueError("Cannot build-link between containers %s and %s - one or both not in graph." % (
                 provider,
                 depender,
             ))
+        if depender in self._build_dependencies:
+            self._build_children[self._build_dependencies[depender]].discard(depender)
         self._build_dependencies[depender] = provider
+        self._build_children.setdefault(provider, set()).add(depender)
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Clears memoised closures and inherited config. Called when edges
+        change, and by profiles when they are applied.
+        """
+        self._closures.clear()
+        self._inherited.clear()
+
+    def has_container(self, container):
+        """
+        Returns True if the graph has an equal container (same name and path)
+        under the container's name.
+        """
+        return self.containers.get(container.name) == container
 
     def dependencies(self, container):
         """
@@ -133,11 +248,46 @@ class ContainerGraph:
         """
         Returns the containers that depend on the named container
         """
-        result = set()
-        for candidate, dependencies in self._dependencies.items():
-            if container in dependencies:
-                result.add(candidate)
-        return result
+        return self._dependents.get(container, set())
+
+    def ancestors(self, container):
+        """
+        Returns all containers the container depends on at runtime, directly
+        or indirectly, as a frozenset.
+        """
+        return self._closure("ancestors", container, self._dependencies)
+
+    def descendants(self, container):
+        """
+        Returns all containers that depend on the container at runtime,
+        directly or indirectly, as a frozenset.
+        """
+        return self._closure("descendants", container, self._dependents)
+
+    def build_children(self, container):
+        """
+        Returns the containers whose immediate build parent is the container,
+        as a frozenset.
+        """
+        return frozenset(self._build_children.get(container, ()))
+
+    def _closure(self, kind, container, edges):
+        """
+        Returns (and memoises) the transitive closure of `edges` from the
+        container, not including the container itself.
+        """
+        key = (kind, container)
+        if key not in self._closures:
+            result = set()
+            pending = list(edges.get(container, ()))
+            while pending:
+                node = pending.pop()
+                if node not in result:
+                    result.add(node)
+                    pending.extend(edges.get(node, ()))
+            result.discard(container)
+            self._closures[key] = frozenset(result)
+        return self._closures[key]
 
     def build_ancestry(self, container):
         """
@@ -145,10 +295,32 @@ class ContainerGraph:
         to immediate parent.
         """
         ancestry = []
+        container = self._build_dependencies.get(container, None)
         while container is not None:
-            ancestry.insert(0, container)
+            ancestry.append(container)
             container = self._build_dependencies.get(container, None)
-        return ancestry[:-1]
+        ancestry.reverse()
+        return ancestry
+
+    def inherited_config(self, container, name):
+        """
+        Returns the container's own `_<name>` config (e.g. `_devmodes`) merged
+        over that of all its build ancestors, as a read-only mapping.
+
+        Values are resolved once and shared until the graph is invalidated.
+        """
+        key = (name, container)
+        if key not in self._inherited:
+            parent = self.build_parent(container)
+            value = dict(self.inherited_config(parent, name)) if parent is not None else {}
+            # Our own (mutable) config wins over anything inherited
+            value.update(getattr(container, "_" + name))
+            # Nested mappings (like devmode mounts) are made read-only too
+            self._inherited[key] = MappingProxyType({
+                item_name: MappingProxyType(item) if isinstance(item, dict) else item
+                for item_name, item in value.items()
+            })
+        return self._inherited[key]
 
     def build_parent(self, container):
         """
@@ -90,6 +90,7 @@ class Profile:
         Applies the profile to the given graph
         """
         self.graph = graph
+        self.graph.invalidate()
         for name, details in self.containers.items():
             try:
                 container = self.graph[name]
@@ -0,0 +1,94 @@
+import logging
+import os
+import pickle
+import tempfile
+
+import attr
+
+from ..version import __version__
+from .container import ContainerSource
+
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s
+class GraphSnapshot:
+    """
+    On-disk cache of the parsed sources of every container directory in a
+    library, stored as a single pickle.
+
+    Each cached ContainerSource is checked against the mtime/size/inode of the
+    files it came from before use, so only changed directories get re-read and
+    re-parsed. Anything unexpected in the file (corruption, an older format, a
+    different bay version) just results in an empty snapshot.
+    """
+    FORMAT_VERSION = 1
+
+    path = attr.ib()
+    sources = attr.ib(default=attr.Factory(dict), init=False, repr=False)
+    seen = attr.ib(default=attr.Factory(set), init=False, repr=False)
+    changed = attr.ib(default=False, init=False)
+
+    def load(self):
+        """
+        Loads cached sources from disk, if there are any.
+        """
+        try:
+            with open(self.path, "rb") as fh:
+                data = pickle.load(fh)
+        except FileNotFoundError:
+            return
+        except Exception:
+            # Unreadable snapshots get rebuilt from scratch
+            logger.debug("Ignoring unreadable graph snapshot %s", self.path, exc_info=True)
+            return
+        if not isinstance(data, dict) or data.get("key") != self.key:
+            return
+        self.sources = data["sources"]
+
+    @property
+    def key(self):
+        return (self.FORMAT_VERSION, __version__)
+
+    def source(self, directory):
+        """
+        Returns the ContainerSource for the directory, re-reading it from disk
+        only if it is not cached or has changed since it was.
+        """
+        self.seen.add(directory)
+        source = self.sources.get(directory)
+        if source is None or not source.is_current():
+            source = ContainerSource.from_directory(directory)
+            self.sources[directory] = source
+            self.changed = True
+        return source
+
+    def save(self):
+        """
+        Writes the snapshot back to disk if anything changed, dropping any
+        directories that were not seen during this load.
+        """
+        for directory in set(self.sources) - self.seen:
+            del self.sources[directory]
+            self.changed = True
+        if not self.changed:
+            return
+        # Write to a temporary file and move it into place so concurrent
+        # invocations never see a half-written snapshot.
+        dirname = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fd, temp_path = tempfile.mkstemp(dir=dirname, prefix=".graph-")
+        except OSError:
+            # The cache is purely an optimisation; never fail a command over it
+            return
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump({"key": self.key, "sources": self.sources}, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.path)
+        except OSError:
+            os.unlink(temp_path)
+            return
+        self.changed = False
@@ -3,16 +3,41 @@ import io
 import json
 import logging
 import os
+import queue
 import tarfile
 import tempfile
 
 import attr
-from docker.utils import exclude_paths
 
 from ..cli.colors import CYAN, remove_ansi
 from ..cli.tasks import Task
 
 from ..exceptions import BuildFailureError, FailedCommandException
+from ..utils.threading import WorkerPool
+
+
+def build_logger(container):
+    """
+    Returns the logger for a container's build. Each container has its own,
+    so builds running at the same time don't share a log.
+    """
+    return logging.getLogger("build_logger.{}".format(container.name))
+
+
+def build_log_path(app, container):
+    """
+    Returns the path of a container's build log.
+    """
+    path = app.config['bay']['build_log_path']
+    if "{container}" not in path:
+        # Older configs name a single file, which builds running at once would
+        # overwrite and interleave, so give each container its own next to it
+        root, ext = os.path.splitext(path)
+        path = root + ".{container}" + ext
+    # Fill everything in before making the directory, as {container} can be part of it
+    path = path.replace("{prefix}", app.containers.prefix).replace("{container}", container.name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
 
 
 class TaskExtraInfoHandler(logging.Handler):
@@ -33,6 +58,81 @@ class TaskExtraInfoHandler(logging.Handler):
         )
 
 
+@attr.s
+class BuildScheduler:
+    """
+    Builds a set of containers, starting each one as soon as its build
+    parent has been built (if that's one of the set too), so independent
+    branches of the build-parent tree build at the same time, up to
+    `concurrency` builds at once.
+
+    In fail-fast mode, no new builds start once one has failed (ones already
+    running are allowed to finish). With keep_going, everything that does not
+    build on top of a failed build is still built.
+    """
+    app = attr.ib()
+    host = attr.ib()
+    parent_task = attr.ib()
+    concurrency = attr.ib(default=4)
+    keep_going = attr.ib(default=False)
+    docker_cache = attr.ib(default=True)
+    verbose = attr.ib(default=False)
+    built = attr.ib(default=attr.Factory(list), init=False)
+    # {container: log path}
+    failed = attr.ib(default=attr.Factory(dict), init=False)
+    skipped = attr.ib(default=attr.Factory(list), init=False)
+
+    def build(self, containers):
+        """
+        Builds the containers, which must be in build-parent order. Returns
+        True if they all built.
+        """
+        graph = self.app.containers
+        to_build = set(containers)
+        position = {container: index for index, container in enumerate(containers)}
+        ready = [container for container in containers if graph.build_parent(container) not in to_build]
+        completions = queue.Queue()
+        pool = WorkerPool(self.concurrency, completions)
+        running = 0
+        try:
+            while ready or running:
+                # Start what can go, unless we're failing fast. Only as many as
+                # there are workers, so a failure stops builds still waiting.
+                while ready and running < self.concurrency and (self.keep_going or not self.failed):
+                    pool.submit(ready.pop(0), self.build_one)
+                    running += 1
+                if not running:
+                    break
+                container, exception = completions.get()
+                running -= 1
+                if exception is None:
+                    self.built.append(container)
+                    ready.extend(sorted(graph.build_children(container) & to_build, key=position.get))
+                elif isinstance(exception, BuildFailureError):
+                    self.failed[container] = build_log_path(self.app, container)
+                else:
+                    raise exception
+        finally:
+            pool.shutdown()
+        self.skipped = [
+            container
+            for container in containers
+            if container not in self.built and container not in self.failed
+        ]
+        return not self.failed
+
+    def build_one(self, container):
+        Builder(
+            self.host,
+            container,
+            self.app,
+            parent_task=self.parent_task,
+            logfile_name=build_log_path(self.app, container),
+            docker_cache=self.docker_cache,
+            verbose=self.verbose,
+        ).build()
+
+
 @attr.s
 class Builder:
     """
@@ -49,16 +149,17 @@ class Builder:
     logger = attr.ib(init=False)
 
     def __attrs_post_init__(self):
-        self.logger = logging.getLogger('build_logger')
+        self.logger = build_logger(self.container)
         self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
 
         # Close all old logging handlers
         if self.logger.handlers:
             [handler.close() for handler in self.logger.handlers]
             self.logger.handlers = []
 
-        # Add build log file handler
-        file_handler = logging.FileHandler(self.logfile_name)
+        # Add build log file handler, starting the log afresh
+        file_handler = logging.FileHandler(self.logfile_name, mode="w")
         self.logger.addHandler(file_handler)
 
         # Optionally add task (console) log handler
@@ -154,6 +255,7 @@ class Builder:
         Normalises all file ownership and times so that the docker hashes align
         better.
         """
+        from docker.utils import exclude_paths
         # Start temporary tar file
         fileobj = tempfile.NamedTemporaryFile()
         tfile = tarfile.open(mode='w:gz', fileobj=fileobj)
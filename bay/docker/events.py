@@ -0,0 +1,241 @@
+import collections
+import logging
+import threading
+import time
+
+import attr
+
+from ..exceptions import DockerNotAvailableError
+
+
+logger = logging.getLogger(__name__)
+
+
+def stream_errors():
+    """
+    Returns the exceptions that mean the event stream itself failed (the
+    connection dropped or Docker went away), rather than a bug in handling it.
+    """
+    import docker.errors
+    import requests
+    return (
+        OSError,
+        requests.exceptions.RequestException,
+        requests.packages.urllib3.exceptions.HTTPError,
+        docker.errors.DockerException,
+        DockerNotAvailableError,
+    )
+
+
+@attr.s
+class EventStream:
+    """
+    Follows the Docker events API for a host and keeps track of the state of
+    bay-managed containers on one formation network as events arrive. Docker
+    cannot filter container events by network, so containers are labelled
+    with their formation's network when they are created, and the stream
+    filters on that label.
+
+    Threads that need to know when a container starts, dies or changes health
+    wait on it rather than repeatedly inspecting the container. State is only
+    known for containers that had an event since the stream was started;
+    anything else returns None and callers should fall back to inspecting.
+    """
+    LABEL = "com.eventbrite.bay.container"
+    NETWORK_LABEL = "com.eventbrite.bay.network"
+
+    # Seconds to wait before reconnecting a dropped stream
+    RECONNECT_DELAY = 1
+
+    # How many destroyed containers to remember, so that a long-lived process
+    # (like the daemon) does not keep state for every container it ever saw
+    MAX_DESTROYED = 100
+
+    host = attr.ib()
+    started = attr.ib(default=False, init=False)
+    # The formation network being followed
+    network = attr.ib(default=None, init=False)
+    # Bumped each time the stream is (re)started for a network, so the
+    # thread following an older one knows to stop
+    generation = attr.ib(default=0, init=False, repr=False)
+    # {container name: {"running": bool, "exited": bool, "health": str or None, "exit_code": int or None}}
+    # "exited" is only set by a die or destroy event, so it is False for a container that has
+    # been created but whose start event has not arrived yet.
+    states = attr.ib(default=attr.Factory(dict), init=False, repr=False)
+    # Names of destroyed containers still in states, oldest first
+    destroyed = attr.ib(default=attr.Factory(collections.OrderedDict), init=False, repr=False)
+    condition = attr.ib(default=attr.Factory(threading.Condition), init=False, repr=False)
+    last_time = attr.ib(default=None, init=False, repr=False)
+    # Callables run as listener(host, container name, action) for each lifecycle event
+    listeners = attr.ib(default=attr.Factory(list), init=False, repr=False)
+
+    def start(self, network):
+        """
+        Subscribes to events for containers on the network, if we are not
+        already. Returns once the stream is open, so any event that happens
+        after this is seen.
+        """
+        with self.condition:
+            if self.started and network == self.network:
+                return
+            if self.last_time is None:
+                # Somewhere for catch_up() (in a forked child) to start from
+                self.last_time = int(time.time())
+        # Opening the stream can block on Docker, so other threads can still
+        # read state and handle events while it happens
+        events = self.connect(network)
+        with self.condition:
+            if self.started and network == self.network:
+                # Another thread started it while we were connecting
+                events.close()
+                return
+            # Changing network (the library's prefix changed under the daemon)
+            # replaces the stream, and what we knew is no longer kept current
+            if self.network != network:
+                self.states.clear()
+                self.destroyed.clear()
+            self.network = network
+            self.generation += 1
+            self.started = True
+            generation = self.generation
+        thread = threading.Thread(target=self.follow, args=(events, generation, network), daemon=True)
+        thread.start()
+
+    def connect(self, network):
+        """
+        Opens the event stream for the network and returns its generator.
+        """
+        # A dedicated client with no read timeout, as the stream can be idle for a long time
+        client = self.host.make_client()
+        client.timeout = None
+        return client.events(since=self.last_time, filters=self.filters(network), decode=True)
+
+    def filters(self, network):
+        return {
+            "type": "container",
+            "label": [self.LABEL, "{}={}".format(self.NETWORK_LABEL, network)],
+        }
+
+    def catch_up(self, network):
+        """
+        Handles every event on the network since the last one handled (by
+        the parent process, in a forked child) up to now, returning once
+        they have all been handled. Raises if the stream can't be read.
+        """
+        client = self.host.make_client()
+        try:
+            for event in client.events(
+                since=self.last_time,
+                until="{:.9f}".format(time.time()),
+                filters=self.filters(network),
+                decode=True,
+            ):
+                self.handle(event)
+        finally:
+            client.close()
+
+    def follow(self, events, generation, network):
+        """
+        Reads events until the process exits or the stream is started for
+        another network, reconnecting if the stream drops.
+        """
+        errors = stream_errors()
+        while generation == self.generation:
+            try:
+                for event in events:
+                    if generation != self.generation:
+                        return
+                    try:
+                        self.handle(event)
+                    except Exception:
+                        # A bug in us or a listener; the stream itself is fine
+                        logger.exception("Error handling Docker event %r", event)
+            except errors:
+                pass
+            # The stream ended or dropped; pick up from where we got to
+            while generation == self.generation:
+                time.sleep(self.RECONNECT_DELAY)
+                try:
+                    events = self.connect(network)
+                except errors:
+                    continue
+                break
+
+    def handle(self, event):
+        """
+        Updates container state from a single event.
+        """
+        actor = event.get("Actor") or {}
+        attributes = actor.get("Attributes") or {}
+        name = attributes.get("name")
+        action = event.get("Action") or event.get("status") or ""
+        if not name:
+            return
+        with self.condition:
+            self.last_time = event.get("time", self.last_time)
+            # Only lifecycle events tell us whether a container is running;
+            # anything else (exec, attach, ...) doesn't change what we know.
+            if action == "create":
+                self.states[name] = {"running": False, "exited": False, "health": None, "exit_code": None}
+                self.destroyed.pop(name, None)
+            elif action == "start":
+                self.states[name] = {"running": True, "exited": False, "health": None, "exit_code": None}
+                self.destroyed.pop(name, None)
+            elif action in ("die", "destroy"):
+                exit_code = attributes.get("exitCode")
+                state = self.states.setdefault(name, {"health": None, "exit_code": None})
+                state["running"] = False
+                state["exited"] = True
+                if exit_code is not None:
+                    state["exit_code"] = int(exit_code)
+                if action == "destroy":
+                    self.forget_destroyed(name)
+            elif action.startswith("health_status:"):
+                # Health checks only run while the container is up
+                state = self.states.setdefault(name, {"running": True, "exited": False, "exit_code": None})
+                state["health"] = action.split(":", 1)[1].strip()
+            else:
+                return
+            self.condition.notify_all()
+        # Copied, as listeners can come and go from other threads
+        for listener in list(self.listeners):
+            listener(self.host, name, action)
+
+    def forget_destroyed(self, name):
+        """
+        Notes the container was destroyed, forgetting the oldest destroyed
+        containers once there are too many. Recent ones are kept so threads
+        woken by the event still see the container exited.
+        """
+        self.destroyed[name] = True
+        while len(self.destroyed) > self.MAX_DESTROYED:
+            old_name, _ = self.destroyed.popitem(last=False)
+            self.states.pop(old_name, None)
+
+    def state(self, name):
+        """
+        Returns a copy of the known state of the named container, or None.
+        """
+        with self.condition:
+            state = self.states.get(name)
+            return dict(state) if state is not None else None
+
+    def wait(self, name, predicate, timeout):
+        """
+        Waits up to timeout seconds for predicate(state) to be true for the
+        named container (state may be None). Returns True if it became true.
+        If the stream isn't running, just checks once after the timeout.
+        """
+        if not self.started:
+            time.sleep(timeout)
+            return predicate(self.state(name))
+        with self.condition:
+            return self.condition.wait_for(lambda: predicate(self.states.get(name)), timeout)
+
+    def wait_for_exit(self, name, timeout):
+        """
+        Waits up to timeout seconds for the named container to die.
+        Returns True if it did. Only a die or destroy event counts, not a
+        container that has been created but not seen starting yet.
+        """
+        return self.wait(name, lambda state: state is not None and state["exited"], timeout)
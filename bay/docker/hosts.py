@@ -1,11 +1,12 @@
 import attr
-import docker
 import os
 import urllib.parse
 
 from ..exceptions import DockerNotAvailableError
 from ..utils.functional import cached_property, thread_cached_property
+from .events import EventStream
 from .images import ImageRepository
+from .probe import FileProbe
 
 
 @attr.s
@@ -48,6 +49,8 @@ class Host(object):
     tls_ca = attr.ib()
     tls_cert = attr.ib()
     tls_key = attr.ib()
+    # Docker API version to talk; "auto" until the first client negotiates it
+    api_version = attr.ib(default="auto", repr=False)
     url_scheme = attr.ib(init=False)
     url_location = attr.ib(init=False)
 
@@ -114,6 +117,14 @@ class Host(object):
         """
         Returns a Docker client for the URL
         """
+        return self.make_client()
+
+    def make_client(self):
+        """
+        Makes a new Docker client for the URL. The first one negotiates the
+        API version, and later ones (one per thread) reuse it.
+        """
+        import docker
         # TLS setup
         tls = None
         tls_client = None
@@ -127,14 +138,16 @@ class Host(object):
             )
         # Make client
         try:
-            return docker.Client(
+            client = docker.Client(
                 base_url=self.url,
-                version="auto",
+                version=self.api_version,
                 timeout=10,
                 tls=tls,
             )
         except docker.errors.DockerException:
             raise DockerNotAvailableError("The docker host at {} is not available".format(self.url))
+        self.api_version = client._version
+        return client
 
     @thread_cached_property
     def images(self):
@@ -147,17 +160,53 @@ class Host(object):
         """
         Shortcut to see if a container exists with the given runtime name
         """
+        import docker
         try:
             self.client.inspect_container(name)
             return True
         except docker.errors.APIError:
             return False
 
+    @cached_property
+    def files(self):
+        """
+        Returns the file probe for looking at files inside containers.
+        """
+        return FileProbe(self)
+
+    @cached_property
+    def events(self):
+        """
+        Returns the event stream for the host. It is not followed until
+        something calls start() on it.
+        """
+        return EventStream(self)
+
+    def after_fork(self):
+        """
+        Drops the clients and event stream inherited from a parent process,
+        so a forked child never shares their connections (and its event
+        thread, which did not survive the fork, is started again when needed).
+        The new event stream picks up from where the parent's got to.
+        """
+        events = self.__dict__.pop("events", None)
+        self.__dict__.pop("__cache_client", None)
+        if events is not None:
+            self.events.last_time = events.last_time
+
     def container_running(self, name, ignore_exists=False):
         """
         Says if the named container is running or not. Errors if you provide
         a container that does not exist.
+
+        Answered from the event stream, without asking Docker, if its last
+        event says the container is running. Events lag behind the API (a
+        container we just started may only have its "create" event so far),
+        so anything else is checked with Docker.
         """
+        state = self.events.state(name)
+        if state is not None and state["running"]:
+            return True
         if ignore_exists and not self.container_exists(name):
             return False
         data = self.client.inspect_container(name)
@@ -1,10 +1,16 @@
 import attr
 import json
-
-from docker.errors import NotFound
+import queue
+import threading
+from concurrent.futures import Future
 
 from ..cli.tasks import Task
 from ..exceptions import ImageNotFoundException, ImagePullFailure, BadConfigError
+from ..utils.threading import WorkerPool
+
+
+def format_megabytes(value):
+    return "{} MB".format(value // (1024**2))
 
 
 @attr.s
@@ -43,6 +49,18 @@ class ImageRepository:
         except ImageNotFoundException:
             return {}
 
+    def tagged_image_ids(self):
+        """
+        Returns {"name:tag": image hash} for every tagged image on the host,
+        from a single API call.
+        """
+        result = {}
+        for image in self.host.client.images():
+            for repo_tag in image.get("RepoTags") or []:
+                if repo_tag != "<none>:<none>":
+                    result[repo_tag] = image["Id"]
+        return result
+
     def get_registry_url(self, app, task):
         """
         Gets the current registry URL based on the app config, returning the
@@ -67,11 +85,25 @@ class ImageRepository:
         else:
             raise BadConfigError("No registry plugin {} loaded".format(plugin_name))
 
-    def pull_image_version(self, app, image_name, image_tag, parent_task, fail_silently=False):
+    def pull_image_version(
+        self,
+        app,
+        image_name,
+        image_tag,
+        parent_task,
+        fail_silently=False,
+        registry_url=None,
+        progress=None,
+    ):
         """
         Pulls the most recent version of the given image tag from remote
         docker registry.
+
+        If registry_url is not passed, it is worked out from the app's config.
+        progress, if passed, is called with (bytes downloaded, bytes total)
+        as the download goes.
         """
+        from docker.errors import NotFound
 
         assert isinstance(image_name, str)
         assert isinstance(image_tag, str)
@@ -91,10 +123,12 @@ class ImageRepository:
         task = Task(
             "Pulling remote image {}".format(image_name),
             parent=parent_task,
-            progress_formatter=lambda x: "{} MB".format(x // (1024**2)),
+            progress_formatter=format_megabytes,
+            collapse_if_finished=progress is not None,
         )
 
-        registry_url = self.get_registry_url(app, task)
+        if registry_url is None:
+            registry_url = self.get_registry_url(app, task)
         if registry_url is None:
             if fail_silently:
                 return None
@@ -143,6 +177,8 @@ class ImageRepository:
 
                 if total is not None:
                     task.update(progress=(current, total))
+                    if progress is not None:
+                        progress(current, total)
 
         task.finish(status="Done", status_flavor=Task.FLAVOR_GOOD)
 
@@ -169,6 +205,7 @@ class ImageRepository:
         Returns the Docker image hash of the requested image and tag, or
         raises ImageNotFoundException if it's not available on the host.
         """
+        from docker.errors import NotFound
         if image_tag == "local":
             image_tag = "latest"
         try:
@@ -181,3 +218,124 @@ class ImageRepository:
                 image=image_name,
                 image_tag=image_tag,
             )
+
+
+@attr.s
+class PullScheduler:
+    """
+    Pulls images onto a host from several threads at once, up to
+    `concurrency` pulls at a time.
+
+    Each image and tag is only pulled once; anything else asking for it
+    waits for that pull and shares its result. Progress from every pull is
+    added up into one byte-level progress bar.
+    """
+    app = attr.ib()
+    host = attr.ib()
+    parent_task = attr.ib()
+    concurrency = attr.ib(default=4)
+    task = attr.ib(default=None, init=False, repr=False)
+    lock = attr.ib(default=attr.Factory(threading.Lock), init=False, repr=False)
+    semaphore = attr.ib(default=None, init=False, repr=False)
+    # {(image name, tag): Future of True (pulled) or False (failed)}
+    pulls = attr.ib(default=attr.Factory(dict), init=False, repr=False)
+    # {(image name, tag): (bytes downloaded, bytes total)}
+    progress = attr.ib(default=attr.Factory(dict), init=False, repr=False)
+    # Set once the registry has been looked up; the URL can be None if there is no registry
+    registry_url = attr.ib(default=None, init=False, repr=False)
+    registry_resolved = attr.ib(default=False, init=False, repr=False)
+    registry_lock = attr.ib(default=attr.Factory(threading.Lock), init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        self.semaphore = threading.BoundedSemaphore(self.concurrency)
+        self.task = Task(
+            "Pulling images",
+            parent=self.parent_task,
+            hide_if_empty=True,
+            progress_formatter=format_megabytes,
+        )
+
+    def pull(self, container):
+        """
+        Pulls the container's image if it's not already been tried, and
+        returns True if it was pulled.
+        """
+        key = (container.image_name, container.image_tag)
+        with self.lock:
+            future = self.pulls.get(key)
+            first = future is None
+            if first:
+                future = self.pulls[key] = Future()
+        if not first:
+            return future.result()
+        try:
+            # Checked before the registry, so local images never log in to it
+            if container.image_tag == "local":
+                raise ImagePullFailure("Cannot pull a local image", remote_name=None, image_tag=container.image_tag)
+            registry_url = self.get_registry_url()
+            if registry_url is None:
+                raise ImagePullFailure("No registry configured", remote_name=None, image_tag=container.image_tag)
+            with self.semaphore:
+                self.host.images.pull_image_version(
+                    self.app,
+                    container.image_name,
+                    container.image_tag,
+                    parent_task=self.task,
+                    fail_silently=False,
+                    registry_url=registry_url,
+                    progress=lambda current, total: self.update_progress(key, current, total),
+                )
+        except ImagePullFailure:
+            future.set_result(False)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(True)
+        return future.result()
+
+    def get_registry_url(self):
+        """
+        Works out the registry URL once, so registry plugins only log in once.
+        Returns None if there is no registry.
+        """
+        # Not under self.lock, as logging in can take a while (or ask the user things)
+        with self.registry_lock:
+            if not self.registry_resolved:
+                self.registry_url = self.host.images.get_registry_url(self.app, self.task)
+                self.registry_resolved = True
+            return self.registry_url
+
+    def update_progress(self, key, current, total):
+        with self.lock:
+            self.progress[key] = (current, total)
+            current = sum(value[0] for value in self.progress.values())
+            total = sum(value[1] for value in self.progress.values())
+        self.task.update(progress=(current, total))
+
+    def run_all(self, items, function):
+        """
+        Calls function(item) for every item on a pool of threads (so any
+        pulls it does happen concurrently), and returns {item: result}.
+        """
+        results = {}
+        completions = queue.Queue()
+        pool = WorkerPool(max(1, min(len(items), self.concurrency)), completions)
+
+        def call(item):
+            results[item] = function(item)
+
+        try:
+            for item in items:
+                pool.submit(item, call)
+            for _ in items:
+                _, exception = completions.get()
+                if exception is not None:
+                    raise exception
+        finally:
+            pool.shutdown()
+        return results
+
+    def finish(self):
+        if self.pulls:
+            self.task.finish(status="Done", status_flavor=Task.FLAVOR_GOOD)
@@ -1,4 +1,8 @@
 import attr
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from ..containers.formation import ContainerFormation, ContainerInstance
 from ..exceptions import DockerRuntimeError
 
@@ -14,21 +18,43 @@ class FormationIntrospector:
     graph = attr.ib()
     network = attr.ib(default=None)
     formation = attr.ib(init=False)
+    # {"name:tag": image hash}, fetched at most once per introspection
+    _image_ids = attr.ib(default=None, init=False, repr=False)
 
     def __attrs_post_init__(self):
         if self.network is None:
             self.network = self.graph.prefix
 
+    # Label we put on every container we launch, naming its graph container
+    LABEL = "com.eventbrite.bay.container"
+
+    # Number of containers to inspect at once when the list API is missing details
+    # (older API versions, or containers from before links were labelled)
+    INSPECT_WORKERS = 8
+
     def introspect(self):
         """
         Runs the introspection and returns a ContainerFormation.
         """
         # Make the formation
         self.formation = ContainerFormation(self.graph, self.network)
-        # Go through all containers on the remote host that are running and on the right network
-        for container in self.host.client.containers(all=False):
-            if self.network in container['NetworkSettings']['Networks']:
-                self.add_container(container['Names'][0].lstrip("/"))
+        self._image_ids = None
+        # List all containers on the remote host that are running and on the right
+        # network in one call. The filters are also checked here, as older
+        # Docker versions ignore ones they don't know.
+        summaries = [
+            summary
+            for summary in self.host.client.containers(
+                all=False,
+                filters={"network": self.network, "label": self.LABEL},
+            )
+            if self.network in summary['NetworkSettings']['Networks']
+        ]
+        # Fill in anything the list API doesn't give us, inspecting concurrently
+        with ThreadPoolExecutor(max_workers=self.INSPECT_WORKERS) as executor:
+            all_details = list(executor.map(self._container_details, summaries))
+        for details in all_details:
+            self.formation.add_instance(self._create_container(details))
         # As a second phase, go through and resolve links
         for instance in self.formation:
             instance.resolve_links()
@@ -38,68 +64,252 @@ class FormationIntrospector:
         """
         Returns a single container introspected directly.
         """
-        # Inspect image and list images have different formats, so we use list with filter here to match the other code
-        details = self.host.client.containers(filters={"name": name})
+        self._image_ids = None
+        # The name filter matches substrings, so pick out the exact match
+        details = [
+            summary
+            for summary in self.host.client.containers(filters={"name": name})
+            if "/" + name in summary['Names']
+        ]
         if not details:
             raise DockerRuntimeError("Cannot introspect single container {}".format(name))
-        return self._create_container(details[0])
+        return self._create_container(self._container_details(details[0]))
+
+    def _container_details(self, summary):
+        """
+        Turns a container summary from the list API into the details we need:
+        {name, labels, image, image_id, links, mounts, ip_address, port_mapping}.
+        The list API gives links as null, so they come from the label we put
+        on containers when creating them. The container is only inspected if
+        the summary is missing mounts (older API versions) or it has no links
+        label (it was created by an older bay).
+        """
+        network = summary['NetworkSettings']['Networks'][self.network]
+        labels = summary.get('Labels') or {}
+        links = network.get('Links') or None
+        if links is None and ContainerInstance.LINKS_LABEL in labels:
+            links = json.loads(labels[ContainerInstance.LINKS_LABEL])
+        if "Mounts" in summary and links is not None:
+            port_mapping = {}
+            for port in summary.get('Ports') or []:
+                if port.get('PublicPort'):
+                    port_mapping.setdefault(port['PrivatePort'], port['PublicPort'])
+            image_id = summary.get('ImageID') or summary['Image']
+            return {
+                "name": summary['Names'][0].lstrip("/"),
+                "labels": labels,
+                "image": summary['Image'],
+                "image_id": image_id if image_id and image_id.startswith("sha256:") else None,
+                "links": links,
+                "mounts": [mount['Destination'] for mount in summary['Mounts']],
+                "ip_address": network['IPAddress'],
+                "port_mapping": port_mapping,
+            }
+        inspected = self.host.client.inspect_container(summary['Id'])
+        network = inspected['NetworkSettings']['Networks'][self.network]
+        port_mapping = {}
+        for container_port, host_details in (inspected['NetworkSettings'].get('Ports') or {}).items():
+            if host_details:
+                port_mapping[int(container_port.split("/", 1)[0])] = int(host_details[0]['HostPort'])
+        image = inspected['Image']
+        return {
+            "name": inspected['Name'].lstrip("/"),
+            "labels": inspected['Config']['Labels'] or {},
+            "image": inspected['Config'].get('Image') or image,
+            "image_id": image if image.startswith("sha256:") else None,
+            "links": network.get('Links') or [],
+            "mounts": [mount['Destination'] for mount in inspected['Mounts']],
+            "ip_address": network['IPAddress'],
+            "port_mapping": port_mapping,
+        }
 
-    def add_container(self, container_details):
-        instance = self._create_container(container_details)
-        self.formation.add_instance(instance)
+    def _resolve_image_id(self, image):
+        """
+        Converts an image name into its hash, listing all images on the host
+        once per introspection rather than inspecting each one.
+        """
+        name, _, tag = image.partition(":")
+        if self._image_ids is None:
+            self._image_ids = self.host.images.tagged_image_ids()
+        image_id = self._image_ids.get("{}:{}".format(name, tag or "latest"))
+        if image_id is None:
+            # Not tagged any more; let the repository deal with it (and error)
+            image_id = self.host.images.image_version(name, tag or "latest")
+        return image_id
 
-    def _create_container(self, container_name):
+    def _create_container(self, details):
         """
-        Returns a container build from introspected information
+        Returns a container instance built from introspected details
         """
-        container_details = self.host.client.inspect_container(container_name)
         # Find the container name in the graph
         try:
-            labels = container_details['Config']['Labels']
             # Use the bay-specific (not eventbrite-specific, just named uniquely as per the docker label spec) label
             # to work out what container name this was.
-            container = self.graph[labels['com.eventbrite.bay.container']]
+            container = self.graph[details['labels'][self.LABEL]]
         except KeyError:
             raise DockerRuntimeError(
-                "Cannot find local container for running container {}".format(container_name)
+                "Cannot find local container for running container {}".format(details['name'])
             )
         # Get the image hash
-        image = container_details['Image']
-        assert ":" in image
-        if image.startswith("sha256:"):
-            image_id = image
-        else:
-            # It's a string name of a image
-            # CONVERT IMAGE NAME INTO HASH USING REPO
-            name, tag = image.split(":", 1)
-            image_id = self.host.images.image_version(name, tag)
+        image_id = details['image_id'] or self._resolve_image_id(details['image'])
         # Work out links
         links = {}
-        for link in (container_details['NetworkSettings']['Networks'][self.network].get('Links', None) or []):
+        for link in details['links']:
             linked_container_name, link_alias = link.split(":", 1)
             links[link_alias] = linked_container_name
         # Work out devmodes
-        mounted_targets = set()
+        mounted_targets = set(details['mounts'])
         devmodes = set()
-        for mount in container_details['Mounts']:
-            mounted_targets.add(mount['Destination'])
         for devmode, mounts in container.devmodes.items():
             if all((destination in mounted_targets) for destination in mounts.keys()):
                 devmodes.add(devmode)
         # Make a formation instance
         instance = ContainerInstance(
-            name=container_name,
+            name=details['name'],
             container=container,
             image_id=image_id,
             links=links,
             devmodes=devmodes,
+            recorded_fingerprint=details['labels'].get(ContainerInstance.FINGERPRINT_LABEL),
         )
         # Set extra networking attributes because it's running
-        instance.ip_address = container_details['NetworkSettings']['Networks'][self.network]['IPAddress']
-        instance.port_mapping = {}
-        for container_port, host_details in container_details['NetworkSettings'].get('Ports', {}).items():
-            if host_details:
-                private_port = int(container_port.split("/", 1)[0])
-                public_port = int(host_details[0]['HostPort'])
-                instance.port_mapping[private_port] = public_port
+        instance.ip_address = details['ip_address']
+        instance.port_mapping = details['port_mapping']
         return instance
+
+
+@attr.s
+class FormationCache:
+    """
+    App-wide cache of the formation running on each host, so one command
+    introspects each host once rather than every time something asks.
+
+    Callers always get a clone they can change freely. The runner keeps the
+    cached copy up to date as it starts and stops containers, telling us
+    which events to expect first; any other start/die/destroy event for our
+    containers (i.e. someone else changed things) throws the copy away.
+    """
+    app = attr.ib()
+    # {host alias: ContainerFormation}
+    formations = attr.ib(default=attr.Factory(dict), init=False, repr=False)
+    # {(host alias, container name, event action)} for our own changes
+    expected = attr.ib(default=attr.Factory(set), init=False, repr=False)
+    lock = attr.ib(default=attr.Factory(threading.RLock), init=False, repr=False)
+    # Aliases of hosts whose events this process is following
+    followed = attr.ib(default=attr.Factory(set), init=False, repr=False)
+    # Aliases of hosts whose cached formation came from the parent process
+    inherited = attr.ib(default=attr.Factory(set), init=False, repr=False)
+
+    def get(self, host, follow=True):
+        """
+        Returns a copy of the formation currently running on the host.
+        Pass follow=False to skip subscribing to events if the caller is only
+        going to look at it.
+        """
+        with self.lock:
+            if host.alias in self.inherited:
+                self.inherited.discard(host.alias)
+                self.catch_up(host)
+            # Subscribe before looking so nothing can change unseen in between
+            if follow and host.alias not in self.followed:
+                self.follow_events(host)
+            if host.alias not in self.formations:
+                with self.app.timings.phase("introspect"):
+                    self.formations[host.alias] = FormationIntrospector(host, self.app.containers).introspect()
+            return self.formations[host.alias].clone()
+
+    def follow_events(self, host):
+        from docker.errors import DockerException
+        if self.on_event not in host.events.listeners:
+            host.events.listeners.append(self.on_event)
+        try:
+            host.events.start(self.app.containers.prefix)
+        except (DockerException, OSError):
+            # Without events the cache is still right for our own changes
+            pass
+        else:
+            self.followed.add(host.alias)
+
+    def catch_up(self, host):
+        """
+        Applies the events the parent process had not seen yet when it forked
+        us to a formation inherited from it, or drops it if we can't.
+        """
+        from .events import stream_errors
+        if self.on_event not in host.events.listeners:
+            host.events.listeners.append(self.on_event)
+        try:
+            host.events.catch_up(self.app.containers.prefix)
+        except stream_errors():
+            self.formations.pop(host.alias, None)
+
+    def after_fork(self):
+        """
+        Keeps the cached formations in a forked child, but follows their
+        hosts' events again (from where the parent got to) when next asked,
+        as the parent's event threads do not survive the fork. Before any
+        inherited formation is used, events the parent had not got to yet
+        are applied to it, so a change just made by a previous command
+        is never missed.
+        """
+        self.followed.clear()
+        self.inherited = set(self.formations)
+
+    def invalidate(self, host=None):
+        with self.lock:
+            if host is None:
+                self.formations.clear()
+            else:
+                self.formations.pop(host.alias, None)
+
+    def expect(self, host, name, action):
+        """
+        Notes that we are about to cause the given event, so it does not
+        invalidate the cache when it arrives.
+        """
+        with self.lock:
+            self.expected.add((host.alias, name, action))
+
+    def record_started(self, host, instance):
+        """
+        Adds a newly started (and introspected) instance to the cached formation.
+        """
+        with self.lock:
+            formation = self.formations.get(host.alias)
+            if formation is not None:
+                formation.discard_instance(instance.name)
+                formation.add_instance(instance)
+                instance.resolve_links()
+
+    def record_stopped(self, host, name):
+        """
+        Removes a stopped container from the cached formation.
+        """
+        with self.lock:
+            formation = self.formations.get(host.alias)
+            if formation is not None:
+                formation.discard_instance(name)
+
+    def record_plan(self, host, plan):
+        """
+        Updates the cached formation as if an ExecutionPlan had been carried
+        out, so that later plans in a dry run build on it.
+        """
+        from .plan import PlanAction
+        for instance in plan.instances(PlanAction.STOP):
+            self.record_stopped(host, instance.name)
+        for instance in plan.instances(PlanAction.START):
+            self.record_started(host, instance.clone())
+
+    def on_event(self, host, name, action):
+        with self.lock:
+            key = (host.alias, name, action)
+            if key in self.expected:
+                self.expected.discard(key)
+                return
+            formation = self.formations.get(host.alias)
+            if formation is None:
+                return
+            running = name in formation.container_instances
+            if (action == "start" and not running) or (action in ("die", "destroy") and running):
+                self.formations.pop(host.alias)
@@ -0,0 +1,78 @@
+import socket
+import threading
+
+import attr
+
+
+@attr.s
+class LogStream:
+    """
+    A followed log stream for a container, on its own connection with no read
+    timeout (the log can be quiet for a long time).
+
+    Iterate over it for chunks of output. It can be closed from any thread,
+    which also ends an iteration that is blocked waiting for output, so
+    readers don't hold a connection open once nobody needs the log.
+    """
+
+    client = attr.ib(repr=False)
+    chunks = attr.ib(repr=False)
+    response = attr.ib(repr=False)
+    closed = attr.ib(default=False, init=False)
+    lock = attr.ib(default=attr.Factory(threading.Lock), init=False, repr=False)
+
+    @classmethod
+    def open(cls, host, container_name, stdout=True, stderr=True, timestamps=False, since=None):
+        """
+        Starts following the named container's log, from the given Unix
+        timestamp if there is one.
+        """
+        client = host.make_client()
+        client.timeout = None
+        params = {
+            "stdout": int(stdout),
+            "stderr": int(stderr),
+            "timestamps": int(timestamps),
+            "follow": 1,
+            "tail": "all",
+        }
+        if since is not None:
+            params["since"] = since
+        # Make the request ourselves (rather than with logs()), as we have to
+        # keep hold of the HTTP response to close it
+        response = client._get(client._url("/containers/{0}/logs", container_name), params=params, stream=True)
+        try:
+            # Demultiplexes the output, or not for a container with a TTY
+            chunks = client._get_result(container_name, True, response)
+        except Exception:
+            response.close()
+            client.close()
+            raise
+        return cls(client, chunks, response)
+
+    def __iter__(self):
+        try:
+            for chunk in self.chunks:
+                yield chunk
+        except Exception:
+            # Reads fail once we are closed; anything else ends the stream too
+            if not self.closed:
+                raise
+
+    def close(self):
+        """
+        Closes the connection. Safe to call more than once.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        # Shutting the socket down wakes a reader blocked on it, which closing alone doesn't
+        try:
+            sock = self.client._get_raw_response_socket(self.response)
+            sock = getattr(sock, "_sock", sock)
+            sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        self.response.close()
+        self.client.close()
@@ -0,0 +1,116 @@
+import attr
+
+
+@attr.s
+class PlanAction:
+    """
+    A single step of an ExecutionPlan: stopping, creating, reusing or
+    starting one container instance.
+
+    :kind: One of STOP, CREATE, REUSE or START
+    :instance: The ContainerInstance the action is for
+    :reason: Why the action is needed, in plain English
+    :after: The PlanActions that must finish before this one can run
+    """
+    STOP = "stop"
+    CREATE = "create"
+    # Starting a stopped container with the same spec again instead of creating one
+    REUSE = "reuse"
+    START = "start"
+
+    kind = attr.ib()
+    instance = attr.ib()
+    reason = attr.ib()
+    after = attr.ib(default=attr.Factory(list), repr=False)
+
+    @property
+    def key(self):
+        return "{}:{}".format(self.kind, self.instance.name)
+
+    def as_dict(self):
+        return {
+            "action": self.kind,
+            "name": self.instance.name,
+            "container": self.instance.container.name,
+            "reason": self.reason,
+            "after": sorted(action.key for action in self.after),
+        }
+
+
+@attr.s
+class ExecutionPlan:
+    """
+    The changes needed to bring a host's running formation in line with a
+    target one, as an ordered list of PlanActions with their dependency edges.
+
+    Plans are built by FormationRunner.plan() and carried out by
+    FormationRunner.execute(); in between they can be shown to the user or
+    serialised with as_dict().
+    """
+    host = attr.ib()
+    actions = attr.ib(default=attr.Factory(list))
+    actions_by_key = attr.ib(default=attr.Factory(dict), init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        for action in list(self.actions):
+            self.actions_by_key[action.key] = action
+
+    def add(self, kind, instance, reason, after=()):
+        """
+        Adds a new action to the end of the plan and returns it.
+        """
+        action = PlanAction(kind=kind, instance=instance, reason=reason, after=list(after))
+        self.actions.append(action)
+        self.actions_by_key[action.key] = action
+        return action
+
+    def get(self, kind, instance):
+        """
+        Returns the action of the given kind for the instance, or None.
+        """
+        return self.actions_by_key.get("{}:{}".format(kind, instance.name))
+
+    def instances(self, kind):
+        """
+        Returns the instances that have an action of the given kind, in plan order.
+        """
+        return [action.instance for action in self.actions if action.kind == kind]
+
+    def dependencies(self, kind, instance):
+        """
+        Returns the instances whose actions of the same kind must finish
+        before the instance's action of that kind can run.
+        """
+        return [
+            action.instance
+            for action in self.get(kind, instance).after
+            if action.kind == kind
+        ]
+
+    @property
+    def empty(self):
+        return not self.actions
+
+    def as_dict(self):
+        return {
+            "host": self.host.alias,
+            "noop": self.empty,
+            "actions": [action.as_dict() for action in self.actions],
+        }
+
+    def describe(self):
+        """
+        Returns the plan as lines of human-readable text.
+        """
+        if self.empty:
+            return ["Nothing to do on {}.".format(self.host.alias)]
+        lines = ["Plan for {}:".format(self.host.alias)]
+        for action in self.actions:
+            line = "  {:<7}{:<30}{}".format(action.kind, action.instance.container.name, action.reason)
+            if action.after:
+                line += " (after {})".format(", ".join(sorted(
+                    "{} {}".format(after.kind, after.instance.container.name)
+                    for after in action.after
+                )))
+            lines.append(line)
+        return lines
@@ -0,0 +1,133 @@
+import base64
+import collections
+import io
+import json
+import tarfile
+import threading
+import time
+
+import attr
+
+from ..utils.threading import KeyedLock
+
+
+@attr.s(frozen=True)
+class FileStat:
+    """
+    What Docker reports about a path inside a container.
+    """
+    name = attr.ib()
+    size = attr.ib()
+    mode = attr.ib()
+    mtime = attr.ib()
+
+
+@attr.s
+class FileProbe:
+    """
+    Checks for files inside containers on a host without downloading them.
+
+    Existence, size and mtime come from a HEAD request on the archive
+    endpoint, which returns the stat of the path in a header. Content is only
+    fetched for small files, and only when their stat has changed since it
+    was last fetched. Stats are cached for `ttl` seconds (one check "tick"),
+    and concurrent lookups of the same path share one request, so several
+    waits on one container cost a single request per tick.
+    """
+    # Largest file read() will download
+    MAX_READ_SIZE = 64 * 1024
+
+    # How many paths to keep stats and contents for, so that a long-lived
+    # process (like the daemon) does not keep them for every path it ever saw
+    MAX_ENTRIES = 256
+
+    host = attr.ib()
+    ttl = attr.ib(default=0.5)
+    # {(container, path): (time, FileStat or None)}, least recently used first
+    stats = attr.ib(default=attr.Factory(collections.OrderedDict), init=False, repr=False)
+    # {(container, path): (FileStat, contents)}, least recently used first
+    contents = attr.ib(default=attr.Factory(collections.OrderedDict), init=False, repr=False)
+    locks = attr.ib(default=attr.Factory(KeyedLock), init=False, repr=False)
+    # Guards the two caches above, which lookups of different paths share
+    cache_lock = attr.ib(default=attr.Factory(threading.Lock), init=False, repr=False)
+
+    def stat(self, container, path):
+        """
+        Returns a FileStat for the path in the container, or None if it (or
+        the container) does not exist.
+        """
+        key = (container, path)
+        with self.locks.lock(key):
+            cached = self.cached(self.stats, key)
+            if cached is not None and time.monotonic() - cached[0] < self.ttl:
+                return cached[1]
+            client = self.host.client
+            response = client.head(client._url("/containers/{0}/archive", container), params={"path": path})
+            if response.status_code == 404:
+                result = None
+            else:
+                client._raise_for_status(response)
+                result = self.decode_stat(response.headers.get("X-Docker-Container-Path-Stat"))
+            self.remember(self.stats, key, (time.monotonic(), result))
+            return result
+
+    def cached(self, cache, key):
+        """
+        Returns the entry for the key in one of the caches, or None.
+        """
+        with self.cache_lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def remember(self, cache, key, value):
+        """
+        Stores an entry in one of the caches, dropping the least recently
+        used entries once there are too many.
+        """
+        with self.cache_lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.MAX_ENTRIES:
+                cache.popitem(last=False)
+
+    @staticmethod
+    def decode_stat(header):
+        if not header:
+            return None
+        data = json.loads(base64.b64decode(header).decode("utf8"))
+        return FileStat(
+            name=data.get("name"),
+            size=data.get("size"),
+            mode=data.get("mode"),
+            mtime=data.get("mtime"),
+        )
+
+    def exists(self, container, path):
+        return self.stat(container, path) is not None
+
+    def read(self, container, path):
+        """
+        Returns the contents of a small regular file in the container as a
+        string, or None if it does not exist or is too big.
+        """
+        from docker.errors import NotFound
+        stat = self.stat(container, path)
+        if stat is None or stat.size is None or stat.size > self.MAX_READ_SIZE:
+            return None
+        key = (container, path)
+        cached = self.cached(self.contents, key)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+        try:
+            stream, _ = self.host.client.get_archive(container, path)
+        except NotFound:
+            return None
+        with tarfile.open(fileobj=io.BytesIO(stream.read()), mode="r") as archive:
+            member = archive.next()
+            if member is None or not member.isfile():
+                return None
+            contents = archive.extractfile(member).read().decode("utf8", "replace")
+        self.remember(self.contents, key, (stat, contents))
+        return contents
@@ -0,0 +1,185 @@
+import asyncio
+import functools
+import random
+import threading
+import time
+
+import attr
+
+from ..exceptions import DockerRuntimeError
+
+
+@attr.s
+class ReadinessEngine:
+    """
+    Runs the readiness checks ("waits") of every starting container on one
+    asyncio event loop in a background thread, rather than each container
+    polling its waits one after the other from its own thread.
+
+    Each wait is retried with exponential backoff and jitter until it passes,
+    its own timeout runs out, or the engine's overall timeout for the
+    container (counted from when its waits were submitted) is reached. A container dying fails all of its
+    waits straight away. Waits with a `ready_async` coroutine method are
+    checked on the loop itself; anything else has its blocking `ready()`
+    run in the loop's default thread pool.
+    """
+    # Seconds before the first retry of a wait; doubles on each failure up to MAX_DELAY
+    INITIAL_DELAY = 0.05
+    MAX_DELAY = 1
+    # Seconds between checks that the container is still running, when there are no events
+    LIVENESS_INTERVAL = 1
+
+    timeout = attr.ib(default=None)
+    loop = attr.ib(default=None, init=False, repr=False)
+    lock = attr.ib(default=attr.Factory(threading.Lock), init=False, repr=False)
+    # {(host alias, container name): future that completes when the container dies}
+    deaths = attr.ib(default=attr.Factory(dict), init=False, repr=False)
+    watched_hosts = attr.ib(default=attr.Factory(set), init=False, repr=False)
+
+    def start(self):
+        """
+        Starts the event loop thread, if it's not already running.
+        """
+        with self.lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        thread.start()
+
+    def wait(self, host, instance, waits, on_ready=None):
+        """
+        Blocks until all the waits for the instance pass. Waits are given as
+        a list of (wait, timeout in seconds or None) tuples, and
+        on_ready(wait, seconds) is called as each one first passes.
+
+        Returns a list of (wait, seconds from the call until it was first ready).
+        Raises DockerRuntimeError if the container dies or a timeout is hit.
+        """
+        # Each call gets the whole timeout, however long the engine has been running
+        deadline = None if not self.timeout else time.monotonic() + self.timeout
+        self.start()
+        self.watch_host(host)
+        future = asyncio.run_coroutine_threadsafe(
+            self.wait_instance(host, instance, waits, on_ready, deadline),
+            self.loop,
+        )
+        return future.result()
+
+    def watch_host(self, host):
+        """
+        Listens to the host's events for containers dying.
+        """
+        with self.lock:
+            if host.alias in self.watched_hosts:
+                return
+            self.watched_hosts.add(host.alias)
+        host.events.listeners.append(self.on_event)
+
+    def on_event(self, host, name, action):
+        # Called from the event stream's thread
+        if action in ("die", "destroy"):
+            self.loop.call_soon_threadsafe(self.container_died, host.alias, name)
+
+    def container_died(self, host_alias, name):
+        died = self.deaths.get((host_alias, name))
+        if died is not None and not died.done():
+            died.set_result(True)
+
+    async def wait_instance(self, host, instance, waits, on_ready, deadline):
+        started = time.monotonic()
+        key = (host.alias, instance.name)
+        died = self.loop.create_future()
+        self.deaths[key] = died
+        checks = [
+            asyncio.ensure_future(self.run_wait(wait, timeout, started, on_ready))
+            for wait, timeout in waits
+        ]
+        watchers = [died, asyncio.ensure_future(self.watch_liveness(host, instance))]
+        all_ready = asyncio.gather(*checks)
+        try:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            done, _ = await asyncio.wait(
+                [all_ready] + watchers,
+                timeout=remaining,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                raise DockerRuntimeError("Timed out after {}s waiting for {} to be ready ({})".format(
+                    self.timeout,
+                    instance.container.name,
+                    ", ".join(wait.description() for (wait, _), check in zip(waits, checks) if not check.done()),
+                ))
+            if died in done:
+                raise DockerRuntimeError(
+                    "Container {} died while waiting for boot completion".format(instance.container.name)
+                )
+            for future in done:
+                # Raises if a wait timed out or the container was found dead
+                future.result()
+        finally:
+            del self.deaths[key]
+            for future in [all_ready] + checks + watchers:
+                future.cancel()
+            # Collect cancelled futures' exceptions so they are not logged
+            await asyncio.gather(all_ready, *(checks + watchers), return_exceptions=True)
+        return [(wait, check.result()) for (wait, _), check in zip(waits, checks)]
+
+    async def run_wait(self, wait, timeout, started, on_ready):
+        """
+        Checks a single wait until it passes, backing off between attempts.
+        Returns the seconds it took to pass.
+        """
+        attempt = 0
+        while True:
+            if timeout is None:
+                ready = await self.check(wait)
+            else:
+                # Checks that wait for something to happen still have to give up in time
+                try:
+                    ready = await asyncio.wait_for(self.check(wait), max(0, timeout - (time.monotonic() - started)))
+                except asyncio.TimeoutError:
+                    ready = False
+            if ready:
+                elapsed = time.monotonic() - started
+                if on_ready is not None:
+                    on_ready(wait, elapsed)
+                return elapsed
+            elapsed = time.monotonic() - started
+            if timeout is not None and elapsed >= timeout:
+                raise DockerRuntimeError("Timed out after {}s waiting for {}".format(timeout, wait.description()))
+            delay = min(self.MAX_DELAY, self.INITIAL_DELAY * 2 ** attempt)
+            attempt += 1
+            delay = random.uniform(delay / 2, delay)
+            if timeout is not None:
+                delay = min(delay, timeout - elapsed)
+            await asyncio.sleep(delay)
+
+    async def check(self, wait):
+        if hasattr(wait, "ready_async"):
+            return await wait.ready_async()
+        return await self.loop.run_in_executor(None, wait.ready)
+
+    async def watch_liveness(self, host, instance):
+        """
+        Fails if the container is not running. With events, the died future
+        covers this after one initial check; without them, it polls.
+        """
+        while True:
+            state = host.events.state(instance.name) if host.events.started else None
+            if state is not None and state["running"]:
+                running = True
+            else:
+                # Events can lag behind, so only trust them when they say it's running
+                running = await self.loop.run_in_executor(
+                    None,
+                    functools.partial(host.container_running, instance.name, ignore_exists=True),
+                )
+            if not running:
+                raise DockerRuntimeError(
+                    "Container {} died while waiting for boot completion".format(instance.container.name)
+                )
+            if host.events.started:
+                # Any later death arrives as an event
+                await self.loop.create_future()
+            await asyncio.sleep(self.LIVENESS_INTERVAL)
@@ -1,25 +1,26 @@
-import dockerpty
+import contextlib
 import functools
+import json
 import os
+import queue
 import sys
 import threading
-import time
-
-from docker.errors import NotFound
 
+from .events import EventStream
 from .introspect import FormationIntrospector
+from .plan import ExecutionPlan, PlanAction
 from .towline import Towline
 from ..cli.tasks import Task
 from ..constants import PluginHook
 from ..exceptions import DockerRuntimeError, DockerInteractiveException, NotFoundException
 from ..utils.sorting import dependency_sort
-from ..utils.threading import ExceptionalThread, ThreadSet
+from ..utils.threading import KeyedLock, WorkerPool
 
 
 network_lock = threading.Lock()
 
 # Tracks which containers are being started/stopped globally to avoid starting the same one twice.
-changing_containers = ThreadSet()
+changing_containers = KeyedLock()
 
 
 class FormationRunner:
@@ -30,125 +31,268 @@ class FormationRunner:
     It can run actions in parallel in background threads if needs be.
     """
 
+    # Seconds another thread starting/stopping a container gets on top of its
+    # wait_timeout before we give up waiting for it
+    LOCK_MARGIN = 300
+
     def __init__(self, app, host, formation, task, stop=True):
         self.app = app
         self.host = host
         self.formation = formation
-        self.introspector = FormationIntrospector(self.host, self.formation.graph)
         self.task = task
         # Allows things to override and not have anything stop
         self.stop = stop
+        # Maximum number of containers to start/stop at once
+        self.concurrency = self.app.config["bay"]["runner_concurrency"]
+        # If stopped containers with an unchanged spec are started again rather than recreated
+        self.reuse_containers = self.app.config["bay"]["reuse_containers"]
+        # Seconds to wait for another thread to finish starting/stopping a container.
+        # The holder may be waiting for its container to boot, so by default
+        # this allows for wait_timeout; with no wait_timeout, wait forever.
+        self.lock_timeout = self.app.config["bay"]["lock_timeout"] or None
+        wait_timeout = self.app.config["bay"]["wait_timeout"]
+        if self.lock_timeout is None and wait_timeout:
+            self.lock_timeout = wait_timeout + self.LOCK_MARGIN
 
     def run(self):
         """
         Runs through and performs all the actions. Blocks until completion.
         """
-        self.actions = []
+        self.execute(self.plan())
+
+    def plan(self, current_formation=None):
+        """
+        Works out what needs to happen to turn the formation running on the
+        host (or current_formation, if given) into the target one, and
+        returns it as an ExecutionPlan without changing anything.
+        """
         # Check the formation is valid
         self.formation.validate()
+        if current_formation is None:
+            current_formation = self.app.formations.get(self.host)
+        plan = ExecutionPlan(self.host)
         # Work out what containers need turning off, and which need turning on
         # Containers that have changes will need both.
-        to_stop = set()
-        to_start = set()
-        current_formation = self.introspector.introspect()
+        stop_reasons = {}
+        start_reasons = {}
         for instance in current_formation:
             if instance not in self.formation:
-                to_stop.add(instance)
+                stop_reasons[instance] = "not in the target formation"
         # Now see if there are any that are entirely new
         for instance in self.formation:
             if instance not in current_formation:
-                to_start.add(instance)
+                start_reasons[instance] = "not running"
             else:
                 # It's in both - stop and start if it's changed
-                if instance.different_from(current_formation[instance.name]):
-                    to_stop.add(instance)
-                    to_start.add(instance)
+                differences = instance.differences(current_formation[instance.name])
+                if differences:
+                    stop_reasons[current_formation[instance.name]] = "recreate: {}".format(", ".join(differences))
+                    start_reasons[instance] = "recreate: {}".format(", ".join(differences))
+        if not self.stop:
+            # Nothing gets stopped, so changed containers are left as they are
+            stop_reasons = {}
+            start_reasons = {
+                instance: reason
+                for instance, reason in start_reasons.items()
+                if instance not in current_formation
+            }
+
+        # Stopping an instance means stopping everything that links to it first
+        @functools.lru_cache(maxsize=512)
+        def get_incoming_links(instance):
+            result = set()
+            for potential_linker in current_formation:
+                links_to = potential_linker.links.values()
+                if instance in links_to:
+                    result.add(potential_linker)
+            return result
+
+        to_stop = dependency_sort(stop_reasons, get_incoming_links)
+        for instance in to_stop:
+            if instance not in stop_reasons:
+                stop_reasons[instance] = "links to {}".format(", ".join(sorted(
+                    target.container.name
+                    for target in instance.links.values()
+                    if target in to_stop
+                )))
+                # It still needs to be running afterwards. The target formation
+                # only has an introspected copy of it, without its environment or
+                # command, so make it again from its bay.yaml to start it.
+                if instance in self.formation and instance not in start_reasons:
+                    self.formation.discard_instance(instance.name)
+                    restarted = self.formation.add_container(instance.container, self.host)
+                    start_reasons[restarted] = "restart: {}".format(stop_reasons[instance])
+            plan.add(
+                PlanAction.STOP,
+                instance,
+                stop_reasons[instance],
+                after=[plan.get(PlanAction.STOP, linker) for linker in get_incoming_links(instance)],
+            )
+
+        # Starting waits for everything it links to that isn't already running
+        for instance in dependency_sort(start_reasons, lambda instance: instance.links.values()):
+            if instance not in start_reasons:
+                continue
+            stop_action = plan.get(PlanAction.STOP, instance)
+            launch_action = plan.add(
+                PlanAction.REUSE if self.will_reuse(instance, current_formation) else PlanAction.CREATE,
+                instance,
+                start_reasons[instance],
+                after=[stop_action] if stop_action else [],
+            )
+            plan.add(
+                PlanAction.START,
+                instance,
+                start_reasons[instance],
+                after=[launch_action] + [
+                    plan.get(PlanAction.START, target)
+                    for target in instance.links.values()
+                    if target in start_reasons
+                ],
+            )
+        return plan
+
+    def will_reuse(self, instance, current_formation):
+        """
+        Works out if starting the instance will start a stopped container
+        again rather than create a new one, without changing anything.
+
+        Plugins can still change the spec when the container is started, so
+        this compares the spec from before they ran; if the container turns
+        out not to be reusable after all, start_container creates one anyway.
+        """
+        from docker.errors import NotFound
+        if not self.reuse_containers or instance.foreground:
+            return False
+        if instance in current_formation:
+            # It's running now, so it will be stopped first and then started as it is
+            recorded_fingerprint = current_formation[instance.name].recorded_fingerprint
+        else:
+            try:
+                details = self.host.client.inspect_container(instance.name)
+            except NotFound:
+                return False
+            if details['State']['Running']:
+                return False
+            labels = details['Config'].get('Labels') or {}
+            if labels.get(EventStream.NETWORK_LABEL) != instance.formation.network:
+                return False
+            recorded_fingerprint = labels.get(instance.FINGERPRINT_LABEL)
+        return recorded_fingerprint is not None and recorded_fingerprint == instance.fingerprint()
+
+    def execute(self, plan):
+        """
+        Carries out an ExecutionPlan. Blocks until completion.
+        """
+        self.actions = []
         # Stop containers in parallel
-        if to_stop and self.stop:
-            self.stop_containers(to_stop)
+        if plan.instances(PlanAction.STOP):
+            with self.app.timings.phase("stop containers"):
+                self.stop_containers(plan)
         # Start containers in parallel
-        if to_start:
-            self.start_containers(to_start)
+        if plan.instances(PlanAction.START):
+            # Follow container events so boot failures are seen as they happen
+            self.host.events.start(self.formation.network)
+            with self.app.timings.phase("start containers"):
+                self.start_containers(plan)
+        for name, stats in sorted(changing_containers.contended().items()):
+            self.app.timings.note("lock {}: waited {} times, {:.1f}ms total".format(
+                name,
+                stats["contended"],
+                stats["waited"] * 1000,
+            ))
+
+    @contextlib.contextmanager
+    def container_lock(self, instance):
+        """
+        Holds the global lock for the instance's container name, so two threads
+        never start or stop the same container at once. Gives up with a
+        DockerRuntimeError (which commands report) after lock_timeout.
+        """
+        try:
+            changing_containers.acquire(instance.name, timeout=self.lock_timeout)
+        except TimeoutError:
+            raise DockerRuntimeError(
+                "Timed out waiting for another operation on {} to finish".format(instance.container.name)
+            )
+        try:
+            yield
+        finally:
+            changing_containers.release(instance.name)
 
     # Shared "dependency-based parallel execution" code
 
-    def parallel_execute(self, instances, ready_to_execute, executor, done=None):
+    def parallel_execute(self, instances, dependencies, executor, done=None):
         """
-        Runs the "executor" in parallel threads on "instances" when the condition
-        "ready_to_execute" is met for an instance. Handles deadlocking as well.
+        Runs the "executor" on "instances" on a pool of worker threads. Each
+        instance is started as soon as everything "dependencies(instance)"
+        returns is done, either because it was already in "done" or because
+        its own executor finished.
+
+        Anything that can never become ready (its dependencies are neither done
+        nor being run) is reported as a deadlock once everything else finishes.
         """
-        idle_iterations = 0
+        done = set(done or ())
         queued = set(instances)
-        processing = set()
-        done = done or set()
-        threads = {}
-        while queued or processing:
-            # See if we can stop anything new - everything that depends on it must also be stopped
-            for instance in list(queued):
-                if ready_to_execute(instance, done):
-                    threads[instance] = ExceptionalThread(
-                        target=executor,
-                        args=(instance,),
-                        daemon=True,
-                    )
-                    threads[instance].start()
+        # Track what each instance is still waiting on, and the reverse, so
+        # a completion releases its dependents directly.
+        waiting_on = {}
+        dependents = {}
+        for instance in queued:
+            waiting_on[instance] = set(dependencies(instance)) - done
+            for dependency in waiting_on[instance]:
+                dependents.setdefault(dependency, set()).add(instance)
+        ready = [instance for instance in queued if not waiting_on[instance]]
+        completions = queue.Queue()
+        pool = WorkerPool(self.concurrency, completions)
+        running = 0
+        try:
+            while ready or running:
+                for instance in ready:
                     queued.remove(instance)
-                    processing.add(instance)
-                    idle_iterations = 0
-            # See if anything finished stopping
-            for instance in list(processing):
-                if not threads[instance].is_alive():
-                    processing.remove(instance)
-                    done.add(instance)
-                    # Collect exceptions from the thread - if it's an interactive exception, run the rest of it.
-                    try:
-                        threads[instance].maybe_raise()
-                    except DockerInteractiveException as e:
-                        e.handler()
+                    pool.submit(instance, executor)
+                    running += 1
+                ready = []
+                # Wait for something to finish
+                instance, exception = completions.get()
+                running -= 1
+                if exception is not None:
+                    # Interactive exceptions run the rest of their handler in the main thread
+                    if isinstance(exception, DockerInteractiveException):
+                        exception.handler()
                         sys.exit(0)
-                    del threads[instance]
-                    idle_iterations = 0
-            # If there's nothing in progress, we've deadlocked
-            if idle_iterations > 10 and queued and not processing:
-                raise DockerRuntimeError(
-                    "Deadlock during stop: Cannot stop any of {}.".format(
-                        ", ".join(i.name for i in queued),
-                    ),
-                )
-            idle_iterations += 1
-            # Don't idle hot
-            time.sleep(0.1)
+                    raise exception
+                done.add(instance)
+                for dependent in dependents.get(instance, ()):
+                    waiting_on[dependent].discard(instance)
+                    if not waiting_on[dependent]:
+                        ready.append(dependent)
+        finally:
+            pool.shutdown()
+        # Nothing is running and nothing is ready, so anything left is stuck
+        if queued:
+            raise DockerRuntimeError(
+                "Deadlock: Cannot run any of {} - they wait on {}.".format(
+                    ", ".join(sorted(i.name for i in queued)),
+                    ", ".join(sorted(set(d.name for i in queued for d in waiting_on[i]))),
+                ),
+            )
 
     # Stopping
 
-    def stop_containers(self, instances):
+    def stop_containers(self, plan):
         """
-        Stops all the specified containers in parallel, still respecting links
+        Stops all the containers the plan stops in parallel, still respecting links
         """
-        current_formation = self.introspector.introspect()
-
-        # Inner function that we can pass to dependency_sort
-        @functools.lru_cache(maxsize=512)
-        def get_incoming_links(instance):
-            result = set()
-            for potential_linker in current_formation:
-                links_to = potential_linker.links.values()
-                if instance in links_to:
-                    result.add(potential_linker)
-            return result
-
-        # Resolve container list to include descendency
-        instances = dependency_sort(instances, get_incoming_links)
-        # Parallel-stop things
         self.parallel_execute(
-            instances,
-            lambda instance, done: all((linker in done) for linker in get_incoming_links(instance)),
+            plan.instances(PlanAction.STOP),
+            lambda instance: plan.dependencies(PlanAction.STOP, instance),
             executor=self.stop_container,
         )
 
     def stop_container(self, instance):
         # Wait for the global container manipulation lock
-        with changing_containers.entry_lock(instance.name):
+        with self.container_lock(instance):
             # See if it was already stopped
             if not self.host.container_running(instance.name, ignore_exists=True):
                 return
@@ -158,43 +302,145 @@ class FormationRunner:
                 parent=self.task,
                 collapse_if_finished=True,
             )
+            self.app.formations.expect(self.host, instance.name, "die")
             self.host.client.stop(
                 instance.name,
                 timeout=0 if instance.container.fast_kill else 10,
             )
+            self.app.formations.record_stopped(self.host, instance.name)
             stop_task.finish(status="Done", status_flavor=Task.FLAVOR_GOOD)
 
     # Starting
 
-    def start_containers(self, instances):
+    def start_containers(self, plan):
         """
-        Starts all the specified containers in parallel, respecting links
+        Starts all the containers the plan starts in parallel, respecting links
         """
-        current_formation = self.introspector.introspect()
         self.parallel_execute(
-            instances,
-            lambda instance, done: all((dependency in done) for dependency in instance.links.values()),
-            executor=self.start_container,
-            done=set(started_instance for started_instance in current_formation),
+            plan.instances(PlanAction.START),
+            lambda instance: plan.dependencies(PlanAction.START, instance),
+            executor=lambda instance: self.start_container(
+                instance,
+                reuse=plan.get(PlanAction.REUSE, instance) is not None,
+            ),
         )
 
-    def remove_stopped(self, instance):
+    def reusable_container(self, instance, launch_fingerprint, network_id, reuse=True):
         """
-        Sees if there is a container with the same name and removes it if
-        there is and it's stopped.
+        Sees if there is a container with the same name. If it is stopped and
+        was launched with exactly the same spec on the same network, returns
+        its ID so it can be started again as it is, keeping its writable
+        layer. Otherwise removes it (unless it's running, which is an error)
+        and returns None.
+
+        With reuse=False (the plan said to create the container) it is
+        always removed.
         """
-        if self.host.container_exists(instance.name):
-            if self.host.container_running(instance.name):
-                raise DockerRuntimeError("The container {} is already running.".format(instance.container.name))
-            else:
-                self.host.client.remove_container(instance.name)
+        from docker.errors import NotFound
+        try:
+            details = self.host.client.inspect_container(instance.name)
+        except NotFound:
+            return None
+        if details['State']['Running']:
+            raise DockerRuntimeError("The container {} is already running.".format(instance.container.name))
+        labels = details['Config'].get('Labels') or {}
+        networks = details['NetworkSettings'].get('Networks') or {}
+        if (
+            reuse and
+            self.reuse_containers and
+            not instance.foreground and
+            labels.get(instance.LAUNCH_FINGERPRINT_LABEL) == launch_fingerprint and
+            # Older containers lack the label, so their events would not be seen
+            labels.get(EventStream.NETWORK_LABEL) == instance.formation.network and
+            (networks.get(instance.formation.network) or {}).get('NetworkID') == network_id
+        ):
+            return details['Id']
+        self.host.client.remove_container(instance.name)
+        return None
+
+    def create_container(self, instance, fingerprint, launch_fingerprint):
+        """
+        Creates the Docker container for the instance, ready to be started,
+        and returns it.
+        """
+        # Create network configuration for the new container
+        networking_config = self.host.client.create_networking_config({
+            instance.formation.network: self.host.client.create_endpoint_config(
+                aliases=[instance.formation.network],
+                links=[
+                    (link.name, alias)
+                    for alias, link in instance.links.items()
+                ]
+            ),
+        })
+
+        # Work out volumes configuration
+        volume_mountpoints = []
+        volume_binds = {}
+        for mount_path, source in instance.container.bound_volumes.items():
+            if not os.path.isdir(source):
+                raise DockerRuntimeError(
+                    "Volume mount source directory {} does not exist".format(source)
+                )
+            volume_mountpoints.append(mount_path)
+            volume_binds[source] = {"bind": mount_path, "mode": "rw"}
+        for mount_path, source in instance.container.named_volumes.items():
+            volume_mountpoints.append(mount_path)
+            volume_binds[source] = {"bind": mount_path, "mode": "rw"}
+
+        # Add any active devmodes
+        for mount_name in instance.devmodes:
+            for mount_path, source in instance.container.devmodes[mount_name].items():
+                volume_mountpoints.append(mount_path)
+                source = os.path.abspath(source)
+                if os.path.exists(source):
+                    volume_binds[source] = {"bind": mount_path, "mode": "rw"}
+                else:
+                    raise NotFoundException("The volume source path {} does not exist".format(source))
+
+        # Create container. Healthchecks aren't a create_container argument
+        # in older docker-py, so the config is built and then added to.
+        config = self.host.client.create_container_config(
+            instance.image_id,
+            command=instance.command,
+            detach=not instance.foreground,
+            stdin_open=instance.foreground,
+            tty=instance.foreground,
+            # Ports is a list of ports in the container to expose
+            ports=list(instance.ports.keys()),
+            environment=instance.environment,
+            volumes=volume_mountpoints,
+            host_config=self.host.client.create_host_config(
+                binds=volume_binds,
+                port_bindings=instance.ports,
+                publish_all_ports=True,
+                security_opt=['seccomp:unconfined'],
+            ),
+            networking_config=networking_config,
+            labels={
+                "com.eventbrite.bay.container": instance.container.name,
+                EventStream.NETWORK_LABEL: instance.formation.network,
+                instance.LINKS_LABEL: json.dumps(sorted(
+                    "{}:{}".format(link.name, alias)
+                    for alias, link in instance.links.items()
+                )),
+                instance.FINGERPRINT_LABEL: fingerprint,
+                instance.LAUNCH_FINGERPRINT_LABEL: launch_fingerprint,
+            }
+        )
+        if instance.healthcheck is not None:
+            config["Healthcheck"] = instance.healthcheck
+        return self.host.client.create_container_from_config(config, name=instance.name)
 
-    def start_container(self, instance):
+    def start_container(self, instance, reuse=True):
         """
-        Creates the Docker container on the host, ready to be started.
+        Starts the instance on the host, creating a Docker container for it
+        unless a stopped one can be reused (and reuse is True), and waits
+        for it to boot.
         """
+        from docker.errors import NotFound
         # Wait for the global container manipulation lock
-        with changing_containers.entry_lock(instance.name):
+        with self.container_lock(instance):
             # See if the container was already started
             if self.host.container_running(instance.name, ignore_exists=True):
                 return
@@ -205,7 +451,9 @@ class FormationRunner:
                 collapse_if_finished=True,
             )
 
-            self.remove_stopped(instance)
+            # Fingerprint the spec before plugins add to it, as that's what the
+            # next run will compare against
+            fingerprint = instance.fingerprint()
 
             # Run plugins
             self.app.run_hooks(PluginHook.PRE_START, host=self.host, instance=instance, task=start_task)
@@ -213,76 +461,27 @@ class FormationRunner:
             # See if network exists and if not, create it
             with network_lock:
                 try:
-                    self.host.client.inspect_network(instance.formation.network)
+                    network_id = self.host.client.inspect_network(instance.formation.network)['Id']
                 except NotFound:
-                    self.host.client.create_network(
+                    network_id = self.host.client.create_network(
                         name=instance.formation.network,
                         driver="bridge",
-                    )
-
-            # Create network configuration for the new container
-            networking_config = self.host.client.create_networking_config({
-                instance.formation.network: self.host.client.create_endpoint_config(
-                    aliases=[instance.formation.network],
-                    links=[
-                        (link.name, alias)
-                        for alias, link in instance.links.items()
-                    ]
-                ),
-            })
-
-            # Work out volumes configuration
-            volume_mountpoints = []
-            volume_binds = {}
-            for mount_path, source in instance.container.bound_volumes.items():
-                if not os.path.isdir(source):
-                    raise DockerRuntimeError(
-                        "Volume mount source directory {} does not exist".format(source)
-                    )
-                volume_mountpoints.append(mount_path)
-                volume_binds[source] = {"bind": mount_path, "mode": "rw"}
-            for mount_path, source in instance.container.named_volumes.items():
-                volume_mountpoints.append(mount_path)
-                volume_binds[source] = {"bind": mount_path, "mode": "rw"}
-
-            # Add any active devmodes
-            for mount_name in instance.devmodes:
-                for mount_path, source in instance.container.devmodes[mount_name].items():
-                    volume_mountpoints.append(mount_path)
-                    source = os.path.abspath(source)
-                    if os.path.exists(source):
-                        volume_binds[source] = {"bind": mount_path, "mode": "rw"}
-                    else:
-                        raise NotFoundException("The volume source path {} does not exist".format(source))
-
-            # Create container
-            container_pointer = self.host.client.create_container(
-                instance.image_id,
-                command=instance.command,
-                detach=not instance.foreground,
-                stdin_open=instance.foreground,
-                tty=instance.foreground,
-                # Ports is a list of ports in the container to expose
-                ports=list(instance.ports.keys()),
-                environment=instance.environment,
-                volumes=volume_mountpoints,
-                name=instance.name,
-                host_config=self.host.client.create_host_config(
-                    binds=volume_binds,
-                    port_bindings=instance.ports,
-                    publish_all_ports=True,
-                    security_opt=['seccomp:unconfined'],
-                ),
-                networking_config=networking_config,
-                labels={
-                    "com.eventbrite.bay.container": instance.container.name,
-                }
-            )
+                    )['Id']
+
+            # Start any stopped container launched with this exact spec as it is
+            launch_fingerprint = instance.fingerprint()
+            container_pointer = self.reusable_container(instance, launch_fingerprint, network_id, reuse)
+            reused = container_pointer is not None
+            if reused:
+                start_task.update(status="Reusing stopped container")
+            else:
+                container_pointer = self.create_container(instance, fingerprint, launch_fingerprint)
 
             # Foreground containers launch into a PTY at this point. We use an exception so that
             # it happens in the main thread.
             if instance.foreground:
                 def handler():
+                    import dockerpty
                     dockerpty.start(self.host.client, container_pointer)
                     self.host.client.remove_container(container_pointer)
                 start_task.finish(status="Going to shell", status_flavor=Task.FLAVOR_GOOD)
@@ -290,25 +489,34 @@ class FormationRunner:
 
             else:
                 # Make a towline instance and wait on it
-                self.host.client.start(container_pointer)
                 towline = Towline(self.host, instance.name)
-                while True:
-                    status, message = towline.status
-                    if status is None:
-                        if message is not None:
-                            start_task.update(status=message)
-                    elif status is True:
-                        break
-                    elif status is False:
-                        raise DockerRuntimeError(
-                            "Container {} failed to boot!".format(instance.container.name),
-                            code="BOOT_FAIL",
-                            instance=instance,
-                        )
-                    time.sleep(0.5)
+                if reused:
+                    towline.ignore_previous_boot()
+                self.app.formations.expect(self.host, instance.name, "start")
+                self.host.client.start(container_pointer)
+                towline.follow_logs()
+                try:
+                    while True:
+                        status, message = towline.status
+                        if status is None:
+                            if message is not None:
+                                start_task.update(status=message)
+                        elif status is True:
+                            break
+                        elif status is False:
+                            raise DockerRuntimeError(
+                                "Container {} failed to boot!".format(instance.container.name),
+                                code="BOOT_FAIL",
+                                instance=instance,
+                            )
+                        # Wakes straight away on a pushed status or if the container dies
+                        towline.wait(timeout=0.5)
+                finally:
+                    towline.close()
 
             # Replace the instance with an introspected copy of the live one so it has networking details
             instance = FormationIntrospector(self.host, self.app.containers).introspect_single_container(instance.name)
+            self.app.formations.record_started(self.host, instance)
 
             # Run plugins
             self.app.run_hooks(PluginHook.POST_START, host=self.host, instance=instance, task=start_task)
@@ -1,32 +1,170 @@
+import calendar
+import threading
 import time
 
-from docker.errors import NotFound
+from .logs import LogStream
 
 
 class Towline(object):
     """
     Process communication helper that can monitor the boot process and
     provide information about what's happening.
+
+    Containers can report on their boot in one of two ways:
+
+     - Printing marker lines to stdout, which we read from a single streaming
+       logs connection: "@@towline status <message>", "@@towline complete"
+       and "@@towline failed <message>".
+     - Writing /tugboat/boot_status and creating /tugboat/boot_complete,
+       which we have to probe for on every check.
+
+    Once a marker line has been seen the files are never read.
+
+    A stopped container that is started again still has the logs and files
+    of its previous boot, so for those call ignore_previous_boot() before
+    starting it.
     """
 
     # Number of seconds till we conclude the container doesn't have towline support
     NO_TOWLINE_TIMEOUT = 2
 
+    LOG_MARKER = "@@towline "
+
+    STATUS_PATH = "/tugboat/boot_status"
+    COMPLETE_PATH = "/tugboat/boot_complete"
+
     def __init__(self, host, container_name):
         self.host = host
         self.container_name = container_name
         self._first_try = None
+        # State pushed through the log stream
+        self.condition = threading.Condition()
+        self.pushed = False
+        self.pushed_status = None
+        self.pushed_result = None
+        self.log_stream_open = False
+        self.log_stream = None
+        # Set for containers that have booted before
+        self.reused = False
+        self.previous_files = {}
+        self.started_at = None
+
+    def ignore_previous_boot(self):
+        """
+        Notes the state of the boot files before the container is started
+        again, so only ones its new boot writes count.
+        """
+        self.reused = True
+        for path in (self.STATUS_PATH, self.COMPLETE_PATH):
+            self.previous_files[path] = self.host.files.stat(self.container_name, path)
+
+    def follow_logs(self):
+        """
+        Starts reading marker lines from the container's stdout in a
+        background thread. Call once the container has been started.
+        """
+        if self.reused:
+            # Skip lines from previous boots, using Docker's own clock
+            self.started_at = self.normalise_timestamp(
+                self.host.client.inspect_container(self.container_name)['State']['StartedAt']
+            )
+            self.log_stream = LogStream.open(
+                self.host,
+                self.container_name,
+                stdout=True,
+                stderr=False,
+                timestamps=True,
+                since=calendar.timegm(time.strptime(self.started_at[:19], "%Y-%m-%dT%H:%M:%S")),
+            )
+        else:
+            self.log_stream = LogStream.open(self.host, self.container_name, stdout=True, stderr=False)
+        self.log_stream_open = True
+        thread = threading.Thread(target=self._read_logs, args=(self.log_stream,), daemon=True)
+        thread.start()
+
+    def close(self):
+        """
+        Stops following the logs. Call once boot is over, however it ended.
+        """
+        if self.log_stream is not None:
+            self.log_stream.close()
+
+    def _read_logs(self, stream):
+        buffer = b""
+        try:
+            for chunk in stream:
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    self._handle_line(line.decode("utf8", "replace").rstrip("\r"))
+                if self.pushed_result is not None:
+                    # Boot is over; nothing else we care about will turn up
+                    break
+        except Exception:
+            pass
+        finally:
+            stream.close()
+            # The stream ends when the container stops, which wakes waiters too
+            with self.condition:
+                self.log_stream_open = False
+                self.condition.notify_all()
+
+    @staticmethod
+    def normalise_timestamp(timestamp):
+        """
+        Pads the fraction of a Docker RFC3339Nano UTC timestamp to nine
+        digits, so timestamps compare correctly as strings.
+        """
+        timestamp = timestamp.rstrip("Z")
+        seconds, _, fraction = timestamp.partition(".")
+        return "{}.{:0<9}Z".format(seconds, fraction[:9])
+
+    def _handle_line(self, line):
+        if self.started_at is not None:
+            timestamp, _, line = line.partition(" ")
+            if self.normalise_timestamp(timestamp) < self.started_at:
+                return
+        if not line.startswith(self.LOG_MARKER):
+            return
+        command, _, argument = line[len(self.LOG_MARKER):].partition(" ")
+        with self.condition:
+            if command == "status":
+                self.pushed_status = argument.strip() or None
+            elif command == "complete":
+                self.pushed_result = (True, "Towline boot complete")
+            elif command == "failed":
+                self.pushed_result = (False, argument.strip() or "Towline boot failed")
+            else:
+                return
+            self.pushed = True
+            self.condition.notify_all()
+
+    def wait(self, timeout):
+        """
+        Waits up to timeout seconds before the next status check, returning
+        early if the container pushes a new status or dies.
+        """
+        with self.condition:
+            if self.log_stream_open:
+                self.condition.wait(timeout)
+                return
+        self.host.events.wait_for_exit(self.container_name, timeout=timeout)
+
+    def _current_file(self, path):
+        """
+        Returns if the file exists and wasn't left over from a previous boot
+        """
+        stat = self.host.files.stat(self.container_name, path)
+        return stat is not None and stat != self.previous_files.get(path)
 
     def _read_file(self, path, default=None):
         """
         Helper to read the contents of a file inside a container
         """
-        try:
-            contents = self.host.client.copy(self.container_name, path).strip()
-            return contents or default
-        except NotFound:
-            # Ignore missing containers or other errors
+        if not self._current_file(path):
             return default
+        contents = self.host.files.read(self.container_name, path)
+        return (contents or "").strip() or default
 
     @property
     def status(self):
@@ -35,21 +173,35 @@ class Towline(object):
         Finished is True for successful boot, False for unsuccessful boot, and
         None if boot is still occuring.
         """
-        # The container should exist by now
-        if not self.host.container_exists(self.container_name):
-            return (False, "Container does not exist")
+        with self.condition:
+            if self.pushed_result is not None:
+                return self.pushed_result
+        # See if it's still there; the event stream can tell us it is without
+        # asking Docker, but its start event can arrive after our first check
+        state = self.host.events.state(self.container_name)
+        if state is not None and state["running"]:
+            running = True
+        else:
+            # The container should exist by now
+            if not self.host.container_exists(self.container_name):
+                return (False, "Container does not exist")
+            running = self.host.container_running(self.container_name)
         # If it's dead, that's a failed boot
-        if not self.host.container_running(self.container_name):
+        if not running:
             return (False, "Container died during boot")
-        # See if we can read a status from it
         if self._first_try is None:
             self._first_try = time.time()
-        container_status = self._read_file("/tugboat/boot_status")
+        # Pushed statuses mean the container speaks the log protocol
+        with self.condition:
+            if self.pushed:
+                return (None, self.pushed_status)
+        # See if we can read a status from it
+        container_status = self._read_file(self.STATUS_PATH)
         # If there's no status and the timeout has passed, they're not towline compatible
         if container_status is None and time.time() - self._first_try > self.NO_TOWLINE_TIMEOUT:
             return (True, "Non-towline boot complete")
         # See if boot is complete
-        if self._read_file("/tugboat/boot_complete"):
+        if self._current_file(self.COMPLETE_PATH):
             return (True, "Towline boot complete")
         else:
             return (None, container_status)
@@ -7,7 +7,6 @@ import sys
 from .base import BasePlugin
 from ..cli.argument_types import ContainerType, HostType
 from ..cli.colors import RED
-from ..docker.introspect import FormationIntrospector
 
 
 @attr.s
@@ -35,7 +34,7 @@ def attach(app, container, host, command):
         shell = ['/bin/bash']
 
     # See if the container is running
-    formation = FormationIntrospector(host, app.containers).introspect()
+    formation = app.formations.get(host, follow=False)
     for instance in formation:
         if instance.container == container:
             # Work out anything to put before the shell (e.g. ENV)
@@ -46,10 +46,10 @@ class BasePlugin(object, metaclass=PluginMetaclass):
         pass
 
     def add_command(self, func):
-        self.app.cli.add_command(func)
+        self.app.add_command(func)
 
     def add_alias(self, command_name, alias):
-        self.app.cli.add_alias(command_name, alias)
+        self.app.add_alias(command_name, alias)
 
     def add_hook(self, hook_type, func):
         self.app.add_hook(hook_type, func)
@@ -5,7 +5,6 @@ from .base import BasePlugin
 from ..cli.colors import RED
 from ..cli.tasks import Task
 from ..constants import PluginHook
-from ..docker.introspect import FormationIntrospector
 from ..docker.runner import FormationRunner
 from ..exceptions import BadConfigError, ImageNotFoundException
 
@@ -81,7 +80,7 @@ class BootPlugin(BasePlugin):
         (required ones must be or an error is raised; optional ones are if they
         are available locally).
         """
-        formation = FormationIntrospector(host, self.app.containers).introspect()
+        formation = self.app.formations.get(host, follow=False)
         to_boot = set()
         for container, required in containers.items():
             # See if container is already running
@@ -99,7 +98,7 @@ class BootPlugin(BasePlugin):
         # Boot those containers
         if to_boot:
             boot_task = Task("Running boot containers", parent=task)
-            formation = FormationIntrospector(host, self.app.containers).introspect()
+            formation = self.app.formations.get(host)
             for container in to_boot:
                 formation.add_container(container, host)
             runner = FormationRunner(self.app, host, formation, boot_task, stop=False)
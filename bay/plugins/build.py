@@ -7,8 +7,8 @@ from .base import BasePlugin
 from ..cli.colors import CYAN, GREEN, RED, remove_ansi
 from ..cli.argument_types import ContainerType, HostType
 from ..cli.tasks import Task
-from ..docker.build import Builder
-from ..exceptions import BuildFailureError, ImagePullFailure
+from ..docker.build import BuildScheduler
+from ..docker.images import PullScheduler
 from ..utils.sorting import dependency_sort
 
 
@@ -31,18 +31,17 @@ class BuildPlugin(BasePlugin):
 @click.option('--cache/--no-cache', default=True)
 @click.option('--recursive/--one', '-r/-1', default=True)
 @click.option('--verbose/--quiet', '-v/-q', default=True)
+@click.option('--jobs', '-j', type=int, default=None, help="Number of images to build at once.")
+@click.option('--fail-fast/--keep-going', default=True, help="Stop at the first failure, or build all that can be.")
 # TODO: Add a proper requires_docker check
 # TODO: Add build profile
 @click.pass_obj
-def build(app, containers, host, cache, recursive, verbose):
+def build(app, containers, host, cache, recursive, verbose, jobs, fail_fast):
     """
     Build container images, along with its build dependencies.
     """
-    logfile_name = app.config.get_path('bay', 'build_log_path', app)
     containers_to_pull = []
     containers_to_build = []
-    pulled_containers = set()
-    failed_pulls = set()
 
     task = Task("Building", parent=app.root_task)
     start_time = datetime.datetime.now().replace(microsecond=0)
@@ -61,59 +60,47 @@ def build(app, containers, host, cache, recursive, verbose):
     # from profile) to include runtime dependencies.
     containers_to_pull = dependency_sort(containers_to_pull, app.containers.dependencies)
 
-    # Try pulling each container to pull, and add it to containers_to_build if
-    # it fails. If it works, remember we pulled it, so we don't have to pull it
-    # again later.
+    # Pull the containers to pull all at once, adding any that fail to
+    # containers_to_build. The scheduler remembers what it has pulled (or failed
+    # to), so nothing is pulled twice.
+    pulls = PullScheduler(
+        app,
+        host,
+        parent_task=task,
+        concurrency=app.config["bay"]["pull_concurrency"],
+    )
+    pulled = pulls.run_all(containers_to_pull, pulls.pull)
     for container in containers_to_pull:
-        try:
-            host.images.pull_image_version(
-                app,
-                container.image_name,
-                container.image_tag,
-                parent_task=task,
-                fail_silently=False,
-            )
-        except ImagePullFailure:
-            failed_pulls.add(container)
+        if not pulled[container]:
             containers_to_build.append(container)
-        else:
-            pulled_containers.add(container)
 
-    ancestors_to_build = []
-    # For each container to build, find its ancestry, trying to pull each
-    # ancestor and stopping short if it works.
-    for container in containers_to_build:
+    def find_ancestors_to_build(container):
+        """
+        Returns the container and the ancestors of it that need building,
+        trying to pull each ancestor and stopping short if it works.
+        """
         # Always add `container` to final build list, even if recursive is
         # False.
-        ancestors_to_build.append(container)
+        to_build = [container]
         if recursive:
             # We need to look at the ancestry starting from the oldest, up to
             # and not including the `container`
-            ancestry = dependency_sort(containers_to_build,
-                                       lambda x: [app.containers.build_parent(x)])[:-1]
+            ancestry = app.containers.build_ancestry(container)
             for ancestor in reversed(ancestry):
-                try:
-                    # If we've already attempted to pull it and failed, short
-                    # circuit to failure block.
-                    if ancestor in failed_pulls:
-                        raise ImagePullFailure("We've already attempted to pull this image, and failed.")
-                    # Check if we've pulled it already
-                    if ancestor not in pulled_containers:
-                        host.images.pull_image_version(
-                            app,
-                            ancestor.image_name,
-                            ancestor.image_tag,
-                            parent_task=task,
-                            fail_silently=False,
-                        )
-                except ImagePullFailure:
-                    failed_pulls.add(ancestor)
-                    ancestors_to_build.insert(0, ancestor)
-                else:
+                if pulls.pull(ancestor):
                     # We've pulled the current ancestor successfully, so skip
                     # all the older ancestors.
-                    pulled_containers.add(ancestor)
                     break
+                to_build.insert(0, ancestor)
+        return to_build
+
+    # Walk each container's ancestry at the same time, so pulls for
+    # independent images overlap.
+    ancestry_results = pulls.run_all(containers_to_build, find_ancestors_to_build)
+    pulls.finish()
+    ancestors_to_build = []
+    for container in containers_to_build:
+        ancestors_to_build.extend(ancestry_results[container])
 
     # Sort ancestors so we build the most depended on first.
     sorted_ancestors_to_build = dependency_sort(ancestors_to_build, lambda x: [app.containers.build_parent(x)])
@@ -132,20 +119,18 @@ def build(app, containers, host, cache, recursive, verbose):
         ),
     )
 
-    for container in ancestors_to_build:
-        image_builder = Builder(
-            host,
-            container,
-            app,
-            parent_task=task,
-            logfile_name=logfile_name,
-            docker_cache=cache,
-            verbose=verbose,
-        )
-        try:
-            image_builder.build()
-        except BuildFailureError:
-            click.echo(RED("Build failed! Last 15 lines of log:"))
+    scheduler = BuildScheduler(
+        app,
+        host,
+        parent_task=task,
+        concurrency=jobs or app.config["bay"]["build_concurrency"],
+        keep_going=not fail_fast,
+        docker_cache=cache,
+        verbose=verbose,
+    )
+    if not scheduler.build(ancestors_to_build):
+        for container, logfile_name in scheduler.failed.items():
+            click.echo(RED("Build of {} failed! Last 15 lines of log:".format(container.name)))
             # TODO: More efficient tailing
             lines = []
             with open(logfile_name, "r") as fh:
@@ -154,7 +139,9 @@ def build(app, containers, host, cache, recursive, verbose):
             for line in lines:
                 click.echo("  " + remove_ansi(line).rstrip())
             click.echo("See full build log at {log}".format(log=click.format_filename(logfile_name)), err=True)
-            sys.exit(1)
+        if scheduler.skipped:
+            click.echo(RED("Not built: {}".format(", ".join(container.name for container in scheduler.skipped))))
+        sys.exit(1)
     click.echo()
 
     # Show total build time metric after everything is complete
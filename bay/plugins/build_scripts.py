@@ -1,10 +1,10 @@
 import os
-import logging
 import subprocess
 
 from .base import BasePlugin
 from ..cli.tasks import Task
 from ..constants import PluginHook
+from ..docker.build import build_logger
 from ..exceptions import BuildFailureError
 
 
@@ -50,7 +50,7 @@ class BuildScriptsPlugin(BasePlugin):
                 os.mkdir(build_dir)
                 # Run the script
                 script_task = Task("Running {}".format(name), parent=task, collapse_if_finished=True)
-                logger = logging.getLogger('build_logger')
+                logger = build_logger(container)
                 process = subprocess.Popen(
                     [interpreter, script_path],
                     cwd=container.path,
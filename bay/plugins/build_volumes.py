@@ -1,10 +1,9 @@
 import attr
-from docker.errors import NotFound
 
 from .base import BasePlugin
 from ..cli.tasks import Task
 from ..constants import PluginHook
-from ..docker.build import Builder
+from ..docker.build import Builder, build_log_path
 
 
 @attr.s
@@ -24,6 +23,7 @@ class BuildVolumesPlugin(BasePlugin):
         Safety net to stop you booting volume-providing containers normally,
         and to catch and build volume containers if they're needed
         """
+        from docker.errors import NotFound
         # Safety net
         if instance.container.extra_data.get("provides-volume", None):
             raise ValueError("You cannot run a volume-providing container {}".format(instance.container.name))
@@ -48,11 +48,7 @@ class BuildVolumesPlugin(BasePlugin):
                         providers[name],
                         self.app,
                         parent_task=task,
-                        logfile_name=self.app.config.get_path(
-                            'bay',
-                            'build_log_path',
-                            self.app,
-                        ),
+                        logfile_name=build_log_path(self.app, providers[name]),
                         verbose=True,
                     ).build()
 
@@ -54,6 +54,13 @@ def container(app, container=None):
             click.echo(CYAN("Depended on by: ") + ", ".join(sorted(other.name for other in dependents)))
         else:
             click.echo(CYAN("Depended on by: ") + "(nothing)")
+        # Transitive dependencies/dependents
+        ancestors = app.containers.ancestors(container)
+        if ancestors - dependencies:
+            click.echo(CYAN("All dependencies: ") + ", ".join(sorted(other.name for other in ancestors)))
+        descendants = app.containers.descendants(container)
+        if descendants - dependents:
+            click.echo(CYAN("All dependents: ") + ", ".join(sorted(other.name for other in descendants)))
         # Volumes
         click.echo(CYAN("Named volumes:"))
         for mount_point, source in container.named_volumes.items():
@@ -0,0 +1,107 @@
+import attr
+import click
+import os
+import sys
+import time
+import traceback
+
+from .base import BasePlugin
+from ..cli.colors import CYAN, GREEN, RED
+from ..cli.daemon import DaemonClient, DaemonServer, socket_path
+
+
+@attr.s
+class DaemonPlugin(BasePlugin):
+    """
+    Plugin for running a background daemon that keeps the container graph,
+    plugins and Docker connections warm, so commands start faster.
+    """
+
+    def load(self):
+        self.add_command(daemon)
+
+
+def daemon_client():
+    return DaemonClient(socket_path())
+
+
+@click.group()
+def daemon():
+    """
+    Manages the background daemon.
+    """
+    pass
+
+
+@daemon.command()
+@click.option("--foreground", "-f", is_flag=True, default=False, help="Don't detach from the terminal.")
+@click.pass_obj
+def start(app, foreground):
+    """
+    Starts the daemon for the current container library.
+    """
+    client = daemon_client()
+    reply = client.control("status")
+    if reply is not None:
+        click.echo(RED("The daemon is already running for {}.".format(reply["home"])))
+        sys.exit(1)
+    server = DaemonServer(app, client.path)
+    if foreground:
+        click.echo(CYAN("Daemon listening on {}".format(client.path)))
+        server.serve()
+        return
+    # Detach properly (double fork) so the daemon outlives this terminal
+    if os.fork():
+        for _ in range(100):
+            if client.control("status") is not None:
+                click.echo(GREEN("Daemon started."))
+                return
+            time.sleep(0.1)
+        click.echo(RED("The daemon did not start; see {}".format(daemon_log_path())))
+        sys.exit(1)
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    log_path = daemon_log_path()
+    if not os.path.isdir(os.path.dirname(log_path)):
+        os.makedirs(os.path.dirname(log_path))
+    with open(os.devnull, "r") as devnull:
+        os.dup2(devnull.fileno(), 0)
+    with open(log_path, "a") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+    try:
+        server.serve()
+    except BaseException:
+        traceback.print_exc()
+        os._exit(1)
+    os._exit(0)
+
+
+def daemon_log_path():
+    return os.path.join(os.path.dirname(socket_path()), "daemon.log")
+
+
+@daemon.command()
+@click.pass_obj
+def stop(app):
+    """
+    Stops the daemon.
+    """
+    if daemon_client().control("stop") is None:
+        click.echo("The daemon is not running.")
+    else:
+        click.echo(GREEN("Daemon stopped."))
+
+
+@daemon.command()
+@click.pass_obj
+def status(app):
+    """
+    Shows if the daemon is running.
+    """
+    reply = daemon_client().control("status")
+    if reply is None:
+        click.echo("The daemon is not running.")
+        sys.exit(1)
+    click.echo("Daemon running as PID {} for {}".format(reply["pid"], reply["home"]))
@@ -1,7 +1,6 @@
 import attr
 import click
 import random
-from docker.errors import NotFound
 
 from .base import BasePlugin
 from ..cli.argument_types import HostType
@@ -79,6 +78,7 @@ class GarbageCollector:
         """
         Gets image IDs (including intermediate layers) that are used by running containers
         """
+        from docker.errors import NotFound
         live_images = set()
         for container in self.host.client.containers(all=False, trunc=False):
             try:
@@ -96,6 +96,7 @@ class GarbageCollector:
         """
         Gets image IDs of all layers used by the named images
         """
+        from docker.errors import NotFound
         current_images = set()
         for named_image in named_images:
             try:
@@ -125,6 +126,7 @@ class GarbageCollector:
         """
         Cleans up containers
         """
+        from docker.errors import NotFound
         task = Task("Removing dead containers", parent=parent_task)
         dead_containers = self.dead_containers()
         for i, name in enumerate(dead_containers):
@@ -151,6 +153,7 @@ class GarbageCollector:
         """
         Cleans up old (untagged/non-current images)
         """
+        from docker.errors import NotFound
         # Clean up images
         task = Task("Removing dead images", parent=parent_task)
 
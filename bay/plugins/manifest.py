@@ -0,0 +1,230 @@
+import importlib
+import importlib.util
+import json
+import os
+import tempfile
+
+import attr
+from click.utils import make_default_short_help
+
+
+@attr.s
+class PluginEntryPoint:
+    """
+    An installed plugin entry point. Found with importlib.metadata where it is
+    available, as importing pkg_resources is a large part of startup time.
+    """
+    name = attr.ib()
+    module_name = attr.ib()
+    attrs = attr.ib()
+    version = attr.ib(default=None)
+
+    @classmethod
+    def find_all(cls, group):
+        """
+        Returns all entry points in the group.
+        """
+        try:
+            from importlib import metadata
+        except ImportError:
+            # Python < 3.8
+            import pkg_resources
+            return [
+                cls(entrypoint.name, entrypoint.module_name, list(entrypoint.attrs), entrypoint.dist.version)
+                for entrypoint in pkg_resources.iter_entry_points(group)
+            ]
+        result = []
+        seen_distributions = set()
+        for distribution in metadata.distributions():
+            # The same distribution may be on the path more than once; the first wins
+            if distribution.metadata["Name"] in seen_distributions:
+                continue
+            seen_distributions.add(distribution.metadata["Name"])
+            for entrypoint in distribution.entry_points:
+                if entrypoint.group == group:
+                    module_name, _, attrs = entrypoint.value.partition(":")
+                    result.append(cls(
+                        entrypoint.name,
+                        module_name.strip(),
+                        attrs.split("[", 1)[0].strip().split("."),
+                        distribution.version,
+                    ))
+        return result
+
+    def load(self):
+        """
+        Imports and returns the object the entry point refers to.
+        """
+        value = importlib.import_module(self.module_name)
+        for attr_name in self.attrs:
+            try:
+                value = getattr(value, attr_name)
+            except AttributeError as e:
+                raise ImportError(str(e))
+        return value
+
+
+@attr.s
+class PluginManifest:
+    """
+    Cached description of every installed plugin: what it provides and
+    requires, and which commands, aliases, hooks and catalog entries it
+    registers when loaded.
+
+    This lets the CLI register placeholder commands and work out which plugins
+    a hook or catalog needs without importing any plugin modules. It is keyed
+    on the installed entry points (including distribution versions and module
+    mtimes) and is rebuilt by a full plugin load whenever that key changes.
+    """
+    FORMAT_VERSION = 1
+
+    path = attr.ib()
+    key = attr.ib(default=None)
+    entries = attr.ib(default=attr.Factory(dict), repr=False)
+
+    @classmethod
+    def key_for(cls, entrypoints):
+        """
+        Returns a JSON-compatible key describing the given entry points.
+        """
+        key = [cls.FORMAT_VERSION]
+        for entrypoint in entrypoints:
+            try:
+                spec = importlib.util.find_spec(entrypoint.module_name)
+            except (ImportError, ValueError):
+                spec = None
+            try:
+                mtime = os.stat(spec.origin).st_mtime_ns if spec and spec.origin else None
+            except OSError:
+                mtime = None
+            key.append([
+                entrypoint.name,
+                entrypoint.module_name,
+                list(entrypoint.attrs),
+                entrypoint.version,
+                mtime,
+            ])
+        return key
+
+    def load(self, key):
+        """
+        Loads the manifest from disk. Returns True if it exists and matches
+        the key, False otherwise (in which case it is reset to empty).
+        """
+        self.key = key
+        self.entries = {}
+        try:
+            with open(self.path, "r") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(data, dict) or data.get("key") != key:
+            return False
+        self.entries = data["entries"]
+        return True
+
+    def save(self):
+        """
+        Writes the manifest to disk. Failures are ignored, as the manifest is
+        just a cache.
+        """
+        dirname = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fd, temp_path = tempfile.mkstemp(dir=dirname, prefix=".plugins-")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "w") as fh:
+                json.dump({"key": self.key, "entries": self.entries}, fh, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except OSError:
+            os.unlink(temp_path)
+
+    def invalidate(self):
+        """
+        Removes the manifest from disk so the next run rebuilds it.
+        """
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    # Recording (called as plugins load)
+
+    def add_plugin(self, name, entrypoint, plugin):
+        """
+        Starts a fresh entry for an imported plugin class.
+        """
+        self.entries[name] = {
+            "module": entrypoint.module_name,
+            "attrs": list(entrypoint.attrs),
+            "provides": list(plugin.provides),
+            "requires": list(plugin.requires),
+            "commands": {},
+            "aliases": {},
+            "hooks": [],
+            "catalog_types": [],
+            "catalog_items": {},
+        }
+
+    def record_command(self, name, command):
+        self.entries[name]["commands"][command.name] = (
+            command.short_help or make_default_short_help(command.help or "")
+        )
+
+    def record_alias(self, name, command_name, alias):
+        self.entries[name]["aliases"][alias] = command_name
+
+    def record_hook(self, name, hook_type):
+        if hook_type not in self.entries[name]["hooks"]:
+            self.entries[name]["hooks"].append(hook_type)
+
+    def record_catalog_type(self, name, type_name):
+        if type_name not in self.entries[name]["catalog_types"]:
+            self.entries[name]["catalog_types"].append(type_name)
+
+    def record_catalog_item(self, name, type_name, item_name):
+        items = self.entries[name]["catalog_items"].setdefault(type_name, [])
+        if item_name not in items:
+            items.append(item_name)
+
+    # Queries
+
+    def plugins_with_hook(self, hook_type):
+        """
+        Returns the names of plugins that register hooks of the given type.
+        """
+        return [name for name, entry in self.entries.items() if hook_type in entry["hooks"]]
+
+    def plugins_with_catalog(self, type_name):
+        """
+        Returns the names of plugins that define or add to the given catalog type.
+        """
+        return [
+            name
+            for name, entry in self.entries.items()
+            if type_name in entry["catalog_types"] or type_name in entry["catalog_items"]
+        ]
+
+    def catalog_type_owners(self, name):
+        """
+        Returns the names of plugins defining the catalog types that the named
+        plugin adds items to (and which must therefore be loaded before it).
+        """
+        wanted = set(self.entries[name]["catalog_items"])
+        return [
+            other
+            for other, entry in self.entries.items()
+            if other != name and wanted.intersection(entry["catalog_types"])
+        ]
+
+    def plugin_for_class(self, klass):
+        """
+        Returns the name of the plugin whose entry point is the given class, or None.
+        """
+        for name, entry in self.entries.items():
+            if entry["module"] == klass.__module__ and ".".join(entry["attrs"]) == klass.__qualname__:
+                return name
+        return None
@@ -4,12 +4,11 @@ import attr
 import click
 
 from .base import BasePlugin
-from .run import run_formation
+from .run import plan_formation, run_formation
 from ..cli.argument_types import HostType
 from ..cli.colors import CYAN, RED
 from ..cli.tasks import Task
 from ..containers.profile import Profile
-from ..docker.introspect import FormationIntrospector
 
 
 @attr.s
@@ -88,14 +87,16 @@ def profile(app, name, up, host):
 
 @click.command()
 @click.option("--host", "-h", type=HostType(), default="default")
+@click.option("--plan", "show_plan", is_flag=True, default=False, help="Show what would change without doing it.")
+@click.option("--json", "as_json", is_flag=True, default=False, help="Show the plan as JSON (implies --plan).")
 @click.pass_obj
-def up(app, host):
+def up(app, host, show_plan, as_json):
     """
     Start up a profile by booting the default containers.
     Leaves any other containers that are running (shell, ssh-agent, etc.) alone.
     """
     # Do removal loop first so we don't step on adding containers later
-    formation = FormationIntrospector(host, app.containers).introspect()
+    formation = app.formations.get(host, follow=not (show_plan or as_json))
     for container in app.containers:
         if app.containers.options(container).get('default_boot'):
             for instance in list(formation):
@@ -107,5 +108,8 @@ def up(app, host):
         if app.containers.options(container).get('default_boot'):
             formation.add_container(container, host)
 
+    if show_plan or as_json:
+        plan_formation(app, host, formation, as_json)
+        return
     task = Task("Restarting containers", parent=app.root_task)
     run_formation(app, host, formation, task)
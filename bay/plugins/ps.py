@@ -4,7 +4,6 @@ import click
 from .base import BasePlugin
 from ..cli.argument_types import HostType
 from ..cli.table import Table
-from ..docker.introspect import FormationIntrospector
 
 
 @attr.s
@@ -25,7 +24,7 @@ def ps(app, host):
     Shows details about all containers currently running
     """
     # Run the introspector to get the details
-    formation = FormationIntrospector(host, app.containers).introspect()
+    formation = app.formations.get(host, follow=False)
     # Print formation details
     table = Table([("NAME", 30), ("DOCKER NAME", 40), ("PORTS (CONTAINER->HOST)", 30)])
     table.print_header()
@@ -1,12 +1,12 @@
 import attr
 import click
+import json
 import sys
 
 from .base import BasePlugin
 from ..cli.argument_types import ContainerType, HostType
 from ..cli.colors import RED
 from ..cli.tasks import Task
-from ..docker.introspect import FormationIntrospector
 from ..docker.runner import FormationRunner
 from ..exceptions import DockerRuntimeError, ImageNotFoundException
 
@@ -32,13 +32,15 @@ class RunPlugin(BasePlugin):
 @click.argument("containers", type=ContainerType(), nargs=-1)
 @click.option("--host", "-h", type=HostType(), default="default")
 @click.option("--tail/--notail", "-t", default=False)
+@click.option("--plan", "show_plan", is_flag=True, default=False, help="Show what would change without doing it.")
+@click.option("--json", "as_json", is_flag=True, default=False, help="Show the plan as JSON (implies --plan).")
 @click.pass_obj
-def run(app, containers, host, tail):
+def run(app, containers, host, tail, show_plan, as_json):
     """
     Runs containers by name, including any dependencies needed
     """
     # Get the current formation
-    formation = FormationIntrospector(host, app.containers).introspect()
+    formation = app.formations.get(host, follow=not (show_plan or as_json))
     # Make a Formation that represents what we want to do by taking the existing
     # state and adding in the containers we want
     for container in containers:
@@ -47,6 +49,9 @@ def run(app, containers, host, tail):
         except ImageNotFoundException as e:
             click.echo(RED(str(e)))
             sys.exit(1)
+    if show_plan or as_json:
+        plan_formation(app, host, formation, as_json)
+        return
     # Run that change
     task = Task("Starting containers", parent=app.root_task)
     run_formation(app, host, formation, task)
@@ -68,7 +73,7 @@ def shell(app, container, host, command):
     Runs a single container with foreground enabled and overridden to use bash.
     """
     # Get the current formation
-    formation = FormationIntrospector(host, app.containers).introspect()
+    formation = app.formations.get(host)
     # Make a Formation with that container launched with bash in foreground
     try:
         instance = formation.add_container(container, host)
@@ -88,12 +93,14 @@ def shell(app, container, host, command):
 @click.command()
 @click.argument("containers", type=ContainerType(), nargs=-1)
 @click.option("--host", "-h", type=HostType(), default="default")
+@click.option("--plan", "show_plan", is_flag=True, default=False, help="Show what would change without doing it.")
+@click.option("--json", "as_json", is_flag=True, default=False, help="Show the plan as JSON (implies --plan).")
 @click.pass_obj
-def stop(app, containers, host):
+def stop(app, containers, host, show_plan, as_json):
     """
     Stops containers and ones that depend on them
     """
-    formation = FormationIntrospector(host, app.containers).introspect()
+    formation = app.formations.get(host, follow=not (show_plan or as_json))
     # Look through the formation and remove the containers matching the name
     for instance in list(formation):
         # If there are no names, then we remove everything
@@ -101,6 +108,9 @@ def stop(app, containers, host):
             # Make sure that it was not removed already as a dependent
             if instance.formation:
                 formation.remove_instance(instance)
+    if show_plan or as_json:
+        plan_formation(app, host, formation, as_json)
+        return
     # Run the change
     task = Task("Stopping containers", parent=app.root_task)
     run_formation(app, host, formation, task)
@@ -109,16 +119,35 @@ def stop(app, containers, host):
 @click.command()
 @click.argument("containers", type=ContainerType(), nargs=-1)
 @click.option("--host", "-h", type=HostType(), default="default")
+@click.option("--plan", "show_plan", is_flag=True, default=False, help="Show what would change without doing it.")
+@click.option("--json", "as_json", is_flag=True, default=False, help="Show the plan as JSON (implies --plan).")
 @click.pass_obj
-def restart(app, containers, host):
+def restart(app, containers, host, show_plan, as_json):
     """
     Stops and then starts containers.
+    With --plan, shows the plan for each of the two steps in turn.
     """
-    app.invoke("stop", containers=containers, host=host)
+    app.invoke("stop", containers=containers, host=host, show_plan=show_plan, as_json=as_json)
     if containers:
-        app.invoke("run", containers=containers, host=host)
+        app.invoke("run", containers=containers, host=host, show_plan=show_plan, as_json=as_json)
     else:
-        app.invoke("up", host=host)
+        app.invoke("up", host=host, show_plan=show_plan, as_json=as_json)
+
+
+def plan_formation(app, host, formation, as_json=False):
+    """
+    Common function to show what a formation change would do without doing it.
+    JSON plans are printed one per line, so commands that plan more than one
+    step (like restart) print one line per step.
+    """
+    plan = FormationRunner(app, host, formation, task=None).plan(app.formations.get(host, follow=False))
+    if as_json:
+        click.echo(json.dumps(plan.as_dict(), sort_keys=True))
+    else:
+        for line in plan.describe():
+            click.echo(line)
+    # Later steps of the same command plan from the result of this one
+    app.formations.record_plan(host, plan)
 
 
 def run_formation(app, host, formation, task):
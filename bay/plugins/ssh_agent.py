@@ -5,7 +5,6 @@ import click
 import subprocess
 
 from .base import BasePlugin
-from ..docker.introspect import FormationIntrospector
 from ..exceptions import DockerRuntimeError
 from ..constants import PluginHook
 
@@ -87,7 +86,7 @@ class SSHAgentPlugin(BasePlugin):
         """
         Returns True if the agent container is running on the host, False otherwise.
         """
-        formation = FormationIntrospector(host, self.app.containers).introspect()
+        formation = self.app.formations.get(host, follow=False)
         for instance in formation:
             if instance.container.name == self.CONTAINER_NAME:
                 return True
@@ -1,6 +1,5 @@
 import attr
 import click
-from docker.errors import NotFound
 
 from .base import BasePlugin
 from ..cli.argument_types import HostType
@@ -63,6 +62,7 @@ def destroy(app, host, name):
     """
     Destroys a single volume
     """
+    from docker.errors import NotFound
     task = Task("Destroying volume {}".format(name))
     # Run GC first to clean up stopped containers
     from .gc import GarbageCollector
@@ -1,24 +1,47 @@
+import asyncio
 import attr
+import calendar
 import http.client
+import re
+import shlex
 import socket
+import ssl
+import threading
 import time
-from docker.errors import NotFound
 
 from .base import BasePlugin
 from ..cli.tasks import Task
 from ..constants import PluginHook
+from ..docker.events import stream_errors
+from ..docker.logs import LogStream
+from ..docker.readiness import ReadinessEngine
+from ..docker.towline import Towline
 from ..exceptions import DockerRuntimeError
+from ..utils.functional import cached_property
 
 
 class WaitsPlugin(BasePlugin):
     """
-    Contains the basic, standard waits. Waits' .check is called repeatedly and should return True if the condition is
-    met or False if it is not.
+    Contains the basic, standard waits. Waits' .ready is called repeatedly and should return True if the condition is
+    met or False if it is not; waits that can check without blocking provide a .ready_async coroutine as well.
+
+    Any wait can be given a max_wait parameter, the number of seconds it may take to pass.
+
+    Waits that can also be run inside the container provide .healthcheck_command, a shell command that exits 0 once
+    the condition is met (or None if this particular wait can't be checked that way). Containers with
+    synthesize_healthcheck set have those waits run by Docker as their HEALTHCHECK instead, and bay just waits for
+    them to become healthy.
     """
 
     provides = ["waits"]
 
+    # Settings for healthchecks made from waits, in seconds (retries aside)
+    HEALTHCHECK_INTERVAL = 1
+    HEALTHCHECK_TIMEOUT = 5
+    HEALTHCHECK_RETRIES = 3
+
     def load(self):
+        self.add_hook(PluginHook.PRE_START, self.pre_start)
         self.add_hook(PluginHook.POST_START, self.post_start)
         self.add_catalog_type("wait")
         self.add_catalog_item("wait", "http", HttpWait)
@@ -26,10 +49,21 @@ class WaitsPlugin(BasePlugin):
         self.add_catalog_item("wait", "tcp", TcpWait)
         self.add_catalog_item("wait", "time", TimeWait)
         self.add_catalog_item("wait", "file", FileWait)
+        self.add_catalog_item("wait", "log", LogWait)
+        self.add_catalog_item("wait", "healthy", HealthyWait)
 
-    def post_start(self, host, instance, task):
-        # Loop through all waits and build instances
-        wait_instances = []
+    @cached_property
+    def engine(self):
+        """
+        One readiness engine checks the waits of every container being started.
+        """
+        return ReadinessEngine(timeout=self.app.config["bay"]["wait_timeout"] or None)
+
+    def build_waits(self, host, instance):
+        """
+        Returns the instance's waits as a list of (wait, max_wait) tuples.
+        """
+        waits = []
         for wait in instance.container.waits:
             # Look up wait in app
             try:
@@ -38,29 +72,82 @@ class WaitsPlugin(BasePlugin):
                 raise DockerRuntimeError(
                     "Unknown wait type {} for {}".format(wait["type"], instance.container.name)
                 )
-            # Initialise it and attach a task
-            params = wait.get("params", {})
+            params = dict(wait.get("params", {}))
+            # How long the wait may take to pass is for the engine, not the wait
+            max_wait = params.pop("max_wait", None)
             params["instance"] = instance
             params["host"] = host
-            wait_instance = wait_class(**params)
+            waits.append((wait_class(**params), float(max_wait) if max_wait else None))
+        return waits
+
+    def pre_start(self, host, instance, task):
+        """
+        Turns the waits into the container's healthcheck, if it asks for that.
+        """
+        if not instance.container.synthesize_healthcheck:
+            return
+        commands = [
+            wait.healthcheck_command()
+            for wait, _ in self.build_waits(host, instance)
+            if self.runs_as_healthcheck(wait)
+        ]
+        if commands:
+            instance.healthcheck = {
+                "Test": ["CMD-SHELL", " && ".join("({})".format(command) for command in commands)],
+                "Interval": self.HEALTHCHECK_INTERVAL * 10 ** 9,
+                "Timeout": self.HEALTHCHECK_TIMEOUT * 10 ** 9,
+                "Retries": self.HEALTHCHECK_RETRIES,
+            }
+
+    @staticmethod
+    def runs_as_healthcheck(wait):
+        """
+        Returns True if the wait can be run by Docker as part of a healthcheck.
+        """
+        return hasattr(wait, "healthcheck_command") and wait.healthcheck_command() is not None
+
+    def post_start(self, host, instance, task):
+        waits = self.build_waits(host, instance)
+        # Docker runs the waits it can as the healthcheck, so just wait for that
+        if instance.container.synthesize_healthcheck:
+            synthesized = [(wait, max_wait) for wait, max_wait in waits if self.runs_as_healthcheck(wait)]
+            if synthesized:
+                waits = [(wait, max_wait) for wait, max_wait in waits if not self.runs_as_healthcheck(wait)]
+                max_waits = [max_wait for _, max_wait in synthesized]
+                waits.append((
+                    HealthyWait(
+                        instance=instance,
+                        host=host,
+                        waiting_name="healthcheck ({})".format(
+                            ", ".join(wait.description() for wait, _ in synthesized),
+                        ),
+                    ),
+                    None if None in max_waits else max(max_waits),
+                ))
+        # Attach a task to each
+        wait_instances = []
+        for wait_instance, max_wait in waits:
             wait_instance.task = Task("Waiting for {}".format(wait_instance.description()), parent=task)
             wait_instance.task.update(status="Waiting")
-            wait_instances.append(wait_instance)
+            wait_instances.append((wait_instance, max_wait))
+        if not wait_instances:
+            return
 
-        # Check on them all until they finish
-        while wait_instances:
-            # See if the container actually died
-            if not host.container_running(instance.name):
-                task.update(status="Dead", status_flavor=Task.FLAVOR_BAD)
-                raise DockerRuntimeError(
-                    "Container {} died while waiting for boot completion".format(instance.container.name)
-                )
-            # Check the waits
-            for wait_instance in list(wait_instances):
-                if wait_instance.ready():
-                    wait_instance.task.finish(status="Done", status_flavor=Task.FLAVOR_GOOD)
-                    wait_instances.remove(wait_instance)
-            time.sleep(1)
+        def on_ready(wait_instance, seconds):
+            wait_instance.task.finish(status="Ready after {:.1f}s".format(seconds), status_flavor=Task.FLAVOR_GOOD)
+
+        # Check on them all (alongside any other container's) until they finish
+        try:
+            ready_times = self.engine.wait(host, instance, wait_instances, on_ready=on_ready)
+        except DockerRuntimeError:
+            task.update(status="Failed", status_flavor=Task.FLAVOR_BAD)
+            raise
+        for wait_instance, seconds in ready_times:
+            self.app.timings.note("{} ready for {} after {:.2f}s".format(
+                instance.container.name,
+                wait_instance.description(),
+                seconds,
+            ))
 
 
 @attr.s
@@ -87,6 +174,14 @@ class TcpWait:
         except socket.error:
             return False
 
+    async def ready_async(self):
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(*self.target()), self.timeout or None)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+
     def target(self):
         """
         Returns (host, port) target information.
@@ -95,6 +190,12 @@ class TcpWait:
             raise DockerRuntimeError("Trying to wait on non-exposed port {}".format(self.port))
         return (self.host.external_host_address, self.instance.port_mapping[self.port])
 
+    def healthcheck_command(self):
+        # Look for a listening socket on the port, which needs only grep and /proc (so works on busybox, too)
+        return "grep -qsE '^ *[0-9]+: [0-9A-F]+:{:04X} [0-9A-F]+:[0-9A-F]+ 0A ' /proc/net/tcp /proc/net/tcp6".format(
+            int(self.port),
+        )
+
     def description(self):
         return "TCP on port {}".format(self.port)
 
@@ -111,6 +212,7 @@ class HttpWait(TcpWait):
     expected_codes = attr.ib(default=attr.Factory(lambda: range(200, 400)))
 
     connection_class = http.client.HTTPConnection
+    use_ssl = False
 
     def ready(self):
         addr, port = self.target()
@@ -126,6 +228,47 @@ class HttpWait(TcpWait):
         finally:
             conn.close()
 
+    async def ready_async(self):
+        addr, port = self.target()
+        try:
+            return await asyncio.wait_for(self.request_async(addr, port), self.timeout or None)
+        except Exception:
+            return False
+
+    async def request_async(self, addr, port):
+        """
+        Makes the request and returns if the response status is one we expect.
+        """
+        reader, writer = await asyncio.open_connection(
+            addr,
+            port,
+            ssl=ssl.create_default_context() if self.use_ssl else None,
+        )
+        try:
+            headers = {"Host": "{}:{}".format(addr, port), "Connection": "close"}
+            headers.update(self.headers)
+            writer.write("{} {} HTTP/1.1\r\n{}\r\n".format(
+                self.method,
+                self.path,
+                "".join("{}: {}\r\n".format(name, value) for name, value in headers.items()),
+            ).encode("latin-1"))
+            status_line = (await reader.readline()).split()
+            return len(status_line) >= 2 and status_line[1].isdigit() and int(status_line[1]) in self.expected_codes
+        finally:
+            writer.close()
+
+    def healthcheck_command(self):
+        # curl -f and wget only tell success (2xx/3xx) from failure, so a wait
+        # for other codes stays with bay rather than never turning healthy
+        if set(self.expected_codes) != set(range(200, 400)):
+            return None
+        url = shlex.quote("{}://127.0.0.1:{}{}".format("https" if self.use_ssl else "http", int(self.port), self.path))
+        # Whichever of curl and wget the image has; both fail on 4xx/5xx responses
+        return "curl -fsSk -o /dev/null -X {method} {url} || wget -q -O /dev/null --no-check-certificate {url}".format(
+            method=shlex.quote(self.method),
+            url=url,
+        )
+
     def description(self):
         return "HTTP on port {}".format(self.port)
 
@@ -135,6 +278,7 @@ class HttpsWait(HttpWait):
     HTTPS variant of the HTTP wait
     """
     connection_class = http.client.HTTPSConnection
+    use_ssl = True
 
     def description(self):
         return "HTTPS on port {}".format(self.port)
@@ -157,6 +301,11 @@ class TimeWait:
     def ready(self):
         return time.time() >= self.wait_until
 
+    async def ready_async(self):
+        # Sleep until it's due rather than waking on every retry
+        await asyncio.sleep(max(0, self.wait_until - time.time()))
+        return True
+
     def description(self):
         return "{} seconds".format(self.seconds)
 
@@ -173,13 +322,218 @@ class FileWait:
     waiting_name = attr.ib(default=None)
 
     def ready(self):
-        # Get the file from the host
+        return self.host.files.exists(self.instance.name, self.path)
+
+    def healthcheck_command(self):
+        return "test -e {}".format(shlex.quote(self.path))
+
+    def description(self):
+        return self.waiting_name or "file {}".format(self.path)
+
+
+@attr.s
+class LogWait:
+    """
+    Waits until the container has printed a line matching a regular
+    expression (count times, if given) since it was started.
+
+    The log is followed on a single streaming connection in a background
+    thread, which wakes waiters the moment the line arrives. Lines are
+    looked at one at a time and then dropped.
+    """
+
+    # Longest partial line kept while waiting for its end
+    MAX_LINE_LENGTH = 64 * 1024
+
+    instance = attr.ib()
+    host = attr.ib()
+    pattern = attr.ib()
+    count = attr.ib(default=1)
+    waiting_name = attr.ib(default=None)
+    matches = attr.ib(default=0, init=False)
+    matched = attr.ib(default=attr.Factory(threading.Event), init=False, repr=False)
+    following = attr.ib(default=False, init=False, repr=False)
+    finished = attr.ib(default=False, init=False, repr=False)
+    # Timestamp of the last line looked at, as a stream followed again replays the rest of its second
+    seen_until = attr.ib(default=None, init=False, repr=False)
+    lock = attr.ib(default=attr.Factory(threading.Lock), init=False, repr=False)
+    # Callables run (from the reading thread) when the wait passes or the log ends
+    wakers = attr.ib(default=attr.Factory(list), init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        self.regex = re.compile(self.pattern)
+
+    def follow(self):
+        """
+        Starts reading the log in the background, if we are not already.
+        Blocks while it connects, so call it off the event loop.
+        """
+        with self.lock:
+            if self.following:
+                return
+            self.following = True
+            self.finished = False
+        try:
+            # Only count lines from this run of the container, using Docker's own clock
+            started_at = Towline.normalise_timestamp(
+                self.host.client.inspect_container(self.instance.name)['State']['StartedAt']
+            )
+            stream = LogStream.open(
+                self.host,
+                self.instance.name,
+                stdout=True,
+                stderr=True,
+                timestamps=True,
+                since=calendar.timegm(time.strptime(started_at[:19], "%Y-%m-%dT%H:%M:%S")),
+            )
+        except Exception:
+            # Let the next check follow it again
+            with self.lock:
+                self.following = False
+            raise
+        thread = threading.Thread(target=self.read, args=(stream, started_at), daemon=True)
+        thread.start()
+
+    def read(self, stream, started_at):
+        buffer = b""
+        # If we are dropping the rest of an over-long line
+        overflowed = False
+        try:
+            for chunk in stream:
+                if overflowed:
+                    end = chunk.find(b"\n")
+                    if end == -1:
+                        continue
+                    chunk = chunk[end:]
+                    overflowed = False
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                if len(buffer) > self.MAX_LINE_LENGTH:
+                    # Keep the start of the line, which has its timestamp
+                    buffer = buffer[:self.MAX_LINE_LENGTH]
+                    overflowed = True
+                for line in lines:
+                    timestamp, _, line = line.decode("utf8", "replace").partition(" ")
+                    timestamp = Towline.normalise_timestamp(timestamp)
+                    if timestamp < started_at:
+                        continue
+                    if self.seen_until is not None and timestamp <= self.seen_until:
+                        continue
+                    self.seen_until = timestamp
+                    if self.regex.search(line):
+                        self.matches += 1
+                        if self.matches >= self.count:
+                            self.matched.set()
+                            return
+        except Exception:
+            pass
+        finally:
+            stream.close()
+            if not self.matched.is_set():
+                # Follow again on the next check, in case the stream just dropped
+                with self.lock:
+                    self.following = False
+            # The stream ends when the container stops, and either way waiters need to know
+            self.finished = True
+            self.wake()
+
+    def wake(self):
+        with self.lock:
+            wakers, self.wakers = self.wakers, []
+        for waker in wakers:
+            waker()
+
+    def ready(self):
         try:
-            self.host.client.get_archive(self.instance.name, self.path)
-        except NotFound:
+            self.follow()
+        except stream_errors():
+            # The log may not be there to follow yet; the next check tries again
             return False
-        else:
-            return True
+        return self.matched.is_set()
+
+    async def ready_async(self):
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self.follow)
+        except stream_errors():
+            # The log may not be there to follow yet; the next check tries again
+            return False
+        woken = loop.create_future()
+
+        def waker():
+            loop.call_soon_threadsafe(lambda: woken.done() or woken.set_result(None))
+
+        with self.lock:
+            self.wakers.append(waker)
+        # Check after registering, so a match in between can't be missed
+        if not self.matched.is_set() and not self.finished:
+            await woken
+        return self.matched.is_set()
 
     def description(self):
-        return self.waiting_name or "file {}".format(self.path)
+        return self.waiting_name or "log line matching {}".format(self.pattern)
+
+
+@attr.s
+class HealthyWait:
+    """
+    Waits until Docker reports the container as healthy, using the image's
+    HEALTHCHECK or one synthesised from the container's other waits.
+
+    Docker runs the checks itself; we only listen for its health_status
+    events (looking at the container once, to start with). Fails as soon as
+    Docker gives up and reports the container unhealthy.
+    """
+
+    instance = attr.ib()
+    host = attr.ib()
+    waiting_name = attr.ib(default=None)
+
+    def status(self):
+        """
+        Returns the container's health status ("starting", "healthy" or "unhealthy").
+        """
+        state = self.host.events.state(self.instance.name)
+        if state is not None and state["health"] is not None:
+            return state["health"]
+        health = self.host.client.inspect_container(self.instance.name)['State'].get('Health')
+        if not health:
+            raise DockerRuntimeError(
+                "Container {} has no healthcheck to wait for".format(self.instance.container.name)
+            )
+        return health['Status']
+
+    def ready(self):
+        status = self.status()
+        if status == "unhealthy":
+            raise DockerRuntimeError(
+                "Container {} became unhealthy while waiting for {}".format(
+                    self.instance.container.name,
+                    self.description(),
+                )
+            )
+        return status == "healthy"
+
+    async def ready_async(self):
+        loop = asyncio.get_event_loop()
+        if not self.host.events.started:
+            # Nothing will tell us it changed, so check (and get retried)
+            return await loop.run_in_executor(None, self.ready)
+        woken = loop.create_future()
+
+        def listener(host, name, action):
+            if name == self.instance.name and action.startswith("health_status"):
+                loop.call_soon_threadsafe(lambda: woken.done() or woken.set_result(None))
+
+        self.host.events.listeners.append(listener)
+        try:
+            # Check after listening, so a change in between can't be missed
+            if await loop.run_in_executor(None, self.ready):
+                return True
+            await woken
+            return self.ready()
+        finally:
+            self.host.events.listeners.remove(listener)
+
+    def description(self):
+        return self.waiting_name or "container to be healthy"
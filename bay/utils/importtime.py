@@ -0,0 +1,84 @@
+"""
+Import-time budget check for the CLI.
+
+Run as `python -m bay.utils.importtime --budget 150`. It imports bay.cli in a
+fresh interpreter under `-X importtime` and fails if the cumulative import time
+goes over the budget (in milliseconds), or if any of the modules that should
+only be loaded once a command actually talks to Docker got imported.
+"""
+import os
+import subprocess
+import sys
+
+import click
+
+
+# Modules that must not be imported just to start the CLI
+FORBIDDEN_MODULES = ["docker", "dockerpty", "requests", "pkg_resources"]
+
+
+def measure(module="bay.cli", environ=None):
+    """
+    Imports the module in a subprocess and returns ({module: cumulative
+    microseconds}) for every module imported along the way. The subprocess
+    gets environ as its environment (by default, ours).
+    """
+    environ = os.environ if environ is None else environ
+    # Import this copy of bay, wherever we are run from
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(environ, PYTHONPATH=os.pathsep.join(filter(None, [package_root, environ.get("PYTHONPATH")])))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if result.returncode:
+        raise RuntimeError("Importing {} failed:\n{}".format(module, result.stderr))
+    timings = {}
+    for line in result.stderr.splitlines():
+        # Lines look like "import time:   self [us] |  cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        timings[parts[2].strip()] = int(parts[1].strip())
+    return timings
+
+
+def fastest(module="bay.cli", runs=3, environ=None):
+    """
+    Measures the import several times and returns the timings of the fastest
+    run, which is the one least disturbed by whatever else the machine is doing.
+    """
+    best = None
+    for _ in range(runs):
+        timings = measure(module, environ)
+        if best is None or timings[module] < best[module]:
+            best = timings
+    return best
+
+
+@click.command()
+@click.option("--budget", type=float, default=150, help="Maximum import time in milliseconds")
+@click.option("--module", default="bay.cli", help="Module to import")
+@click.option("--runs", type=int, default=3, help="Number of runs (the fastest is used)")
+def main(budget, module, runs):
+    best = fastest(module, runs)
+    elapsed = best[module] / 1000
+    click.echo("Importing {} took {:.1f}ms (budget {:.1f}ms)".format(module, elapsed, budget))
+    failed = False
+    for name in FORBIDDEN_MODULES:
+        if name in best:
+            click.echo("{} was imported at startup".format(name), err=True)
+            failed = True
+    if elapsed > budget:
+        click.echo("Import time is over budget", err=True)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,15 @@
-from collections import deque
+def dependency_levels(initial, dependencies):
+    """
+    Generic dependency sorting algorithm. Takes initial nodes, and a
+    callable that returns a list of dependencies of a node given a node,
+    and returns the nodes and all their dependencies as a list of levels
+    ("waves"). Each level is a sorted list of nodes whose dependencies are all
+    in earlier levels, so the nodes in a level can be handled in parallel.
+
+    Runs in O(V + E) (plus sorting inside each level), and raises ValueError
+    naming the nodes in a cycle if there is one.
+    """
+    return _levels(_discover(initial, dependencies))
 
 
 def dependency_sort(initial, dependencies):
@@ -7,24 +18,87 @@ def dependency_sort(initial, dependencies):
     callable that returns a list of dependencies of a node given a node,
     and returns a list of the node and its dependencies from most depended
     (depends on nothing) to the node passed in (depends on everything else)
+
+    The order is that of repeatedly passing over the remaining nodes in
+    sorted order, taking each one whose dependencies have all been taken
+    (including earlier in the same pass). Plugin and hook order depend on
+    it, so it is kept, but worked out from the levels in O(V + E) rather
+    than with repeated passes.
+    """
+    mapping = _discover(initial, dependencies)
+    # A node is taken in the first pass where every dependency was taken in
+    # an earlier pass, or earlier in the same one (by sorting before it).
+    # Levels give an order where dependencies come first to work this out in.
+    passes = {}
+    for level in _levels(mapping):
+        for node in level:
+            passes[node] = max(
+                [0] + [passes[dep] + (0 if dep < node else 1) for dep in mapping[node]]
+            )
+    return sorted(mapping, key=lambda node: (passes[node], node))
+
+
+def _discover(initial, dependencies):
+    """
+    Returns {node: set of its dependencies} for the initial nodes and
+    everything they depend on.
     """
-    deps = list(initial)
-    pending = deque(initial)
     mapping = {}
+    pending = list(initial)
+    seen = set(pending)
     while pending:
-        current = pending.popleft()
-        mapping[current] = [x for x in dependencies(current) if x is not None]
+        current = pending.pop()
+        mapping[current] = set(x for x in dependencies(current) if x is not None)
         for dep in mapping[current]:
-            if dep not in pending and dep not in mapping:
+            if dep not in seen:
+                seen.add(dep)
                 pending.append(dep)
-    # Now roll through building a sorted list
-    result = []
-    while mapping:
-        len_before = len(mapping)
-        for node, deps in sorted(mapping.items()):
-            if not deps or all((dep in result) for dep in deps):
-                result.append(node)
-                del mapping[node]
-        if len(mapping) == len_before:
-            raise ValueError("Circular dependency detected between: %s" % mapping.keys())
-    return result
+    return mapping
+
+
+def _levels(mapping):
+    """
+    Splits the nodes in the dependency mapping into levels with Kahn's algorithm.
+    """
+    # Build the reverse edges and count outstanding dependencies per node
+    dependents = {}
+    outstanding = {}
+    for node, deps in mapping.items():
+        outstanding[node] = len(deps)
+        for dep in deps:
+            dependents.setdefault(dep, []).append(node)
+    # Peel off levels of nodes with no outstanding dependencies
+    levels = []
+    level = [node for node, count in outstanding.items() if not count]
+    while level:
+        level.sort()
+        levels.append(level)
+        next_level = []
+        for node in level:
+            del outstanding[node]
+            for dependent in dependents.get(node, []):
+                outstanding[dependent] -= 1
+                if not outstanding[dependent]:
+                    next_level.append(dependent)
+        level = next_level
+    if outstanding:
+        raise ValueError("Circular dependency detected between: %s" % ", ".join(
+            str(node) for node in _find_cycle(mapping, outstanding)
+        ))
+    return levels
+
+
+def _find_cycle(mapping, unresolved):
+    """
+    Given the dependency mapping and the nodes that could not be resolved,
+    returns the nodes of one cycle among them. Every unresolved node has an
+    unresolved dependency, so following those must eventually loop.
+    """
+    node = next(iter(unresolved))
+    path = []
+    positions = {}
+    while node not in positions:
+        positions[node] = len(path)
+        path.append(node)
+        node = next(dep for dep in mapping[node] if dep in unresolved)
+    return path[positions[node]:]
@@ -1,4 +1,5 @@
 import contextlib
+import queue
 import sys
 import threading
 import time
@@ -37,33 +38,111 @@ class ExceptionalThread(threading.Thread):
             raise self.__exception[1]
 
 
-class ThreadSet(set):
+class WorkerPool:
     """
-    Threadsafe set extended with check-and-set style operations
+    Bounded pool of daemon worker threads. Each submitted item is passed to a
+    function on a worker, and (item, exception or None) is put on the
+    completions queue once it finishes.
+
+    Workers are daemon threads (unlike concurrent.futures), so an error or
+    Ctrl-C in the main thread never waits on work that is still running.
+    Threads are started as work is submitted, up to `size`.
+    """
+
+    def __init__(self, size, completions):
+        self.size = size
+        self.completions = completions
+        self.work = queue.Queue()
+        self.threads = []
+
+    def submit(self, item, function):
+        if len(self.threads) < self.size:
+            thread = threading.Thread(target=self.worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self.work.put((item, function))
+
+    def worker(self):
+        while True:
+            task = self.work.get()
+            if task is None:
+                return
+            item, function = task
+            try:
+                function(item)
+            except BaseException as e:
+                self.completions.put((item, e))
+            else:
+                self.completions.put((item, None))
+
+    def shutdown(self):
+        """
+        Tells workers to exit once they finish what they are doing.
+        """
+        for _ in self.threads:
+            self.work.put(None)
+
+
+class KeyedLock:
+    """
+    A set of mutexes, one per key (e.g. a container name), made on demand.
+
+    Waiters sleep on a condition and wake as soon as the key is released, and
+    can give up after a timeout. Contention is counted per key so it is
+    possible to see what work ended up serialised; keys nothing ever waited
+    for are forgotten once released, so there is nothing kept per key used.
     """
 
-    def __init__(self, *args, **kwargs):
-        super(ThreadSet, self).__init__(*args, **kwargs)
-        self.lock = threading.Lock()
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.held = set()
+        # {key: {"acquired": int, "contended": int, "waited": seconds, "max_wait": seconds}}
+        # for held keys and any that were contended
+        self.stats = {}
 
-    def check_and_add(self, value):
+    def acquire(self, key, timeout=None):
         """
-        Checks if value is in the set and if it is not, adds it.
-        Returns False if value is already in the set, True if value was not in the set and was added.
+        Takes the lock for key, waiting up to timeout seconds (forever if
+        None). Raises TimeoutError if it could not be taken in time.
         """
-        with self.lock:
-            if value in self:
-                return False
-            self.add(value)
-            return True
+        start = time.monotonic()
+        with self.condition:
+            stats = self.stats.setdefault(key, {"acquired": 0, "contended": 0, "waited": 0.0, "max_wait": 0.0})
+            if key in self.held:
+                stats["contended"] += 1
+                if not self.condition.wait_for(lambda: key not in self.held, timeout):
+                    self.record_wait(stats, start)
+                    raise TimeoutError("Timed out after {}s waiting for {}".format(timeout, key))
+                self.record_wait(stats, start)
+            self.held.add(key)
+            stats["acquired"] += 1
+
+    def record_wait(self, stats, start):
+        waited = time.monotonic() - start
+        stats["waited"] += waited
+        stats["max_wait"] = max(stats["max_wait"], waited)
+
+    def release(self, key):
+        with self.condition:
+            self.held.remove(key)
+            if not self.stats[key]["contended"]:
+                del self.stats[key]
+            self.condition.notify_all()
 
     @contextlib.contextmanager
-    def entry_lock(self, value, interval=1):
+    def lock(self, key, timeout=None):
+        """
+        Context manager version of acquire/release.
+        """
+        self.acquire(key, timeout)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def contended(self):
         """
-        Context manager that allows entry when the value is not in the set, and removes it
-        once finished.
+        Returns stats for just the keys that anything had to wait for.
         """
-        while not self.check_and_add(value):
-            time.sleep(interval)
-        yield
-        self.remove(value)
+        with self.condition:
+            return {key: dict(stats) for key, stats in self.stats.items() if stats["contended"]}
@@ -38,6 +38,7 @@ setup(
         build_scripts = bay.plugins.build_scripts:BuildScriptsPlugin
         build_volumes = bay.plugins.build_volumes:BuildVolumesPlugin
         container = bay.plugins.container:ContainerPlugin
+        daemon = bay.plugins.daemon:DaemonPlugin
         doctor = bay.plugins.doctor:DoctorPlugin
         gc = bay.plugins.gc:GcPlugin
         help = bay.plugins.help:HelpPlugin
@@ -0,0 +1,116 @@
+import contextlib
+import os
+import tempfile
+
+from docker.errors import NotFound
+
+from bay.cli.tasks import RootTask
+from bay.cli.timings import Timings
+from bay.config import Config
+from bay.containers.formation import ContainerFormation
+from bay.containers.graph import ContainerGraph
+
+
+def make_library(extra_files=None):
+    """
+    Writes a small container library to a temporary directory and returns
+    its path: "db", and "web" which links to it, plus any extra files given.
+    """
+    path = tempfile.mkdtemp(prefix="bay-test-")
+    files = {
+        "bay.yaml": "prefix: test\n",
+        "db/Dockerfile": "FROM scratch\n",
+        "web/Dockerfile": "FROM scratch\n",
+        "web/bay.yaml": "links: [db]\nenvironment: {MODE: web}\n",
+    }
+    files.update(extra_files or {})
+    for name, contents in files.items():
+        os.makedirs(os.path.dirname(os.path.join(path, name)), exist_ok=True)
+        with open(os.path.join(path, name), "w") as fh:
+            fh.write(contents)
+    return path
+
+
+class FakeImages:
+
+    def image_version(self, image_name, image_tag):
+        return "sha256:{}".format(image_name)
+
+
+class FakeEvents:
+    """
+    An event stream that never sees any events.
+    """
+    started = False
+
+    def __init__(self):
+        self.listeners = []
+
+    def start(self, network):
+        pass
+
+    def state(self, name):
+        return None
+
+
+class FakeClient:
+    """
+    A Docker client with at most one (stopped) container on it.
+    """
+
+    def __init__(self, details=None):
+        self.details = details
+        self.removed = []
+
+    def inspect_container(self, name):
+        if self.details is None:
+            raise NotFound("Not Found", None, explanation="No such container: {}".format(name))
+        return self.details
+
+    def remove_container(self, name):
+        self.removed.append(name)
+
+
+class FakeHost:
+
+    def __init__(self, alias="default"):
+        self.alias = alias
+        self.client = FakeClient()
+        self.images = FakeImages()
+        self.events = FakeEvents()
+
+
+class FakeFormations:
+    """
+    Stands in for FormationCache, with a fixed running formation.
+    """
+
+    def __init__(self, formation):
+        self.formation = formation
+
+    def get(self, host, follow=True):
+        return self.formation.clone()
+
+
+class FakeApp:
+    """
+    Just enough of App for runner and plugin code.
+    """
+
+    def __init__(self, library=None, config_paths=()):
+        self.config = Config(list(config_paths))
+        self.containers = ContainerGraph(library or make_library())
+        self.formations = FakeFormations(ContainerFormation(self.containers))
+        self.timings = Timings()
+        self.root_task = RootTask()
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Swallows task output, returning what was written to stdout.
+    """
+    import io
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        yield output
@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from bay.docker.build import BuildScheduler, build_log_path
+from bay.exceptions import BuildFailureError
+
+from .helpers import FakeApp, FakeHost, make_library
+
+
+class BuildLogPathTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="bay-test-")
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def make_app(self, build_log_path):
+        app = FakeApp()
+        app.config.add_config({"bay": {"build_log_path": build_log_path}}, "<test>")
+        return app
+
+    def test_container_in_directory(self):
+        app = self.make_app(os.path.join(self.dir, "{prefix}", "{container}", "build.log"))
+        path = build_log_path(app, app.containers["db"])
+        self.assertEqual(path, os.path.join(self.dir, "test", "db", "build.log"))
+        self.assertTrue(os.path.isdir(os.path.dirname(path)))
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "test", "{container}")))
+
+    def test_single_file_gets_one_per_container(self):
+        app = self.make_app(os.path.join(self.dir, "{prefix}", "build.log"))
+        self.assertEqual(
+            build_log_path(app, app.containers["db"]),
+            os.path.join(self.dir, "test", "build.db.log"),
+        )
+        self.assertEqual(
+            build_log_path(app, app.containers["web"]),
+            os.path.join(self.dir, "test", "build.web.log"),
+        )
+
+
+class BuildSchedulerTests(unittest.TestCase):
+    """
+    Builds a library where "app" and "worker" build on "base", and "appext"
+    on "app", alongside the independent "db" and "web".
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="bay-test-")
+        self.addCleanup(shutil.rmtree, self.dir)
+        library = make_library({
+            "base/Dockerfile": "FROM scratch\n",
+            "app/Dockerfile": "FROM test/base\n",
+            "worker/Dockerfile": "FROM test/base\n",
+            "appext/Dockerfile": "FROM test/app\n",
+        })
+        self.addCleanup(shutil.rmtree, library)
+        self.app = FakeApp(library)
+        self.app.config.add_config(
+            {"bay": {"build_log_path": os.path.join(self.dir, "{container}.log")}},
+            "<test>",
+        )
+        self.containers = [
+            self.app.containers[name]
+            for name in ("base", "db", "web", "app", "worker", "appext")
+        ]
+
+    def build(self, failing, keep_going=False, concurrency=1):
+        """
+        Runs the scheduler with the named containers failing to build.
+        Returns it along with the order builds were started in.
+        """
+        started = []
+        lock = threading.Lock()
+
+        def build_one(container):
+            with lock:
+                started.append(container.name)
+            if container.name in failing:
+                raise BuildFailureError("{} failed".format(container.name))
+
+        scheduler = BuildScheduler(
+            self.app,
+            FakeHost(),
+            self.app.root_task,
+            concurrency=concurrency,
+            keep_going=keep_going,
+        )
+        with mock.patch.object(scheduler, "build_one", side_effect=build_one):
+            success = scheduler.build(self.containers)
+        self.assertEqual(success, not failing)
+        return scheduler, started
+
+    def names(self, containers):
+        return sorted(container.name for container in containers)
+
+    def test_all_built(self):
+        scheduler, started = self.build(set(), concurrency=4)
+        self.assertEqual(self.names(scheduler.built), ["app", "appext", "base", "db", "web", "worker"])
+        self.assertEqual(scheduler.failed, {})
+        self.assertEqual(scheduler.skipped, [])
+        # Each builds after its parent
+        self.assertLess(started.index("base"), started.index("app"))
+        self.assertLess(started.index("base"), started.index("worker"))
+        self.assertLess(started.index("app"), started.index("appext"))
+
+    def test_fail_fast(self):
+        scheduler, started = self.build({"base"})
+        self.assertEqual(started, ["base"])
+        self.assertEqual(scheduler.built, [])
+        self.assertEqual(scheduler.failed, {self.app.containers["base"]: os.path.join(self.dir, "base.log")})
+        self.assertEqual(self.names(scheduler.skipped), ["app", "appext", "db", "web", "worker"])
+
+    def test_fail_fast_lets_running_builds_finish(self):
+        scheduler, started = self.build({"base"}, concurrency=4)
+        self.assertEqual(sorted(started), ["base", "db", "web"])
+        self.assertEqual(self.names(scheduler.built), ["db", "web"])
+        self.assertEqual(self.names(scheduler.failed), ["base"])
+        self.assertEqual(self.names(scheduler.skipped), ["app", "appext", "worker"])
+
+    def test_keep_going(self):
+        scheduler, started = self.build({"base"}, keep_going=True)
+        self.assertEqual(started, ["base", "db", "web"])
+        self.assertEqual(self.names(scheduler.built), ["db", "web"])
+        self.assertEqual(self.names(scheduler.failed), ["base"])
+        # Only what builds on top of the failure is skipped
+        self.assertEqual(self.names(scheduler.skipped), ["app", "appext", "worker"])
+
+    def test_keep_going_builds_siblings(self):
+        scheduler, started = self.build({"app"}, keep_going=True)
+        self.assertEqual(self.names(scheduler.built), ["base", "db", "web", "worker"])
+        self.assertEqual(self.names(scheduler.failed), ["app"])
+        self.assertEqual(self.names(scheduler.skipped), ["appext"])
@@ -0,0 +1,197 @@
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import click
+
+from bay.cli.daemon import (
+    PINNED_ENVIRONMENT, DaemonClient, DaemonServer, receive_message, send_message, socket_path,
+)
+
+from .helpers import FakeApp, make_library
+
+
+@click.group()
+@click.option("-c", "--config", multiple=True)
+def cli(config):
+    pass
+
+
+@cli.command()
+def ps():
+    # Straight to the fd, so it does not matter what sys.stdout is
+    os.write(1, b"ps output\n")
+    sys.exit(3)
+
+
+@cli.command()
+def build():
+    pass
+
+
+class FakeFormations:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def after_fork(self):
+        pass
+
+
+class DaemonClientTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="bay-test-")
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "daemon.sock")
+        environ = mock.patch.dict(os.environ, {"BAY_DAEMON_SOCKET": self.path})
+        environ.start()
+        self.addCleanup(environ.stop)
+        os.environ.pop("BAY_NO_DAEMON", None)
+
+    def test_socket_path_from_environment(self):
+        self.assertEqual(socket_path(), self.path)
+
+    def test_no_socket(self):
+        with mock.patch.object(DaemonClient, "run") as run:
+            self.assertIsNone(DaemonClient.forward(["ps"]))
+        self.assertFalse(run.called)
+
+    def test_disabled(self):
+        open(self.path, "w").close()
+        os.environ["BAY_NO_DAEMON"] = "1"
+        with mock.patch.object(DaemonClient, "run") as run:
+            self.assertIsNone(DaemonClient.forward(["ps"]))
+        self.assertFalse(run.called)
+
+    def test_forwarded_unparsed(self):
+        """
+        The client does not parse the command line or load any config; the
+        daemon does both.
+        """
+        open(self.path, "w").close()
+        with mock.patch.object(DaemonClient, "run", return_value=0) as run, \
+                mock.patch("bay.cli.daemon.Config") as config:
+            self.assertEqual(DaemonClient.forward(["-c", "x.yaml", "ps"]), 0)
+        run.assert_called_once_with(["-c", "x.yaml", "ps"])
+        self.assertFalse(config.called)
+
+    def test_nothing_listening(self):
+        open(self.path, "w").close()
+        self.assertIsNone(DaemonClient.forward(["ps"]))
+
+
+class FdPassingTests(unittest.TestCase):
+
+    def test_fds_arrive_with_message(self):
+        read_fd, write_fd = os.pipe()
+        sender, receiver = socket.socketpair()
+        try:
+            send_message(sender, {"argv": ["ps"]}, fds=[write_fd])
+            os.close(write_fd)
+            message, fds = receive_message(receiver)
+            self.assertEqual(message, {"argv": ["ps"]})
+            self.assertEqual(len(fds), 1)
+            os.write(fds[0], b"hello")
+            os.close(fds[0])
+            self.assertEqual(os.read(read_fd, 5), b"hello")
+        finally:
+            os.close(read_fd)
+            sender.close()
+            receiver.close()
+
+    def test_closed_connection(self):
+        sender, receiver = socket.socketpair()
+        sender.close()
+        self.assertEqual(receive_message(receiver), (None, []))
+        receiver.close()
+
+
+class DaemonServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.library = make_library({
+            "console/Dockerfile": "FROM scratch\n",
+            "console/bay.yaml": "foreground: true\nlinks: [web]\n",
+        })
+        self.addCleanup(shutil.rmtree, self.library)
+        with open(os.path.join(self.library, "config.yaml"), "w") as fh:
+            fh.write("bay:\n  home: {}\n".format(self.library))
+        self.app = FakeApp(self.library)
+        self.app.cli = cli
+        self.app.hosts = []
+        self.app.formations = FakeFormations()
+        self.server = DaemonServer(self.app, os.path.join(self.library, "daemon.sock"))
+        self.server.environment = {name: os.environ.get(name) for name in PINNED_ENVIRONMENT}
+        self.stdout_read, self.stdout_write = os.pipe()
+        self.stdin = os.open(os.devnull, os.O_RDONLY)
+
+    def tearDown(self):
+        for fd in (self.stdout_read, self.stdout_write, self.stdin):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def request(self, argv, env=None):
+        """
+        Sends a request to the server and returns its reply.
+        """
+        client, server = socket.socketpair()
+        client.settimeout(10)
+        try:
+            send_message(
+                client,
+                {"argv": argv, "cwd": self.library, "env": dict(os.environ, **(env or {}))},
+                fds=[self.stdin, self.stdout_write, self.stdout_write],
+            )
+            self.server.handle(server)
+            return receive_message(client)[0]
+        finally:
+            client.close()
+
+    def test_runs_command_in_child(self):
+        self.server.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        reply = self.request(["-c", "config.yaml", "ps"])
+        self.assertEqual(reply, {"exit": 3})
+        os.close(self.stdout_write)
+        self.assertEqual(os.read(self.stdout_read, 100), b"ps output\n")
+
+    def test_refuses_command_not_forwarded(self):
+        with mock.patch.object(self.server, "fork_command") as fork_command:
+            reply = self.request(["-c", "config.yaml", "build"])
+        self.assertIn("refused", reply)
+        self.assertFalse(fork_command.called)
+
+    def test_refuses_other_environment(self):
+        with mock.patch.object(self.server, "fork_command") as fork_command:
+            reply = self.request(["-c", "config.yaml", "ps"], env={"DOCKER_HOST": "tcp://elsewhere:2375"})
+        self.assertEqual(reply, {"refused": "environment differs from the daemon's"})
+        self.assertFalse(fork_command.called)
+
+    def test_refuses_other_library(self):
+        other = make_library()
+        self.addCleanup(shutil.rmtree, other)
+        with open(os.path.join(self.library, "other.yaml"), "w") as fh:
+            fh.write("bay:\n  home: {}\n".format(other))
+        with mock.patch.object(self.server, "fork_command") as fork_command:
+            reply = self.request(["-c", "other.yaml", "ps"])
+        self.assertEqual(reply, {"refused": "library differs from the daemon's"})
+        self.assertFalse(fork_command.called)
+
+    def test_refuses_foreground_containers(self):
+        with mock.patch.object(self.server, "fork_command") as fork_command:
+            reply = self.request(["-c", "config.yaml", "up", "console"])
+        self.assertEqual(reply, {"refused": "command runs a foreground container"})
+        self.assertFalse(fork_command.called)
+
+    def test_needs_terminal(self):
+        self.assertTrue(self.server.needs_terminal(["up", "console"]))
+        self.assertTrue(self.server.needs_terminal(["up", "all"]))
+        self.assertFalse(self.server.needs_terminal(["up", "web"]))
+        self.assertFalse(self.server.needs_terminal(["ps"]))
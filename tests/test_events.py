@@ -0,0 +1,217 @@
+import threading
+import time
+import unittest
+
+from bay.docker.hosts import Host
+from bay.docker.towline import Towline
+
+
+class FakeResponse:
+    status_code = 404
+
+
+class FakeClient:
+    """
+    Docker client for one container, which Docker says is running.
+    """
+
+    def __init__(self):
+        self.running = True
+
+    def inspect_container(self, name):
+        return {"State": {"Running": self.running}}
+
+    def _url(self, path, *args):
+        return path.format(*args)
+
+    def head(self, url, params=None):
+        return FakeResponse()
+
+
+def event(name, action):
+    return {"Action": action, "Actor": {"Attributes": {"name": name}}, "time": int(time.time())}
+
+
+class LaggingEventTests(unittest.TestCase):
+    """
+    The start event for a container can arrive after we have started it and
+    first looked at it; until then, events only know it was created.
+    """
+
+    name = "test.db.1"
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.host = Host(alias="default", url="unix:///nonexistent", tls_ca=None, tls_cert=None, tls_key=None)
+        self.host.make_client = lambda: self.client
+        # Pretend the stream is being followed, and feed it events by hand
+        self.host.events.started = True
+        self.host.events.handle(event(self.name, "create"))
+
+    def test_container_running_before_start_event(self):
+        self.assertTrue(self.host.container_running(self.name))
+        self.host.events.handle(event(self.name, "start"))
+        self.assertTrue(self.host.container_running(self.name))
+        self.client.running = False
+        self.host.events.handle(event(self.name, "die"))
+        self.assertFalse(self.host.container_running(self.name))
+
+    def test_towline_before_start_event(self):
+        towline = Towline(self.host, self.name)
+        # First check: Docker has started it, but events only know it was created
+        finished, _ = towline.status
+        self.assertIsNone(finished)
+        # Waiting must not return early as if it had exited
+        started = time.monotonic()
+        self.assertFalse(self.host.events.wait_for_exit(self.name, timeout=0.2))
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        # The start event turns up late
+        self.host.events.handle(event(self.name, "start"))
+        finished, _ = towline.status
+        self.assertIsNone(finished)
+        # A real death is still seen
+        self.client.running = False
+        self.host.events.handle(event(self.name, "die"))
+        self.assertTrue(self.host.events.wait_for_exit(self.name, timeout=0.2))
+        self.assertEqual(towline.status, (False, "Container died during boot"))
+
+
+class FakeEventsClient:
+    """
+    Docker client whose event streams are given by the test.
+    """
+
+    def __init__(self, streams):
+        self.streams = list(streams)
+        self.filters = []
+
+    def events(self, since=None, until=None, filters=None, decode=False):
+        self.filters.append(filters)
+        self.since = since
+        self.until = until
+        stream = self.streams.pop(0)
+        if isinstance(stream, Exception):
+            raise stream
+        return iter(stream)
+
+
+def failing_stream(events, error):
+    yield from events
+    raise error
+
+
+def blocking_stream(release):
+    release.wait()
+    yield from ()
+
+
+class EventStreamTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = Host(alias="default", url="unix:///nonexistent", tls_ca=None, tls_cert=None, tls_key=None)
+        self.events = self.host.events
+        self.events.RECONNECT_DELAY = 0
+
+    def follow(self, streams):
+        """
+        Follows the given streams until they run out (which the fake client
+        signals with an IndexError, as it is not a stream error).
+        """
+        client = FakeEventsClient(streams)
+        self.host.make_client = lambda: client
+        self.events.network = "test"
+        self.events.generation = 1
+        with self.assertRaises(IndexError):
+            self.events.follow(self.events.connect("test"), 1, "test")
+        return client
+
+    def test_filters_by_network(self):
+        client = self.follow([[]])
+        self.assertEqual(client.filters[0], {
+            "type": "container",
+            "label": ["com.eventbrite.bay.container", "com.eventbrite.bay.network=test"],
+        })
+
+    def test_reconnects_when_stream_drops(self):
+        import requests
+        self.follow([
+            failing_stream([event("test.db.1", "start")], requests.exceptions.ConnectionError()),
+            OSError("Docker is restarting"),
+            [event("test.db.1", "die")],
+        ])
+        self.assertTrue(self.events.state("test.db.1")["exited"])
+
+    def test_listener_errors_are_logged(self):
+        def listener(host, name, action):
+            raise KeyError(name)
+        self.events.listeners.append(listener)
+        with self.assertLogs("bay.docker.events") as logs:
+            self.follow([[event("test.db.1", "start"), event("test.db.1", "die")]])
+        self.assertEqual(len(logs.records), 2)
+        # The stream carried on to the second event
+        self.assertTrue(self.events.state("test.db.1")["exited"])
+
+    def test_other_errors_are_raised(self):
+        with self.assertRaises(ValueError):
+            self.follow([failing_stream([], ValueError("bad JSON"))])
+
+    def test_catch_up(self):
+        """
+        Catching up handles the events since the last one handled, up to
+        now, before returning.
+        """
+        client = FakeEventsClient([[event("test.db.1", "start"), event("test.db.1", "die")]])
+        client.close = lambda: None
+        self.host.make_client = lambda: client
+        self.events.last_time = 1500000000
+        seen = []
+        self.events.listeners.append(lambda host, name, action: seen.append((name, action)))
+        self.events.catch_up("test")
+        self.assertEqual(seen, [("test.db.1", "start"), ("test.db.1", "die")])
+        self.assertTrue(self.events.state("test.db.1")["exited"])
+        self.assertEqual(client.since, 1500000000)
+        self.assertLessEqual(float(client.until), time.time())
+        self.assertEqual(client.filters[0]["label"][1], "com.eventbrite.bay.network=test")
+
+    def test_connects_outside_the_lock(self):
+        """
+        Other threads can use the stream while it connects, and a second
+        start() that gets in first leaves only one stream followed.
+        """
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.addCleanup(setattr, self.events, "generation", -1)
+        opened = []
+        test = self
+
+        class Client:
+            def events(self, since=None, filters=None, decode=False):
+                reader = threading.Thread(target=test.events.state, args=("test.db.1",))
+                reader.start()
+                reader.join(1)
+                test.assertFalse(reader.is_alive())
+                stream = blocking_stream(release)
+                opened.append(stream)
+                if len(opened) == 1:
+                    test.events.start("test")
+                return stream
+
+        self.host.make_client = Client
+        self.events.start("test")
+        self.assertEqual(len(opened), 2)
+        self.assertEqual(self.events.generation, 1)
+        # The first stream was closed without being read
+        self.assertIsNone(opened[0].gi_frame)
+
+    def test_destroyed_containers_are_forgotten(self):
+        self.events.MAX_DESTROYED = 2
+        for number in range(5):
+            name = "test.run.{}".format(number)
+            for action in ("create", "start", "die", "destroy"):
+                self.events.handle(event(name, action))
+        self.events.handle(event("test.db.1", "start"))
+        self.assertEqual(sorted(self.events.states), ["test.db.1", "test.run.3", "test.run.4"])
+        self.assertTrue(self.events.state("test.run.4")["exited"])
+        # Creating one again means it is no longer destroyed
+        self.events.handle(event("test.run.4", "create"))
+        self.assertEqual(list(self.events.destroyed), ["test.run.3"])
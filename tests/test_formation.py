@@ -0,0 +1,38 @@
+import unittest
+
+from bay.containers.formation import ContainerFormation
+
+from .helpers import FakeApp, FakeHost
+
+
+class FingerprintTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = FakeApp()
+        self.host = FakeHost()
+
+    def add(self, name):
+        return ContainerFormation(self.app.containers).add_container(self.app.containers[name], self.host)
+
+    def test_stable_across_add_container(self):
+        """
+        Hooks changing one instance's environment (as legacy_env and
+        ssh_agent do) must not leak into the next instance of the container.
+        """
+        first = self.add("web")
+        fingerprint = first.fingerprint()
+        first.environment["SSHKEY0"] = "secret"
+        first.devmodes.add("debug")
+        second = self.add("web")
+        self.assertEqual(second.fingerprint(), fingerprint)
+        self.assertEqual(second.environment, {"MODE": "web"})
+        self.assertEqual(self.app.containers["web"].environment, {"MODE": "web"})
+
+    def test_clone_is_independent(self):
+        instance = self.add("web")
+        fingerprint = instance.fingerprint()
+        clone = instance.clone()
+        clone.environment["EXTRA"] = "1"
+        clone.ports[8080] = 80
+        self.assertEqual(instance.fingerprint(), fingerprint)
+        self.assertNotEqual(clone.fingerprint(), fingerprint)
@@ -0,0 +1,120 @@
+import os
+import shutil
+import unittest
+
+from bay.containers.graph import ContainerGraph
+
+from .helpers import make_library
+
+
+class BuildChildrenTests(unittest.TestCase):
+
+    def setUp(self):
+        path = make_library({
+            "base/Dockerfile": "FROM scratch\n",
+            "app/Dockerfile": "FROM test/base\n",
+            "worker/Dockerfile": "FROM test/base\n",
+        })
+        self.addCleanup(shutil.rmtree, path)
+        self.graph = ContainerGraph(path)
+
+    def test_build_children(self):
+        base, app, worker = self.graph["base"], self.graph["app"], self.graph["worker"]
+        self.assertEqual(self.graph.build_children(base), {app, worker})
+        self.assertEqual(self.graph.build_children(app), set())
+
+    def test_rebuilding_on_another_parent(self):
+        base, app, worker = self.graph["base"], self.graph["app"], self.graph["worker"]
+        self.graph.add_build_dependency(worker, app)
+        self.assertEqual(self.graph.build_children(base), {app})
+        self.assertEqual(self.graph.build_children(app), {worker})
+        self.assertEqual(self.graph.build_ancestry(worker), [base, app])
+
+
+class InheritedConfigTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = make_library({
+            "base/Dockerfile": "FROM scratch\n",
+            "base/bay.yaml": (
+                "volumes: {/data: ../data, /cache: basecache}\n"
+                "devmodes: {src: {/src: ../base-src}, tools: {/tools: ../tools}}\n"
+            ),
+            "app/Dockerfile": "FROM test/base\n",
+            "app/bay.yaml": (
+                "volumes: {/cache: appcache}\n"
+                "devmodes: {src: {/src: ../app-src}}\n"
+                "synthesize_healthcheck: true\n"
+                "team: web\n"
+            ),
+        })
+        self.addCleanup(shutil.rmtree, self.path)
+        self.graph = ContainerGraph(self.path)
+        self.base, self.app = self.graph["base"], self.graph["app"]
+
+    def test_child_overrides_parent(self):
+        self.assertEqual(dict(self.app.devmodes), {"src": {"/src": "../app-src"}, "tools": {"/tools": "../tools"}})
+        self.assertEqual(dict(self.app.named_volumes), {"/cache": "appcache"})
+        self.assertEqual(dict(self.app.bound_volumes), {"/data": os.path.join(os.path.dirname(self.path), "data")})
+        self.assertEqual(dict(self.base.devmodes["src"]), {"/src": "../base-src"})
+
+    def test_read_only(self):
+        with self.assertRaises(TypeError):
+            self.app.devmodes["new"] = {}
+        with self.assertRaises(TypeError):
+            self.app.devmodes["src"]["/other"] = "../other"
+        with self.assertRaises(TypeError):
+            self.app.bound_volumes["/other"] = "/tmp"
+
+    def test_shared_until_invalidated(self):
+        devmodes = self.app.devmodes
+        self.assertIs(self.app.devmodes, devmodes)
+        self.base._devmodes["tools"] = {"/tools": "../new-tools"}
+        self.assertIs(self.app.devmodes, devmodes)
+        self.graph.invalidate()
+        self.assertEqual(dict(self.app.devmodes["tools"]), {"/tools": "../new-tools"})
+
+    def test_extra_data(self):
+        self.assertEqual(self.app.extra_data, {"team": "web"})
+
+
+class ClosureTests(unittest.TestCase):
+    """
+    Runtime links: "api" links to "web", which links to "db"; "cache" is on its own.
+    """
+
+    def setUp(self):
+        path = make_library({
+            "api/Dockerfile": "FROM scratch\n",
+            "api/bay.yaml": "links: [web]\n",
+            "cache/Dockerfile": "FROM scratch\n",
+        })
+        self.addCleanup(shutil.rmtree, path)
+        self.graph = ContainerGraph(path)
+        self.api, self.web, self.db, self.cache = (self.graph[name] for name in ("api", "web", "db", "cache"))
+
+    def test_ancestors(self):
+        self.assertEqual(self.graph.ancestors(self.api), {self.web, self.db})
+        self.assertEqual(self.graph.ancestors(self.web), {self.db})
+        self.assertEqual(self.graph.ancestors(self.db), set())
+        self.assertEqual(self.graph.ancestors(self.cache), set())
+
+    def test_descendants(self):
+        self.assertEqual(self.graph.descendants(self.db), {self.web, self.api})
+        self.assertEqual(self.graph.descendants(self.web), {self.api})
+        self.assertEqual(self.graph.descendants(self.api), set())
+        self.assertIsInstance(self.graph.descendants(self.db), frozenset)
+
+    def test_memoised_until_invalidated(self):
+        descendants = self.graph.descendants(self.db)
+        self.assertIs(self.graph.descendants(self.db), descendants)
+        self.graph.invalidate()
+        self.assertIsNot(self.graph.descendants(self.db), descendants)
+
+    def test_changing_links_invalidates(self):
+        self.assertEqual(self.graph.descendants(self.db), {self.web, self.api})
+        self.graph.set_dependencies(self.api, [self.db, self.cache])
+        self.assertEqual(self.graph.ancestors(self.api), {self.db, self.cache})
+        self.assertEqual(self.graph.descendants(self.db), {self.web, self.api})
+        self.assertEqual(self.graph.descendants(self.web), set())
+        self.assertEqual(self.graph.descendants(self.cache), {self.api})
@@ -0,0 +1,51 @@
+import unittest
+
+from bay.docker.images import PullScheduler
+
+from .helpers import FakeApp
+
+
+class FakeImages:
+
+    def __init__(self):
+        self.registry_lookups = 0
+        self.pulled = []
+
+    def get_registry_url(self, app, task):
+        self.registry_lookups += 1
+        return "registry.example.com"
+
+    def pull_image_version(self, app, image_name, image_tag, **kwargs):
+        self.pulled.append((image_name, image_tag))
+
+
+class FakeHost:
+
+    def __init__(self):
+        self.images = FakeImages()
+
+
+class FakeContainer:
+
+    def __init__(self, image_tag):
+        self.image_name = "test/db"
+        self.image_tag = image_tag
+
+
+class PullSchedulerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = FakeApp()
+        self.host = FakeHost()
+        self.pulls = PullScheduler(self.app, self.host, self.app.root_task)
+
+    def test_local_image_skips_registry(self):
+        self.assertFalse(self.pulls.pull(FakeContainer("local")))
+        self.assertEqual(self.host.images.registry_lookups, 0)
+        self.assertEqual(self.host.images.pulled, [])
+
+    def test_registry_looked_up_once(self):
+        self.assertTrue(self.pulls.pull(FakeContainer("latest")))
+        self.assertTrue(self.pulls.pull(FakeContainer("v2")))
+        self.assertEqual(self.host.images.registry_lookups, 1)
+        self.assertEqual(self.host.images.pulled, [("test/db", "latest"), ("test/db", "v2")])
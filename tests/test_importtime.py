@@ -0,0 +1,36 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bay.utils.importtime import FORBIDDEN_MODULES, fastest
+
+
+class ImportTimeTests(unittest.TestCase):
+    """
+    Starting the CLI must stay fast. The budget here is looser than the
+    150ms `make importtime` aims for, so that slower CI machines do not fail
+    it at random; set BAY_IMPORTTIME_BUDGET (in milliseconds) to change it.
+    """
+
+    budget = float(os.environ.get("BAY_IMPORTTIME_BUDGET", 400))
+
+    @classmethod
+    def setUpClass(cls):
+        # Anything bay writes (like the plugin manifest) goes in a throwaway home
+        home = tempfile.mkdtemp(prefix="bay-test-")
+        try:
+            cls.timings = fastest("bay.cli", runs=5, environ=dict(os.environ, HOME=home, BAY_HOME=home))
+        finally:
+            shutil.rmtree(home)
+
+    def test_within_budget(self):
+        elapsed = self.timings["bay.cli"] / 1000
+        self.assertLessEqual(
+            elapsed,
+            self.budget,
+            "Importing bay.cli took {:.1f}ms (budget {:.1f}ms)".format(elapsed, self.budget),
+        )
+
+    def test_no_docker_imports(self):
+        self.assertEqual([name for name in FORBIDDEN_MODULES if name in self.timings], [])
@@ -0,0 +1,262 @@
+import json
+import unittest
+from unittest import mock
+
+from bay.containers.formation import ContainerFormation, ContainerInstance
+from bay.docker.introspect import FormationCache, FormationIntrospector
+from bay.docker.runner import FormationRunner
+
+from .helpers import FakeApp, FakeClient, FakeImages
+
+
+def summary(name, container, links=None):
+    """
+    Returns a container's summary as the list API gives it, with the links
+    label if links are given.
+    """
+    labels = {FormationIntrospector.LABEL: container}
+    if links is not None:
+        labels[ContainerInstance.LINKS_LABEL] = json.dumps(links)
+    return {
+        "Id": name,
+        "Names": ["/" + name],
+        "Image": "test/{}".format(container),
+        "ImageID": "sha256:{}".format(container),
+        "Labels": labels,
+        "Mounts": [],
+        "Ports": [{"PrivatePort": 80, "PublicPort": 8000}],
+        "NetworkSettings": {"Networks": {"test": {"IPAddress": "10.0.0.2", "Links": None}}},
+    }
+
+
+class CountingClient:
+    """
+    Docker client that records the calls made to it.
+    """
+
+    def __init__(self, summaries):
+        self.summaries = summaries
+        self.calls = []
+
+    def containers(self, **kwargs):
+        self.calls.append("containers")
+        return self.summaries
+
+    def inspect_container(self, name):
+        self.calls.append("inspect_container")
+        return {
+            "Name": "/" + name,
+            "Image": "sha256:db",
+            "Config": {"Image": "test/db", "Labels": {FormationIntrospector.LABEL: "db"}},
+            "Mounts": [],
+            "NetworkSettings": {
+                "Ports": {},
+                "Networks": {"test": {"IPAddress": "10.0.0.3", "Links": None}},
+            },
+        }
+
+
+class FakeHost:
+
+    def __init__(self, client):
+        self.client = client
+        self.images = FakeImages()
+
+
+class IntrospectionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = FakeApp()
+
+    def test_labelled_containers_are_not_inspected(self):
+        client = CountingClient([
+            summary("test.db.1", "db", links=[]),
+            summary("test.web.1", "web", links=["test.db.1:db"]),
+        ])
+        formation = FormationIntrospector(FakeHost(client), self.app.containers).introspect()
+        self.assertEqual(client.calls, ["containers"])
+        self.assertIs(formation["test.web.1"].links["db"], formation["test.db.1"])
+        self.assertEqual(formation["test.web.1"].port_mapping, {80: 8000})
+
+    def test_unlabelled_containers_are_inspected(self):
+        client = CountingClient([
+            summary("test.db.1", "db"),
+            summary("test.web.1", "web", links=["test.db.1:db"]),
+        ])
+        formation = FormationIntrospector(FakeHost(client), self.app.containers).introspect()
+        self.assertEqual(client.calls, ["containers", "inspect_container"])
+        self.assertEqual(formation["test.db.1"].ip_address, "10.0.0.3")
+
+
+class FakeEvents:
+    """
+    An event stream whose events the test sends, and which has some events
+    a parent process had not got to yet for catch_up().
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.listeners = []
+        self.calls = []
+        self.missed = []
+
+    def start(self, network):
+        self.calls.append(("start", network))
+
+    def catch_up(self, network):
+        self.calls.append(("catch_up", network))
+        if isinstance(self.missed, Exception):
+            raise self.missed
+        for name, action in self.missed:
+            self.emit(name, action)
+
+    def emit(self, name, action):
+        for listener in list(self.listeners):
+            listener(self.host, name, action)
+
+
+class EventHost:
+
+    alias = "default"
+
+    def __init__(self):
+        self.images = FakeImages()
+        self.events = FakeEvents(self)
+        self.client = FakeClient()
+
+
+class FormationCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = FakeApp()
+        self.host = EventHost()
+        self.cache = FormationCache(self.app)
+        self.running = ["db", "web"]
+        self.introspections = 0
+        patcher = mock.patch.object(FormationIntrospector, "introspect", side_effect=self.introspect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def introspect(self):
+        self.introspections += 1
+        formation = ContainerFormation(self.app.containers)
+        for name in self.running:
+            formation.add_container(self.app.containers[name], self.host)
+        # Adding a container adds the ones it links to, too
+        for instance in list(formation):
+            if instance.container.name not in self.running:
+                formation.discard_instance(instance.name)
+        return formation
+
+    def names(self, formation):
+        return sorted(instance.name for instance in formation)
+
+    def test_get_returns_clone(self):
+        formation = self.cache.get(self.host)
+        formation.discard_instance("test.web.1")
+        self.assertEqual(self.names(self.cache.get(self.host)), ["test.db.1", "test.web.1"])
+        self.assertEqual(self.introspections, 1)
+
+    def test_follows_events_once(self):
+        self.cache.get(self.host)
+        self.cache.get(self.host)
+        self.assertEqual(self.host.events.calls, [("start", "test")])
+        self.assertEqual(self.host.events.listeners, [self.cache.on_event])
+
+    def test_no_follow(self):
+        self.cache.get(self.host, follow=False)
+        self.assertEqual(self.host.events.calls, [])
+
+    def test_own_events_keep_cache(self):
+        self.cache.get(self.host)
+        self.cache.expect(self.host, "test.db.1", "die")
+        self.cache.record_stopped(self.host, "test.db.1")
+        self.host.events.emit("test.db.1", "die")
+        self.assertEqual(self.names(self.cache.get(self.host)), ["test.web.1"])
+        self.assertEqual(self.introspections, 1)
+
+    def test_foreign_events_drop_cache(self):
+        for name, action in [("test.db.1", "die"), ("test.web.1", "destroy"), ("test.other.1", "start")]:
+            self.cache.get(self.host)
+            introspections = self.introspections
+            self.host.events.emit(name, action)
+            self.cache.get(self.host)
+            self.assertEqual(self.introspections, introspections + 1, (name, action))
+
+    def test_events_that_change_nothing_keep_cache(self):
+        self.cache.get(self.host)
+        self.host.events.emit("test.db.1", "start")
+        self.host.events.emit("test.other.1", "die")
+        self.host.events.emit("test.db.1", "health_status: healthy")
+        self.cache.get(self.host)
+        self.assertEqual(self.introspections, 1)
+
+    def test_record_started(self):
+        self.running = ["db"]
+        self.cache.get(self.host)
+        target = ContainerFormation(self.app.containers)
+        instance = target.add_container(self.app.containers["web"], self.host)
+        self.cache.record_started(self.host, instance.clone())
+        formation = self.cache.get(self.host)
+        self.assertEqual(self.names(formation), ["test.db.1", "test.web.1"])
+        self.assertEqual(formation["test.web.1"].links["db"].name, "test.db.1")
+
+    def record_plan(self, target_names):
+        """
+        Plans and records a change to the named containers, as a dry run does.
+        """
+        target = ContainerFormation(self.app.containers)
+        for name in target_names:
+            target.add_container(self.app.containers[name], self.host)
+        plan = FormationRunner(self.app, self.host, target, task=None).plan(self.cache.get(self.host, follow=False))
+        self.cache.record_plan(self.host, plan)
+
+    def test_record_plan(self):
+        self.running = []
+        self.record_plan(["db"])
+        self.assertEqual(self.names(self.cache.get(self.host, follow=False)), ["test.db.1"])
+        # The next plan builds on the first
+        self.record_plan(["web"])
+        formation = self.cache.get(self.host, follow=False)
+        self.assertEqual(self.names(formation), ["test.db.1", "test.web.1"])
+        self.assertEqual(formation["test.web.1"].links["db"].name, "test.db.1")
+        self.record_plan(["db"])
+        self.assertEqual(self.names(self.cache.get(self.host, follow=False)), ["test.db.1"])
+        self.assertEqual(self.introspections, 1)
+
+    def check_inherited_formation_caught_up(self, follow):
+        """
+        A forked child applies the events its parent had not got to yet
+        before it uses a formation it inherited.
+        """
+        self.cache.get(self.host)
+        self.cache.after_fork()
+        self.host.events.calls = []
+        self.host.events.missed = [("test.db.1", "die")]
+        self.running = ["web"]
+        formation = self.cache.get(self.host, follow=follow)
+        self.assertEqual(self.host.events.calls[0], ("catch_up", "test"))
+        self.assertEqual(self.names(formation), ["test.web.1"])
+        self.assertEqual(self.introspections, 2)
+
+    def test_inherited_formation_caught_up(self):
+        self.check_inherited_formation_caught_up(follow=False)
+
+    def test_inherited_formation_caught_up_when_following(self):
+        self.check_inherited_formation_caught_up(follow=True)
+        self.assertEqual(self.host.events.calls, [("catch_up", "test"), ("start", "test")])
+
+    def test_inherited_formation_kept(self):
+        self.cache.get(self.host)
+        self.cache.after_fork()
+        self.cache.get(self.host, follow=False)
+        self.cache.get(self.host, follow=False)
+        self.assertEqual(self.introspections, 1)
+        self.assertEqual(self.host.events.calls, [("start", "test"), ("catch_up", "test")])
+
+    def test_inherited_formation_dropped_without_events(self):
+        self.cache.get(self.host)
+        self.cache.after_fork()
+        self.host.events.missed = OSError("Docker went away")
+        self.cache.get(self.host, follow=False)
+        self.assertEqual(self.introspections, 2)
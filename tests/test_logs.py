@@ -0,0 +1,76 @@
+import unittest
+
+from bay.docker.logs import LogStream
+
+
+class FakeResponse:
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """
+    Docker client that gives a log of two chunks, recording its requests.
+    """
+
+    def __init__(self, status=200):
+        self.status = status
+        self.requests = []
+        self.closed = False
+
+    def _url(self, path, *args):
+        return path.format(*args)
+
+    def _get(self, url, params=None, stream=False):
+        self.response = FakeResponse()
+        self.requests.append((url, params, stream))
+        return self.response
+
+    def _get_result(self, container, stream, response):
+        if self.status != 200:
+            raise RuntimeError("No such container")
+        return iter([b"one\n", b"two\n"])
+
+    def _get_raw_response_socket(self, response):
+        raise AttributeError("no socket")
+
+    def close(self):
+        self.closed = True
+
+
+class FakeHost:
+
+    def __init__(self, client):
+        self.client = client
+
+    def make_client(self):
+        return self.client
+
+
+class LogStreamTests(unittest.TestCase):
+
+    def test_open_and_close(self):
+        client = FakeClient()
+        stream = LogStream.open(FakeHost(client), "test.db.1", stderr=False, timestamps=True, since=100)
+        self.assertEqual(client.requests, [(
+            "/containers/test.db.1/logs",
+            {"stdout": 1, "stderr": 0, "timestamps": 1, "follow": 1, "tail": "all", "since": 100},
+            True,
+        )])
+        self.assertIsNone(client.timeout)
+        self.assertEqual(list(stream), [b"one\n", b"two\n"])
+        stream.close()
+        stream.close()
+        self.assertTrue(client.response.closed)
+        self.assertTrue(client.closed)
+
+    def test_failed_open_closes_connection(self):
+        client = FakeClient(status=404)
+        with self.assertRaises(RuntimeError):
+            LogStream.open(FakeHost(client), "test.db.1")
+        self.assertTrue(client.response.closed)
+        self.assertTrue(client.closed)
@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import click
+
+from bay.cli import App, AppGroup
+from bay.plugins.base import BasePlugin
+from bay.plugins.manifest import PluginEntryPoint, PluginManifest
+
+
+@click.command()
+def hello():
+    """
+    Says hello.
+    """
+
+
+@click.command()
+def bye():
+    """
+    Says goodbye.
+    """
+
+
+class GreetPlugin(BasePlugin):
+
+    provides = ["greet"]
+
+    def load(self):
+        self.add_command(hello)
+        self.add_alias(hello, "hi")
+
+
+class ByePlugin(BasePlugin):
+
+    requires = ["greet"]
+
+    def load(self):
+        self.add_command(bye)
+
+
+class PluginManifestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="bay-test-")
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "plugin_manifest.json")
+        patcher = mock.patch.object(App, "plugin_manifest_path", self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.entrypoints = [
+            PluginEntryPoint("greet", __name__, ["GreetPlugin"], "1.0"),
+            PluginEntryPoint("bye", __name__, ["ByePlugin"], "1.0"),
+        ]
+
+    def make_cli(self):
+        with mock.patch.object(PluginEntryPoint, "find_all", return_value=self.entrypoints):
+            cli = AppGroup(App, name="bay")
+            cli.load_plugins()
+        return cli
+
+    def manifest(self):
+        with open(self.path) as fh:
+            return json.load(fh)
+
+    def test_first_run_loads_everything(self):
+        cli = self.make_cli()
+        self.assertEqual(cli.app.loaded_plugins, {"greet", "bye"})
+        self.assertEqual(cli.app.plugin_order, ["greet", "bye"])
+        entries = self.manifest()["entries"]
+        self.assertEqual(entries["greet"]["commands"], {"hello": "Says hello."})
+        self.assertEqual(entries["greet"]["aliases"], {"hi": "hello"})
+        self.assertEqual(entries["bye"]["requires"], ["greet"])
+
+    def test_current_manifest_loads_lazily(self):
+        self.make_cli()
+        cli = self.make_cli()
+        self.assertEqual(cli.app.loaded_plugins, set())
+        command = cli.get_command(click.Context(cli), "bye")
+        self.assertIs(command, bye)
+        # Required plugins come along, nothing else does
+        self.assertEqual(cli.app.loaded_plugins, {"greet", "bye"})
+
+    def test_stale_key_reloads_everything(self):
+        self.make_cli()
+        self.entrypoints[1] = PluginEntryPoint("bye", __name__, ["ByePlugin"], "2.0")
+        cli = self.make_cli()
+        self.assertEqual(cli.app.loaded_plugins, {"greet", "bye"})
+        self.assertEqual(
+            self.manifest()["key"],
+            PluginManifest.key_for(self.entrypoints),
+        )
+
+    def test_stale_entries_reload_everything(self):
+        """
+        A manifest whose key still matches but which says a plugin registers
+        a command it no longer does falls back to loading every plugin, and
+        is removed so the next run rebuilds it.
+        """
+        self.make_cli()
+        data = self.manifest()
+        data["entries"]["greet"]["commands"]["wave"] = "Waves."
+        with open(self.path, "w") as fh:
+            json.dump(data, fh)
+        cli = self.make_cli()
+        self.assertEqual(cli.app.loaded_plugins, set())
+        self.assertIsNone(cli.get_command(click.Context(cli), "wave"))
+        self.assertEqual(cli.app.loaded_plugins, {"greet", "bye"})
+        self.assertNotIn("wave", cli.commands)
+        self.assertFalse(os.path.exists(self.path))
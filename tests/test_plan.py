@@ -0,0 +1,150 @@
+import unittest
+
+from bay.containers.formation import ContainerFormation
+from bay.containers.formation import ContainerInstance
+from bay.docker.events import EventStream
+from bay.docker.plan import PlanAction
+from bay.docker.runner import FormationRunner
+
+from .helpers import FakeApp, FakeClient, FakeHost
+
+
+class ExecutionPlanTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = FakeApp()
+        self.host = FakeHost()
+        self.running = ContainerFormation(self.app.containers)
+        for name in ("db", "web"):
+            self.running.add_container(self.app.containers[name], self.host)
+
+    def plan(self, target, current):
+        return FormationRunner(self.app, self.host, target, self.app.root_task).plan(current)
+
+    def test_nothing_to_do(self):
+        plan = self.plan(self.running.clone(), self.running)
+        self.assertTrue(plan.empty)
+        self.assertEqual(plan.as_dict(), {"host": "default", "noop": True, "actions": []})
+        self.assertEqual(plan.describe(), ["Nothing to do on default."])
+
+    def test_start(self):
+        plan = self.plan(self.running.clone(), ContainerFormation(self.app.containers))
+        self.assertEqual(plan.as_dict(), {
+            "host": "default",
+            "noop": False,
+            "actions": [
+                {"action": "create", "name": "test.db.1", "container": "db", "reason": "not running",
+                 "after": []},
+                {"action": "start", "name": "test.db.1", "container": "db", "reason": "not running",
+                 "after": ["create:test.db.1"]},
+                {"action": "create", "name": "test.web.1", "container": "web", "reason": "not running",
+                 "after": []},
+                {"action": "start", "name": "test.web.1", "container": "web", "reason": "not running",
+                 "after": ["create:test.web.1", "start:test.db.1"]},
+            ],
+        })
+        self.assertEqual(plan.describe(), [
+            "Plan for default:",
+            "  create db                            not running",
+            "  start  db                            not running (after create db)",
+            "  create web                           not running",
+            "  start  web                           not running (after create web, start db)",
+        ])
+
+    def test_recreate_restarts_linkers(self):
+        target = self.running.clone()
+        target["test.db.1"].environment["DEBUG"] = "1"
+        plan = self.plan(target, self.running)
+        self.assertEqual(
+            [(action["action"], action["container"], action["reason"]) for action in plan.as_dict()["actions"]],
+            [
+                ("stop", "web", "links to db"),
+                ("stop", "db", "recreate: environment changed"),
+                ("create", "db", "recreate: environment changed"),
+                ("start", "db", "recreate: environment changed"),
+                ("create", "web", "restart: links to db"),
+                ("start", "web", "restart: links to db"),
+            ],
+        )
+        self.assertEqual(
+            plan.describe()[2],
+            "  stop   db                            recreate: environment changed (after stop web)",
+        )
+        web = plan.instances(PlanAction.START)[1]
+        self.assertEqual(plan.dependencies(PlanAction.START, web), [plan.instances(PlanAction.START)[0]])
+
+    def test_stopped(self):
+        target = ContainerFormation(self.app.containers)
+        target.add_container(self.app.containers["db"], self.host)
+        plan = self.plan(target, self.running)
+        self.assertEqual(plan.as_dict()["actions"], [
+            {"action": "stop", "name": "test.web.1", "container": "web",
+             "reason": "not in the target formation", "after": []},
+        ])
+
+
+class ReusePlanTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = FakeApp()
+        self.host = FakeHost()
+        self.target = ContainerFormation(self.app.containers)
+        self.db = self.target.add_container(self.app.containers["db"], self.host)
+
+    def plan(self, current=None):
+        runner = FormationRunner(self.app, self.host, self.target, self.app.root_task)
+        return runner.plan(current or ContainerFormation(self.app.containers))
+
+    def stopped(self, fingerprint, network="test"):
+        """
+        Puts a stopped container for db on the host, created with the given spec.
+        """
+        self.host.client = FakeClient({
+            "Id": "abc123",
+            "State": {"Running": False},
+            "Config": {"Labels": {
+                ContainerInstance.FINGERPRINT_LABEL: fingerprint,
+                EventStream.NETWORK_LABEL: network,
+            }},
+        })
+
+    def kinds(self, plan):
+        return [(action.kind, action.instance.container.name) for action in plan.actions]
+
+    def test_stopped_container_is_reused(self):
+        self.stopped(self.db.fingerprint())
+        plan = self.plan()
+        self.assertEqual(self.kinds(plan), [("reuse", "db"), ("start", "db")])
+        self.assertEqual(plan.as_dict()["actions"][1]["after"], ["reuse:test.db.1"])
+        self.assertEqual(self.host.client.removed, [])
+
+    def test_changed_spec_is_created(self):
+        self.stopped("old spec")
+        self.assertEqual(self.kinds(self.plan()), [("create", "db"), ("start", "db")])
+
+    def test_other_network_is_created(self):
+        self.stopped(self.db.fingerprint(), network="other")
+        self.assertEqual(self.kinds(self.plan()), [("create", "db"), ("start", "db")])
+
+    def test_reuse_disabled(self):
+        self.app.config["bay"]["reuse_containers"] = False
+        self.stopped(self.db.fingerprint())
+        self.assertEqual(self.kinds(self.plan()), [("create", "db"), ("start", "db")])
+
+    def test_restarted_linker_is_reused(self):
+        """
+        A container only stopped because something it links to is recreated
+        starts again as it is.
+        """
+        web = self.target.add_container(self.app.containers["web"], self.host)
+        current = self.target.clone()
+        current["test.web.1"].recorded_fingerprint = web.fingerprint()
+        self.target["test.db.1"].environment["DEBUG"] = "1"
+        self.assertEqual(self.kinds(self.plan(current)), [
+            ("stop", "web"),
+            ("stop", "db"),
+            ("create", "db"),
+            ("start", "db"),
+            ("reuse", "web"),
+            ("start", "web"),
+        ])
@@ -0,0 +1,134 @@
+import base64
+import io
+import json
+import tarfile
+import unittest
+from unittest import mock
+
+from bay.docker.probe import FileProbe, FileStat
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeClient:
+    """
+    Docker client for containers with the given {(container, path): contents}
+    files, counting the requests made.
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.heads = 0
+        self.archives = 0
+
+    def _url(self, path, *args):
+        return path.format(*args)
+
+    def _raise_for_status(self, response):
+        pass
+
+    def head(self, url, params=None):
+        self.heads += 1
+        container = url.split("/")[2]
+        contents = self.files.get((container, params["path"]))
+        if contents is None:
+            return FakeResponse(404)
+        stat = {"name": params["path"].rsplit("/", 1)[-1], "size": len(contents), "mode": 420, "mtime": "now"}
+        return FakeResponse(200, {
+            "X-Docker-Container-Path-Stat": base64.b64encode(json.dumps(stat).encode("utf8")).decode("ascii"),
+        })
+
+    def get_archive(self, container, path):
+        self.archives += 1
+        contents = self.files[(container, path)].encode("utf8")
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode="w") as archive:
+            member = tarfile.TarInfo(path.rsplit("/", 1)[-1])
+            member.size = len(contents)
+            archive.addfile(member, io.BytesIO(contents))
+        data.seek(0)
+        return data, {}
+
+
+class FakeHost:
+
+    def __init__(self, files):
+        self.client = FakeClient(files)
+
+
+class FileProbeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.host = FakeHost({("test.db.1", "/ready"): "yes"})
+        self.probe = FileProbe(self.host)
+        self.now = 100.0
+        patcher = mock.patch("bay.docker.probe.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stat(self):
+        self.assertEqual(
+            self.probe.stat("test.db.1", "/ready"),
+            FileStat(name="ready", size=3, mode=420, mtime="now"),
+        )
+        self.assertIsNone(self.probe.stat("test.db.1", "/missing"))
+        self.assertTrue(self.probe.exists("test.db.1", "/ready"))
+        self.assertFalse(self.probe.exists("test.db.1", "/missing"))
+
+    def test_stat_cached_for_ttl(self):
+        self.probe.stat("test.db.1", "/ready")
+        self.now += 0.4
+        self.probe.stat("test.db.1", "/ready")
+        self.assertEqual(self.host.client.heads, 1)
+        self.now += 0.1
+        self.probe.stat("test.db.1", "/ready")
+        self.assertEqual(self.host.client.heads, 2)
+
+    def test_missing_cached_for_ttl(self):
+        self.assertFalse(self.probe.exists("test.db.1", "/later"))
+        self.host.client.files[("test.db.1", "/later")] = "now"
+        self.assertFalse(self.probe.exists("test.db.1", "/later"))
+        self.now += 0.5
+        self.assertTrue(self.probe.exists("test.db.1", "/later"))
+        self.assertEqual(self.host.client.heads, 2)
+
+    def test_read(self):
+        self.assertEqual(self.probe.read("test.db.1", "/ready"), "yes")
+        self.assertIsNone(self.probe.read("test.db.1", "/missing"))
+
+    def test_read_downloads_only_changed_files(self):
+        self.probe.read("test.db.1", "/ready")
+        self.now += 1
+        self.assertEqual(self.probe.read("test.db.1", "/ready"), "yes")
+        self.assertEqual(self.host.client.archives, 1)
+        self.host.client.files[("test.db.1", "/ready")] = "no!!"
+        self.now += 1
+        self.assertEqual(self.probe.read("test.db.1", "/ready"), "no!!")
+        self.assertEqual(self.host.client.archives, 2)
+
+    def test_read_skips_big_files(self):
+        self.host.client.files[("test.db.1", "/big")] = "x" * (FileProbe.MAX_READ_SIZE + 1)
+        self.assertIsNone(self.probe.read("test.db.1", "/big"))
+        self.assertEqual(self.host.client.archives, 0)
+
+    def test_caches_bounded(self):
+        self.probe.MAX_ENTRIES = 3
+        for number in range(5):
+            path = "/file{}".format(number)
+            self.host.client.files[("test.db.1", path)] = "x"
+            self.probe.read("test.db.1", path)
+            # Keep the first one in use
+            self.probe.read("test.db.1", "/ready")
+        self.assertEqual(
+            list(self.probe.stats),
+            [("test.db.1", "/file3"), ("test.db.1", "/file4"), ("test.db.1", "/ready")],
+        )
+        self.assertEqual(
+            list(self.probe.contents),
+            [("test.db.1", "/file3"), ("test.db.1", "/file4"), ("test.db.1", "/ready")],
+        )
@@ -0,0 +1,218 @@
+import threading
+import time
+import unittest
+
+from bay.containers.formation import ContainerFormation
+from bay.docker.events import EventStream
+from bay.docker.runner import FormationRunner, changing_containers
+from bay.exceptions import DockerRuntimeError
+from bay.plugins.run import run_formation
+
+from .helpers import FakeApp, FakeClient, FakeHost, quiet
+
+
+class ContainerLockTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = FakeApp()
+        self.app.config["bay"]["lock_timeout"] = 0.1
+        self.host = FakeHost()
+        self.formation = ContainerFormation(self.app.containers)
+        self.instance = self.formation.add_container(self.app.containers["db"], self.host)
+
+    def test_lock_timeout_is_reported_by_run_formation(self):
+        """
+        Another thread holding a container's lock for too long fails the
+        command with a message, not a traceback.
+        """
+        changing_containers.acquire(self.instance.name)
+        try:
+            with quiet() as output:
+                run_formation(self.app, self.host, self.formation, self.app.root_task)
+        finally:
+            changing_containers.release(self.instance.name)
+        self.assertIn("Timed out waiting for another operation on db to finish", output.getvalue())
+
+    def test_lock_timeout_default_allows_for_wait_timeout(self):
+        self.app.config["bay"]["lock_timeout"] = 0
+        self.app.config["bay"]["wait_timeout"] = 600
+        runner = FormationRunner(self.app, self.host, self.formation, self.app.root_task)
+        self.assertEqual(runner.lock_timeout, 600 + FormationRunner.LOCK_MARGIN)
+        self.app.config["bay"]["wait_timeout"] = 0
+        runner = FormationRunner(self.app, self.host, self.formation, self.app.root_task)
+        self.assertIsNone(runner.lock_timeout)
+
+
+class ReusableContainerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = FakeApp()
+        self.host = FakeHost()
+        self.formation = ContainerFormation(self.app.containers)
+        self.instance = self.formation.add_container(self.app.containers["db"], self.host)
+        self.runner = FormationRunner(self.app, self.host, self.formation, self.app.root_task)
+
+    def existing(self, fingerprint="spec", running=False, network_label="test", network_id="net1"):
+        """
+        Puts a container for the instance on the host, launched with the given spec.
+        """
+        labels = {self.instance.LAUNCH_FINGERPRINT_LABEL: fingerprint}
+        if network_label is not None:
+            labels[EventStream.NETWORK_LABEL] = network_label
+        self.host.client = FakeClient({
+            "Id": "abc123",
+            "State": {"Running": running},
+            "Config": {"Labels": labels},
+            "NetworkSettings": {"Networks": {"test": {"NetworkID": network_id}}},
+        })
+
+    def reusable(self):
+        return self.runner.reusable_container(self.instance, "spec", "net1")
+
+    def test_no_container(self):
+        self.host.client = FakeClient()
+        self.assertIsNone(self.reusable())
+        self.assertEqual(self.host.client.removed, [])
+
+    def test_same_spec_reused(self):
+        self.existing()
+        self.assertEqual(self.reusable(), "abc123")
+        self.assertEqual(self.host.client.removed, [])
+
+    def test_fingerprint_mismatch_recreates(self):
+        self.existing(fingerprint="old spec")
+        self.assertIsNone(self.reusable())
+        self.assertEqual(self.host.client.removed, ["test.db.1"])
+
+    def test_missing_network_label_recreates(self):
+        self.existing(network_label=None)
+        self.assertIsNone(self.reusable())
+        self.assertEqual(self.host.client.removed, ["test.db.1"])
+
+    def test_other_network_recreates(self):
+        self.existing(network_id="net0")
+        self.assertIsNone(self.reusable())
+        self.assertEqual(self.host.client.removed, ["test.db.1"])
+
+    def test_plan_said_create(self):
+        self.existing()
+        self.assertIsNone(self.runner.reusable_container(self.instance, "spec", "net1", reuse=False))
+        self.assertEqual(self.host.client.removed, ["test.db.1"])
+
+    def test_reuse_disabled(self):
+        self.runner.reuse_containers = False
+        self.existing()
+        self.assertIsNone(self.reusable())
+        self.assertEqual(self.host.client.removed, ["test.db.1"])
+
+    def test_running_container(self):
+        self.existing(running=True)
+        with self.assertRaises(DockerRuntimeError):
+            self.reusable()
+        self.assertEqual(self.host.client.removed, [])
+
+
+class Named:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+class ParallelExecuteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = FakeApp()
+        self.host = FakeHost()
+        self.instances = {name: Named(name) for name in "abcdxy"}
+        self.lock = threading.Lock()
+        self.started = []
+        self.running = 0
+        self.max_running = 0
+
+    def execute(self, edges, names, concurrency=4, work=None, done=()):
+        """
+        Runs parallel_execute over the named instances with the given
+        {name: [dependency names]} edges, and work(name) as the executor.
+        """
+        self.app.config["bay"]["runner_concurrency"] = concurrency
+        runner = FormationRunner(self.app, self.host, ContainerFormation(self.app.containers), self.app.root_task)
+
+        def executor(instance):
+            with self.lock:
+                self.started.append(instance.name)
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            try:
+                if work is not None:
+                    work(instance.name)
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+        runner.parallel_execute(
+            [self.instances[name] for name in names],
+            lambda instance: [self.instances[name] for name in edges.get(instance.name, [])],
+            executor,
+            done=[self.instances[name] for name in done],
+        )
+
+    def test_diamond(self):
+        edges = {"b": ["a"], "c": ["a"], "d": ["b", "c"]}
+        self.execute(edges, "abcd", work=lambda name: time.sleep(0.01))
+        self.assertEqual(self.started[0], "a")
+        self.assertEqual(sorted(self.started[1:3]), ["b", "c"])
+        self.assertEqual(self.started[3], "d")
+
+    def test_dependents_released_as_soon_as_ready(self):
+        """
+        "x" starts once "a" finishes, without waiting for the unrelated "b".
+        """
+        x_started = threading.Event()
+
+        def work(name):
+            if name == "b":
+                self.assertTrue(x_started.wait(5), "x waited for b")
+            elif name == "x":
+                x_started.set()
+
+        self.execute({"x": ["a"]}, "abx", work=work)
+        self.assertEqual(sorted(self.started), ["a", "b", "x"])
+
+    def test_already_done(self):
+        self.execute({"x": ["a"]}, "x", done="a")
+        self.assertEqual(self.started, ["x"])
+
+    def test_concurrency_cap(self):
+        self.execute({}, "abcd", concurrency=1, work=lambda name: time.sleep(0.01))
+        self.assertEqual(self.max_running, 1)
+        self.assertEqual(sorted(self.started), ["a", "b", "c", "d"])
+
+    def test_runs_in_parallel(self):
+        barrier = threading.Barrier(3, timeout=5)
+        self.execute({}, "abc", concurrency=3, work=lambda name: barrier.wait())
+        self.assertEqual(self.max_running, 3)
+
+    def test_unsatisfiable_dependency(self):
+        with self.assertRaises(DockerRuntimeError) as context:
+            self.execute({"x": ["d"], "y": ["x"]}, "axy")
+        self.assertEqual(str(context.exception), "Deadlock: Cannot run any of x, y - they wait on d, x.")
+        self.assertEqual(self.started, ["a"])
+
+    def test_cycle(self):
+        with self.assertRaises(DockerRuntimeError) as context:
+            self.execute({"x": ["y"], "y": ["x"], "b": ["a"]}, "abxy")
+        self.assertEqual(str(context.exception), "Deadlock: Cannot run any of x, y - they wait on x, y.")
+        self.assertEqual(self.started, ["a", "b"])
+
+    def test_failure_raised(self):
+        def work(name):
+            if name == "a":
+                raise DockerRuntimeError("a failed")
+
+        with self.assertRaises(DockerRuntimeError) as context:
+            self.execute({"x": ["a"]}, "ax", work=work)
+        self.assertEqual(str(context.exception), "a failed")
+        self.assertEqual(self.started, ["a"])
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from bay.containers.container import ContainerSource
+from bay.containers.graph import ContainerGraph
+from bay.containers.snapshot import GraphSnapshot
+
+from .helpers import make_library
+
+
+class GraphSnapshotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.library = make_library()
+        self.addCleanup(shutil.rmtree, self.library)
+        self.snapshot_dir = tempfile.mkdtemp(prefix="bay-test-")
+        self.addCleanup(shutil.rmtree, self.snapshot_dir)
+        self.snapshot_path = os.path.join(self.snapshot_dir, "{prefix}", "graph.snapshot")
+        self.load()
+
+    def load(self):
+        """
+        Loads the graph, returning it and the names of the container
+        directories that had to be read from disk.
+        """
+        read = []
+        from_directory = ContainerSource.from_directory
+
+        def reading(path):
+            read.append(os.path.basename(path))
+            return from_directory(path)
+
+        with mock.patch.object(ContainerSource, "from_directory", side_effect=reading):
+            graph = ContainerGraph(self.library, snapshot_path=self.snapshot_path)
+        return graph, sorted(read)
+
+    def path(self, name):
+        return os.path.join(self.library, name)
+
+    def rewrite(self, name, contents, keep_mtime=False, new_inode=False):
+        """
+        Rewrites a file, optionally keeping its mtime or giving it a new inode.
+        """
+        path = self.path(name)
+        stat = os.stat(path)
+        if new_inode:
+            with open(path + ".new", "w") as fh:
+                fh.write(contents)
+            os.replace(path + ".new", path)
+        else:
+            with open(path, "w") as fh:
+                fh.write(contents)
+        if keep_mtime:
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    def test_snapshot_written(self):
+        self.assertTrue(os.path.isfile(os.path.join(self.snapshot_dir, "test", "graph.snapshot")))
+
+    def test_unchanged_library_not_reread(self):
+        graph, read = self.load()
+        self.assertEqual(read, [])
+        self.assertEqual(graph["web"].environment, {"MODE": "web"})
+        self.assertEqual(graph.dependencies(graph["web"]), {graph["db"]})
+
+    def test_mtime_change(self):
+        stat = os.stat(self.path("web/bay.yaml"))
+        os.utime(self.path("web/bay.yaml"), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        _, read = self.load()
+        self.assertEqual(read, ["web"])
+
+    def test_size_change(self):
+        self.rewrite("web/bay.yaml", "links: [db]\nenvironment: {MODE: webby}\n", keep_mtime=True)
+        graph, read = self.load()
+        self.assertEqual(read, ["web"])
+        self.assertEqual(graph["web"].environment, {"MODE": "webby"})
+
+    def test_inode_change(self):
+        # Same size and mtime; only the inode gives it away
+        self.rewrite("web/bay.yaml", "links: [db]\nenvironment: {MODE: Web}\n", keep_mtime=True, new_inode=True)
+        graph, read = self.load()
+        self.assertEqual(read, ["web"])
+        self.assertEqual(graph["web"].environment, {"MODE": "Web"})
+
+    def test_new_container(self):
+        os.makedirs(self.path("cache"))
+        with open(self.path("cache/Dockerfile"), "w") as fh:
+            fh.write("FROM scratch\n")
+        graph, read = self.load()
+        self.assertEqual(read, ["cache"])
+        self.assertEqual(sorted(graph.containers), ["cache", "db", "web"])
+
+    def test_removed_directories_dropped(self):
+        shutil.rmtree(self.path("db"))
+        with open(self.path("web/bay.yaml"), "w") as fh:
+            fh.write("environment: {MODE: web}\n")
+        self.load()
+        snapshot = GraphSnapshot(os.path.join(self.snapshot_dir, "test", "graph.snapshot"))
+        snapshot.load()
+        self.assertEqual(sorted(os.path.basename(path) for path in snapshot.sources), ["web"])
+
+    def test_corrupt_snapshot_ignored(self):
+        with open(os.path.join(self.snapshot_dir, "test", "graph.snapshot"), "wb") as fh:
+            fh.write(b"not a pickle")
+        with self.assertLogs("bay.containers.snapshot", "DEBUG") as logs:
+            graph, read = self.load()
+        self.assertIn("Ignoring unreadable graph snapshot", logs.output[0])
+        self.assertEqual(read, ["db", "web"])
+        self.assertEqual(sorted(graph.containers), ["db", "web"])
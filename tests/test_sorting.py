@@ -0,0 +1,96 @@
+import random
+import unittest
+
+from bay.utils.sorting import _find_cycle, dependency_levels, dependency_sort
+
+
+def pass_sort(initial, dependencies):
+    """
+    The original dependency_sort: passes over the remaining nodes in sorted
+    order until all are taken.
+    """
+    mapping = {}
+    pending = list(initial)
+    while pending:
+        current = pending.pop(0)
+        mapping[current] = [x for x in dependencies(current) if x is not None]
+        for dep in mapping[current]:
+            if dep not in pending and dep not in mapping:
+                pending.append(dep)
+    result = []
+    while mapping:
+        for node, deps in sorted(mapping.items()):
+            if all(dep in result for dep in deps):
+                result.append(node)
+                del mapping[node]
+    return result
+
+
+class DependencySortTests(unittest.TestCase):
+
+    graph = {
+        "a": [],
+        "b": ["a"],
+        "c": [],
+        "d": ["c"],
+        "e": ["b", "d"],
+    }
+
+    def test_levels(self):
+        self.assertEqual(
+            dependency_levels(["e"], self.graph.get),
+            [["a", "c"], ["b", "d"], ["e"]],
+        )
+
+    def test_levels_only_include_what_is_reachable(self):
+        self.assertEqual(dependency_levels(["b"], self.graph.get), [["a"], ["b"]])
+
+    def test_sort_takes_dependents_in_the_same_pass(self):
+        """
+        "b" comes straight after "a" rather than waiting for the next level,
+        as plugins have always been ordered.
+        """
+        self.assertEqual(dependency_sort(["e"], self.graph.get), ["a", "b", "c", "d", "e"])
+
+    def test_sort_matches_passes(self):
+        rng = random.Random(42)
+        for _ in range(200):
+            nodes = list(range(rng.randint(1, 15)))
+            # Only depend on earlier nodes in a shuffled order, so there is no cycle
+            order = nodes[:]
+            rng.shuffle(order)
+            graph = {
+                node: rng.sample(order[:index], rng.randint(0, min(3, index)))
+                for index, node in enumerate(order)
+            }
+            self.assertEqual(dependency_sort(nodes, graph.get), pass_sort(nodes, graph.get), graph)
+
+    def test_ignores_none(self):
+        self.assertEqual(dependency_sort(["b"], {"a": [None], "b": ["a", None]}.get), ["a", "b"])
+
+    def test_cycle(self):
+        graph = {"a": ["b"], "b": ["c"], "c": ["b"], "d": []}
+        with self.assertRaises(ValueError) as context:
+            dependency_levels(["a", "d"], graph.get)
+        self.assertIn("Circular dependency detected between: ", str(context.exception))
+        cycle = str(context.exception).split(": ", 1)[1].split(", ")
+        self.assertEqual(sorted(cycle), ["b", "c"])
+        with self.assertRaises(ValueError):
+            dependency_sort(["a"], graph.get)
+
+
+class FindCycleTests(unittest.TestCase):
+
+    def test_self_dependency(self):
+        self.assertEqual(_find_cycle({"a": {"a"}}, {"a"}), ["a"])
+
+    def test_returns_only_the_cycle(self):
+        """
+        Nodes leading into the cycle are left out.
+        """
+        mapping = {"a": {"b"}, "b": {"c"}, "c": {"d"}, "d": {"b"}}
+        cycle = _find_cycle(mapping, {"a": 1, "b": 1, "c": 1, "d": 1})
+        self.assertEqual(sorted(cycle), ["b", "c", "d"])
+        # In dependency order around the loop
+        for node, dep in zip(cycle, cycle[1:] + cycle[:1]):
+            self.assertIn(dep, mapping[node])
@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+
+from bay.utils.threading import KeyedLock
+
+
+class KeyedLockTests(unittest.TestCase):
+
+    def setUp(self):
+        self.locks = KeyedLock()
+
+    def hold(self, key, seconds):
+        """
+        Holds the key's lock from another thread for a while. Returns once it is held.
+        """
+        held = threading.Event()
+
+        def holder():
+            with self.locks.lock(key):
+                held.set()
+                time.sleep(seconds)
+
+        thread = threading.Thread(target=holder)
+        thread.start()
+        self.addCleanup(thread.join)
+        held.wait()
+        return thread
+
+    def test_exclusive_per_key(self):
+        self.hold("db", 0.2)
+        started = time.monotonic()
+        with self.locks.lock("db"):
+            self.assertGreaterEqual(time.monotonic() - started, 0.15)
+
+    def test_keys_independent(self):
+        self.hold("db", 0.5)
+        started = time.monotonic()
+        with self.locks.lock("web", timeout=0.4):
+            pass
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(self.locks.held, {"db"})
+
+    def test_timeout(self):
+        self.hold("db", 0.5)
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            self.locks.acquire("db", timeout=0.1)
+        self.assertLess(time.monotonic() - started, 0.4)
+        stats = self.locks.contended()["db"]
+        self.assertEqual(stats["contended"], 1)
+        self.assertGreaterEqual(stats["max_wait"], 0.1)
+
+    def test_contended_stats(self):
+        thread = self.hold("db", 0.1)
+        with self.locks.lock("db"):
+            pass
+        with self.locks.lock("web"):
+            pass
+        thread.join()
+        stats = self.locks.contended()
+        self.assertEqual(list(stats), ["db"])
+        self.assertEqual(stats["db"]["acquired"], 2)
+        self.assertEqual(stats["db"]["contended"], 1)
+        self.assertGreater(stats["db"]["waited"], 0)
+        self.assertEqual(stats["db"]["waited"], stats["db"]["max_wait"])
+
+    def test_released_keys_forgotten(self):
+        for number in range(100):
+            with self.locks.lock(("test.db.1", "/file{}".format(number))):
+                pass
+        self.assertEqual(self.locks.held, set())
+        self.assertEqual(self.locks.stats, {})
@@ -0,0 +1,103 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from bay.cli.timings import Timings
+
+
+class TimingsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch("bay.cli.timings.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.timings = Timings(start=self.now)
+
+    def record(self):
+        """
+        Records a command with nested phases, a repeated phase and a note.
+        """
+        with self.timings.phase("load_config"):
+            self.now += 0.01
+            with self.timings.phase("graph"):
+                self.now += 0.03
+            with self.timings.phase("graph"):
+                self.now += 0.02
+        with self.timings.phase("command up"):
+            self.now += 0.04
+        self.timings.note("lock db: waited 1 times, 5.0ms total")
+        self.now += 0.1
+
+    def test_phases(self):
+        self.record()
+        data = self.timings.as_dict()
+        self.assertAlmostEqual(data["total"], 0.2)
+        self.assertEqual(
+            [(record["name"], record["depth"]) for record in data["phases"]],
+            [("load_config", 0), ("graph", 1), ("graph", 1), ("command up", 0)],
+        )
+        load_config, graph, graph_again, command = data["phases"]
+        self.assertAlmostEqual(load_config["duration"], 0.06)
+        # Time in nested phases adds up
+        self.assertAlmostEqual(load_config["nested"], 0.05)
+        self.assertAlmostEqual(graph["start"], 0.01)
+        self.assertAlmostEqual(graph_again["duration"], 0.02)
+        self.assertAlmostEqual(command["start"], 0.06)
+        self.assertEqual(data["notes"], ["lock db: waited 1 times, 5.0ms total"])
+
+    def test_unfinished_phases_left_out(self):
+        with self.timings.phase("command run"):
+            self.assertEqual(self.timings.as_dict()["phases"], [])
+
+    def test_threads_nest_separately(self):
+        def boot():
+            with self.timings.phase("boot db"):
+                pass
+
+        with self.timings.phase("start containers"):
+            thread = threading.Thread(target=boot, name="worker")
+            thread.start()
+            thread.join()
+        self.assertEqual(
+            [(record["name"], record["depth"], record["thread"]) for record in self.timings.phases],
+            [("start containers", 0, "MainThread"), ("boot db", 0, "worker")],
+        )
+
+    def test_report(self):
+        self.timings.enabled = True
+        self.record()
+        output = io.StringIO()
+        with contextlib.redirect_stderr(output):
+            self.timings.report()
+        lines = output.getvalue().splitlines()
+        self.assertIn("PHASE", lines[0])
+        self.assertEqual(lines[1].split(), ["load_config", "60.0", "10.0", "30.0"])
+        self.assertEqual(lines[2].split(), ["graph", "30.0", "30.0", "15.0"])
+        self.assertTrue(lines[2].startswith("  graph"))
+        self.assertEqual(lines[4].split(), ["command", "up", "40.0", "40.0", "20.0"])
+        self.assertEqual(lines[5].split(), ["total", "200.0"])
+        self.assertEqual(lines[6], "lock db: waited 1 times, 5.0ms total")
+
+    def test_json(self):
+        directory = tempfile.mkdtemp(prefix="bay-test-")
+        self.addCleanup(shutil.rmtree, directory)
+        self.timings.json_path = os.path.join(directory, "timings.json")
+        self.record()
+        output = io.StringIO()
+        with contextlib.redirect_stderr(output):
+            self.timings.report()
+        # Only the JSON, as the report itself is not enabled
+        self.assertEqual(output.getvalue(), "")
+        with open(self.timings.json_path) as fh:
+            data = json.load(fh)
+        self.assertEqual(sorted(data), ["notes", "phases", "total"])
+        self.assertEqual(sorted(data["phases"][1]), ["depth", "duration", "name", "nested", "start", "thread"])
+        self.assertEqual(data["phases"][1]["name"], "graph")
+        self.assertEqual(data["notes"], ["lock db: waited 1 times, 5.0ms total"])
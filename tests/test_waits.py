@@ -0,0 +1,282 @@
+import os
+import socket
+import subprocess
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+from bay.docker.readiness import ReadinessEngine
+from bay.exceptions import DockerRuntimeError
+from bay.plugins.waits import HealthyWait, HttpWait, LogWait, TcpWait, WaitsPlugin
+
+
+STARTED_AT = "2020-01-01T10:00:00.000000000Z"
+
+
+class FakeClient:
+
+    def inspect_container(self, name):
+        return {"State": {"StartedAt": STARTED_AT}}
+
+
+class FakeHost:
+
+    client = FakeClient()
+
+
+class FakeContainer:
+
+    name = "db"
+
+
+class FakeInstance:
+
+    name = "test.db.1"
+    container = FakeContainer()
+
+
+class FakeLogStream:
+    """
+    A log stream that yields some lines and then drops.
+    """
+
+    def __init__(self, lines):
+        self.chunks = [line.encode("utf8") + b"\n" for line in lines]
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        pass
+
+
+class LogWaitTests(unittest.TestCase):
+
+    first = "2020-01-01T10:00:01.100000000Z ready"
+    second = "2020-01-01T10:00:01.200000000Z other"
+    third = "2020-01-01T10:00:01.300000000Z ready"
+
+    def follow(self, wait, lines):
+        """
+        Follows the log once, over a stream with the given lines, and waits for it to end.
+        """
+        done = threading.Event()
+        wait.wakers.append(done.set)
+        with mock.patch("bay.plugins.waits.LogStream.open", return_value=FakeLogStream(lines)) as opened:
+            wait.follow()
+        self.assertTrue(done.wait(5))
+        return opened
+
+    def test_resumed_stream_does_not_recount_lines(self):
+        wait = LogWait(FakeInstance(), FakeHost(), "ready", count=2)
+        self.follow(wait, [self.first, self.second])
+        self.assertFalse(wait.matched.is_set())
+        self.assertEqual(wait.matches, 1)
+        # Following again from the same second replays the lines already seen
+        opened = self.follow(wait, [self.first, self.second])
+        self.assertEqual(opened.call_args[1]["since"], 1577872800)
+        self.assertFalse(wait.matched.is_set())
+        self.assertEqual(wait.matches, 1)
+        # Only the new line counts
+        self.follow(wait, [self.first, self.second, self.third])
+        self.assertTrue(wait.matched.is_set())
+        self.assertEqual(wait.matches, 2)
+
+    def test_failed_follow_is_retried(self):
+        """
+        Failing to open the log (e.g. before Docker has it) is retried,
+        not an error that fails the boot.
+        """
+        wait = LogWait(FakeInstance(), EventHost("healthy"), "ready")
+        stream = FakeLogStream([self.first])
+        failure = requests.exceptions.ConnectionError("Connection refused")
+        with mock.patch("bay.plugins.waits.LogStream.open", side_effect=[failure, stream]) as opened:
+            ReadinessEngine(timeout=5).wait(wait.host, wait.instance, [(wait, None)])
+        self.assertEqual(opened.call_count, 2)
+        self.assertTrue(wait.matched.is_set())
+
+    def test_lines_before_start_are_ignored(self):
+        wait = LogWait(FakeInstance(), FakeHost(), "ready")
+        self.follow(wait, ["2020-01-01T09:59:59.900000000Z ready", self.second])
+        self.assertFalse(wait.matched.is_set())
+        self.follow(wait, [self.second, self.third])
+        self.assertTrue(wait.matched.is_set())
+
+
+@unittest.skipUnless(os.path.exists("/proc/net/tcp"), "needs /proc/net/tcp")
+class TcpHealthcheckTests(unittest.TestCase):
+    """
+    Runs the healthcheck command with plain sh, as Docker's CMD-SHELL does.
+    """
+
+    def listen(self, family, address):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.bind((address, 0))
+        sock.listen(1)
+        return sock.getsockname()[1]
+
+    def check(self, port):
+        command = TcpWait(FakeInstance(), FakeHost(), port=port).healthcheck_command()
+        return subprocess.call(["sh", "-c", command]) == 0
+
+    def test_listening_port(self):
+        self.assertTrue(self.check(self.listen(socket.AF_INET, "127.0.0.1")))
+
+    @unittest.skipUnless(socket.has_ipv6 and os.path.exists("/proc/net/tcp6"), "needs IPv6")
+    def test_listening_ipv6_port(self):
+        try:
+            port = self.listen(socket.AF_INET6, "::1")
+        except OSError:
+            self.skipTest("no IPv6 loopback")
+        self.assertTrue(self.check(port))
+
+    def test_closed_port(self):
+        # Bound but not listening, so nothing else can take the port meanwhile
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.bind(("127.0.0.1", 0))
+        self.assertFalse(self.check(sock.getsockname()[1]))
+
+
+class HealthcheckContainer:
+
+    name = "web"
+    synthesize_healthcheck = True
+
+
+class HealthcheckInstance:
+
+    name = "test.web.1"
+    container = HealthcheckContainer()
+    healthcheck = None
+
+
+class SynthesizedHealthcheckTests(unittest.TestCase):
+
+    def healthcheck(self, waits):
+        """
+        Returns the healthcheck command pre_start makes from the waits.
+        """
+        instance = HealthcheckInstance()
+        plugin = WaitsPlugin(app=None)
+        plugin.build_waits = lambda host, instance: [(wait(instance, host), None) for wait in waits]
+        plugin.pre_start(FakeHost(), instance, task=None)
+        return instance.healthcheck and instance.healthcheck["Test"][1]
+
+    def test_http(self):
+        command = self.healthcheck([lambda instance, host: HttpWait(instance, host, port=8080, path="/health")])
+        self.assertIn("curl -fsSk -o /dev/null -X GET http://127.0.0.1:8080/health", command)
+
+    def test_http_with_other_codes_not_synthesized(self):
+        """
+        curl and wget can't check for e.g. a 401, so the wait stays with bay
+        rather than the healthcheck never passing.
+        """
+        wait = HttpWait(HealthcheckInstance(), FakeHost(), port=8080, expected_codes=[200, 401])
+        self.assertIsNone(wait.healthcheck_command())
+        self.assertFalse(WaitsPlugin.runs_as_healthcheck(wait))
+        command = self.healthcheck([
+            lambda instance, host: HttpWait(instance, host, port=8080, expected_codes=[401]),
+            lambda instance, host: TcpWait(instance, host, port=5432),
+        ])
+        self.assertNotIn("curl", command)
+        self.assertIn(":1538 ", command)
+        self.assertIsNone(self.healthcheck([
+            lambda instance, host: HttpWait(instance, host, port=8080, expected_codes=[401]),
+        ]))
+
+
+class FakeEvents:
+    """
+    An event stream whose health status the test sets.
+    """
+
+    started = True
+
+    def __init__(self, health):
+        self.health = health
+        self.listeners = []
+
+    def state(self, name):
+        return {"running": True, "exited": False, "health": self.health, "exit_code": None}
+
+    def set_health(self, host, name, health):
+        self.health = health
+        for listener in list(self.listeners):
+            listener(host, name, "health_status: {}".format(health))
+
+
+class EventHost:
+
+    alias = "default"
+    client = FakeClient()
+
+    def __init__(self, health):
+        self.events = FakeEvents(health)
+
+
+class HealthyWaitTests(unittest.TestCase):
+
+    def test_ready(self):
+        host = EventHost("starting")
+        wait = HealthyWait(FakeInstance(), host)
+        self.assertFalse(wait.ready())
+        host.events.health = "healthy"
+        self.assertTrue(wait.ready())
+        host.events.health = "unhealthy"
+        with self.assertRaises(DockerRuntimeError):
+            wait.ready()
+
+    def test_unhealthy_fails_fast(self):
+        host = EventHost("starting")
+        instance = FakeInstance()
+        timer = threading.Timer(0.2, host.events.set_health, (host, instance.name, "unhealthy"))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        started = time.monotonic()
+        with self.assertRaises(DockerRuntimeError) as context:
+            ReadinessEngine(timeout=30).wait(host, instance, [(HealthyWait(instance, host), None)])
+        self.assertIn("unhealthy", str(context.exception))
+        self.assertLess(time.monotonic() - started, 5)
+
+
+class ReadyAfter:
+    """
+    A wait that passes a set time after it is first checked.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.first_checked = None
+
+    def ready(self):
+        if self.first_checked is None:
+            self.first_checked = time.monotonic()
+        return time.monotonic() - self.first_checked >= self.seconds
+
+    def description(self):
+        return "{}s".format(self.seconds)
+
+
+class ReadinessEngineTests(unittest.TestCase):
+
+    def test_timeout_counts_from_each_wait(self):
+        """
+        Waiting for a container later on gets the whole timeout, not what is
+        left of it since the engine first started.
+        """
+        host = EventHost("healthy")
+        engine = ReadinessEngine(timeout=0.5)
+        engine.wait(host, FakeInstance(), [(ReadyAfter(0), None)])
+        time.sleep(0.6)
+        engine.wait(host, FakeInstance(), [(ReadyAfter(0.1), None)])
+
+    def test_timeout(self):
+        host = EventHost("healthy")
+        with self.assertRaises(DockerRuntimeError) as context:
+            ReadinessEngine(timeout=0.2).wait(host, FakeInstance(), [(ReadyAfter(5), None)])
+        self.assertIn("Timed out after 0.2s waiting for db to be ready (5s)", str(context.exception))